@@ -1,4 +1,8 @@
 from .fhir_parser import FHIRParser
+from .fhir_resources import ClinicalBatch
 from .csv_reader import CSVReader
+from .manifest import FileManifest
+from .ndjson_reader import NDJSONReader
+from .patient_cache import PatientCache
 
-__all__ = ['FHIRParser', 'CSVReader']
\ No newline at end of file
+__all__ = ['FHIRParser', 'ClinicalBatch', 'CSVReader', 'FileManifest', 'NDJSONReader', 'PatientCache']
\ No newline at end of file
@@ -0,0 +1,67 @@
+import bz2
+import gzip
+import io
+import lzma
+from pathlib import Path
+from typing import IO, List
+
+# Compressed file suffix -> opener; all support streaming decompression
+COMPRESSION_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def is_compressed(file_path: Path) -> bool:
+    """True if the file has a supported compression suffix"""
+    return Path(file_path).suffix in COMPRESSION_OPENERS
+
+
+def base_name(file_path: Path) -> str:
+    """File name without its compression suffix (e.g. 'Patient.ndjson' for 'Patient.ndjson.gz')"""
+    file_path = Path(file_path)
+    return file_path.stem if is_compressed(file_path) else file_path.name
+
+
+def open_input(file_path: Path, mode: str = 'r', data: bytes = None) -> IO:
+    """
+    Open a plain or compressed input file, decompressing on the fly
+    data: the file's raw bytes, if they were already read (the file is then not opened again)
+    """
+    file_path = Path(file_path)
+    opener = COMPRESSION_OPENERS.get(file_path.suffix)
+    source = file_path if data is None else io.BytesIO(data)
+
+    if opener is None:
+        if data is None:
+            return open(file_path, mode)
+        return source if 'b' in mode else io.TextIOWrapper(source)
+
+    # Compressed openers default to binary; ask for text explicitly
+    if 'b' not in mode and 't' not in mode:
+        mode += 't'
+    return opener(source, mode)
+
+
+def glob_inputs(directory: Path, pattern: str) -> List[Path]:
+    """Sorted files matching pattern (e.g. '*.json') plus their compressed variants"""
+    directory = Path(directory)
+    files = set(directory.glob(pattern))
+    for suffix in COMPRESSION_OPENERS:
+        files.update(directory.glob(pattern + suffix))
+    return sorted(files)
+
+
+def resolve_input(directory: Path, file_name: str) -> Path:
+    """Path of file_name in directory, falling back to a compressed variant if only that exists"""
+    file_path = Path(directory) / file_name
+    if file_path.exists():
+        return file_path
+
+    for suffix in COMPRESSION_OPENERS:
+        compressed = file_path.with_name(file_name + suffix)
+        if compressed.exists():
+            return compressed
+
+    return file_path
@@ -1,39 +1,73 @@
 import pandas as pd
 from pathlib import Path
-from typing import List, Dict
-from utils import setup_logger
+from typing import List, Dict, Iterator
+from etl.records import LabResult
+from utils import setup_logger, concat_frames
+from .compression import resolve_input
 
 logger = setup_logger(__name__)
 
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Explicit column types for chunked reads (categoricals keep repeated strings as int codes)
+LAB_RESULT_DTYPES = {
+    'patient_id': 'object',
+    'test_type': 'category',
+    'value': 'float32',
+    'reference_range': 'category',
+    'status': 'category'
+}
+LAB_RESULT_DATES = ['test_datetime']
+
+APPOINTMENT_DTYPES = {
+    'patient_id': 'object',
+    'appointment_type': 'category',
+    'provider': 'category',
+    'status': 'category'
+}
+APPOINTMENT_DATES = ['appointment_date']
+
+CONDITION_DTYPES = {
+    'patient_id': 'object',
+    'condition': 'category'
+}
+
 class CSVReader:
-    """Read CSV files (lab results, appointments, conditions)"""
+    """Read CSV files (lab results, appointments, conditions), plain or .gz/.bz2/.xz compressed"""
     
     def __init__(self, data_dir: str = "data/raw"):
+        # CSVs are always read in full: they hold the lab/condition context of every patient, so
+        # incremental runs pick out new rows by hash (FileManifest.new_rows) instead of skipping files
         self.data_dir = Path(data_dir)
+        # Failed reads so far (a run with failed reads has incomplete lab/condition context)
+        self.read_errors = 0
     
-    def read_lab_results(self) -> List[Dict]:
-        """Read lab results CSV"""
-        file_path = self.data_dir / "lab_results.csv"
-        
+    def read_lab_results(self, compact: bool = False) -> List[Dict]:
+        """Read lab results CSV (as slotted LabResult records if compact)"""
+        file_path = resolve_input(self.data_dir, "lab_results.csv")
         try:
             df = pd.read_csv(file_path)
             logger.info(f"Loaded {len(df)} lab results from {file_path}")
             
+            if compact:
+                return LabResult.from_frame(df)
+            
             # Convert to list of dicts
             records = df.to_dict('records')
             return records
             
         except FileNotFoundError:
             logger.error(f"File not found: {file_path}")
+            self.read_errors += 1
             return []
         except Exception as e:
             logger.error(f"Error reading lab results: {e}")
+            self.read_errors += 1
             return []
     
     def read_appointments(self) -> List[Dict]:
         """Read appointments CSV"""
-        file_path = self.data_dir / "appointments.csv"
-        
+        file_path = resolve_input(self.data_dir, "appointments.csv")
         try:
             df = pd.read_csv(file_path)
             logger.info(f"Loaded {len(df)} appointments from {file_path}")
@@ -41,15 +75,16 @@ class CSVReader:
             
         except FileNotFoundError:
             logger.error(f"File not found: {file_path}")
+            self.read_errors += 1
             return []
         except Exception as e:
             logger.error(f"Error reading appointments: {e}")
+            self.read_errors += 1
             return []
     
     def read_conditions(self) -> List[Dict]:
         """Read conditions CSV"""
-        file_path = self.data_dir / "conditions.csv"
-        
+        file_path = resolve_input(self.data_dir, "conditions.csv")
         try:
             df = pd.read_csv(file_path)
             logger.info(f"Loaded {len(df)} conditions from {file_path}")
@@ -60,4 +95,55 @@ class CSVReader:
             return []
         except Exception as e:
             logger.error(f"Error reading conditions: {e}")
-            return []
\ No newline at end of file
+            self.read_errors += 1
+            return []
+    
+    def iter_lab_results(self, chunksize: int = DEFAULT_CHUNK_SIZE, typed: bool = True) -> Iterator[pd.DataFrame]:
+        """Stream lab results CSV as typed DataFrame chunks (untyped: parsed like read_lab_results)"""
+        if not typed:
+            return self._iter_csv("lab_results.csv", "lab results", None, None, chunksize)
+        return self._iter_csv("lab_results.csv", "lab results", LAB_RESULT_DTYPES,
+                              LAB_RESULT_DATES, chunksize)
+    
+    def iter_appointments(self, chunksize: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Stream appointments CSV as typed DataFrame chunks"""
+        return self._iter_csv("appointments.csv", "appointments", APPOINTMENT_DTYPES,
+                              APPOINTMENT_DATES, chunksize)
+    
+    def iter_conditions(self, chunksize: int = DEFAULT_CHUNK_SIZE, typed: bool = True) -> Iterator[pd.DataFrame]:
+        """Stream conditions CSV as typed DataFrame chunks (untyped: parsed like read_conditions)"""
+        return self._iter_csv("conditions.csv", "conditions", CONDITION_DTYPES if typed else None,
+                              [] if typed else None, chunksize, optional=True)
+    
+    def read_lab_results_frame(self) -> pd.DataFrame:
+        """Read lab results CSV as a single typed DataFrame"""
+        return concat_frames(list(self.iter_lab_results()), list(LAB_RESULT_DTYPES) + LAB_RESULT_DATES)
+    
+    def read_conditions_frame(self) -> pd.DataFrame:
+        """Read conditions CSV as a single typed DataFrame"""
+        return concat_frames(list(self.iter_conditions()), list(CONDITION_DTYPES))
+    
+    def _iter_csv(self, file_name: str, label: str, dtypes: Dict, date_columns: List[str],
+                  chunksize: int, optional: bool = False) -> Iterator[pd.DataFrame]:
+        """Yield typed chunks of a CSV file (types inferred if dtypes is None), logging errors like the list readers"""
+        file_path = resolve_input(self.data_dir, file_name)
+        total = 0
+        
+        try:
+            with pd.read_csv(file_path, dtype=dtypes, parse_dates=date_columns,
+                             chunksize=chunksize) as reader:
+                for chunk in reader:
+                    total += len(chunk)
+                    yield chunk
+            
+            logger.info(f"Streamed {total} {label} from {file_path}")
+            
+        except FileNotFoundError:
+            if optional:
+                logger.warning(f"File not found: {file_path} (this is optional)")
+            else:
+                logger.error(f"File not found: {file_path}")
+                self.read_errors += 1
+        except Exception as e:
+            logger.error(f"Error reading {label} after {total} rows: {e}")
+            self.read_errors += 1
@@ -1,52 +1,176 @@
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+from etl.records import Patient
 from utils import setup_logger
+from .compression import glob_inputs, open_input
+from .fhir_stream import iter_bundle_items, read_patient_resource
+from .fhir_resources import ClinicalBatch, reference_id
+from .manifest import FileManifest, content_digest
+from .patient_cache import PatientCache
 
 logger = setup_logger(__name__)
 
+# (result, log level, message) returned by per-file workers
+FileResult = Tuple[Optional[Dict], Optional[str], Optional[str]]
+
 class FHIRParser:
-    """Parse FHIR JSON patient files"""
+    """Parse FHIR JSON patient files (plain or .gz/.bz2/.xz compressed)"""
     
-    def __init__(self, data_dir: str = "data/raw/synthea_output"):
+    def __init__(self, data_dir: str = "data/raw/synthea_output", streaming: bool = True,
+                 workers: int = 1, manifest: FileManifest = None, full_rescan: bool = False,
+                 cache: PatientCache = None, compact_records: bool = False):
         self.data_dir = Path(data_dir)
+        # Streaming mode stops reading each bundle once the Patient entry is decoded
+        self.streaming = streaming
+        # Number of worker processes for extraction (None = one per CPU core)
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        # With a manifest only new or modified files are extracted (unless full_rescan)
+        self.manifest = manifest
+        self.full_rescan = full_rescan
+        # Extracted patients are cached by bundle content hash to skip JSON decoding; the cache
+        # serves parse_all_patients/iter_patient_batches (CSV-source runs), not bundle extraction
+        self.cache = cache
+        # Compact mode returns patients as slotted Patient records (built in the workers)
+        self.compact_records = compact_records
+        # Files that failed to read so far
+        self.read_errors = 0
+        # Resolved paths list_patient_files leaves out (e.g. still being written, see IngestWatcher)
+        self.skip_files = set()
+    
+    def __getstate__(self):
+        # Worker processes never touch the manifest; don't pickle it with every task
+        state = self.__dict__.copy()
+        state['manifest'] = None
+        return state
         
     def read_patient_files(self) -> List[Dict]:
         """Read all patient JSON files from directory"""
-        patients = []
-        
+        patients = self._process_files(self._read_patient_file)
+        logger.info(f"Successfully loaded {len(patients)} patients")
+        return patients
+    
+    def list_patient_files(self) -> List[Path]:
+        """List patient files in a deterministic order"""
         if not self.data_dir.exists():
             logger.error(f"Directory not found: {self.data_dir}")
-            return patients
+            return []
         
-        json_files = list(self.data_dir.glob("*.json"))
+        json_files = glob_inputs(self.data_dir, "*.json")
+        if self.skip_files:
+            json_files = [json_file for json_file in json_files if json_file.resolve() not in self.skip_files]
         logger.info(f"Found {len(json_files)} patient files")
         
-        for file_path in json_files:
+        if self.manifest is not None:
+            json_files = self.manifest.filter_changed(json_files, self.full_rescan)
+            logger.info(f"{len(json_files)} patient files are new or modified since the last run")
+        
+        return json_files
+    
+    def _process_files(self, func: Callable[[Path], FileResult], files: List[Path] = None) -> List:
+        """
+        Apply a per-file function, in parallel when workers > 1
+        Results are merged in file order; per-file messages are logged here.
+        """
+        if files is None:
+            files = self.list_patient_files()
+        
+        if self.workers > 1 and len(files) > 1:
+            chunksize = max(1, len(files) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                file_results = executor.map(func, files, chunksize=chunksize)
+                results = self._collect_results(file_results)
+        else:
+            results = self._collect_results(map(func, files))
+        
+        return results
+    
+    def _collect_results(self, file_results: Iterable[FileResult]) -> List:
+        """Log per-file messages and keep non-empty results"""
+        results = []
+        
+        for result, level, message in file_results:
+            if message:
+                getattr(logger, level)(message)
+            if level == 'error':
+                self.read_errors += 1
+            if result:
+                results.append(result)
+        
+        return results
+    
+    def _read_patient_file(self, file_path: Path, data: bytes = None) -> FileResult:
+        """
+        Read the Patient resource from one file (or from its raw bytes, if already read)
+        Returns: (patient resource, log level, message)
+        """
+        try:
+            if self.streaming:
+                resource_type, patient_resource = read_patient_resource(file_path, data=data)
+            else:
+                resource_type, patient_resource = self._load_patient_resource(file_path, data)
+            
+            if patient_resource:
+                return patient_resource, 'debug', f"Loaded patient from {resource_type}: {file_path.name}"
+            if resource_type != 'Bundle':
+                return None, 'warning', f"Unknown resource type in {file_path.name}: {resource_type}"
+            return None, None, None
+            
+        except Exception as e:
+            return None, 'error', f"Error reading {file_path}: {e}"
+    
+    def _parse_patient_file(self, file_path: Path) -> FileResult:
+        """
+        Read and extract one patient file (runs inside worker processes)
+        With the cache, the file is read once: its bytes are hashed for the
+        lookup and, on a miss, parsed from memory.
+        """
+        data = digest = None
+        if self.cache is not None:
             try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    
-                    # Check if it's a FHIR Bundle
-                    if data.get('resourceType') == 'Bundle':
-                        # Extract patient from bundle entries
-                        patient_resource = self._extract_patient_from_bundle(data)
-                        if patient_resource:
-                            patients.append(patient_resource)
-                            logger.debug(f"Loaded patient from bundle: {file_path.name}")
-                    elif data.get('resourceType') == 'Patient':
-                        # Direct patient resource
-                        patients.append(data)
-                        logger.debug(f"Loaded patient: {file_path.name}")
-                    else:
-                        logger.warning(f"Unknown resource type in {file_path.name}: {data.get('resourceType')}")
-                        
+                data = file_path.read_bytes()
+                digest = content_digest(data)
+                cached = self.cache.get(digest)
+                if cached is not None:
+                    return self._patient_record(cached), 'debug', f"Loaded patient from cache: {file_path.name}"
             except Exception as e:
-                logger.error(f"Error reading {file_path}: {e}")
-                
-        logger.info(f"Successfully loaded {len(patients)} patients")
-        return patients
+                return None, 'error', f"Error reading {file_path}: {e}"
+        
+        patient_resource, level, message = self._read_patient_file(file_path, data)
+        
+        if not patient_resource:
+            return None, level, message
+        
+        extracted = self.extract_patient_info(patient_resource)
+        if digest and extracted.get('patient_id'):
+            self.cache.put(digest, extracted)
+        
+        return self._patient_record(extracted), level, message
+    
+    def _patient_record(self, extracted: Dict) -> Dict:
+        """Extracted patient as returned to the pipeline (a Patient record in compact mode)"""
+        if self.compact_records and extracted:
+            return Patient.from_dict(extracted)
+        return extracted
+    
+    def _load_patient_resource(self, file_path: Path, data: bytes = None) -> Tuple[str, Dict]:
+        """Decode a whole FHIR file and return (resourceType, Patient resource)"""
+        with open_input(file_path, 'r', data) as f:
+            data = json.load(f)
+        
+        resource_type = data.get('resourceType')
+        
+        # Check if it's a FHIR Bundle
+        if resource_type == 'Bundle':
+            return resource_type, self._extract_patient_from_bundle(data)
+        
+        # Direct patient resource
+        if resource_type == 'Patient':
+            return resource_type, data
+        
+        return resource_type, None
     
     def _extract_patient_from_bundle(self, bundle: Dict) -> Dict:
         """Extract Patient resource from FHIR Bundle"""
@@ -128,14 +252,96 @@ class FHIRParser:
 
     def parse_all_patients(self) -> List[Dict]:
         """Read and parse all patient files"""
-        raw_patients = self.read_patient_files()
-        parsed_patients = []
+        extracted_patients = self._process_files(self._parse_patient_file)
+        logger.info(f"Successfully loaded {len(extracted_patients)} patients")
         
-        for patient in raw_patients:
-            extracted = self.extract_patient_info(patient)
-            if extracted and extracted.get('patient_id'):  # Only add if has patient_id
-                parsed_patients.append(extracted)
+        # Only keep patients that have a patient_id
+        parsed_patients = [p for p in extracted_patients if p.get('patient_id')]
+        
+        if self.cache is not None:
+            self.cache.prune()
         
         logger.info(f"Parsed {len(parsed_patients)} patients")
         return parsed_patients
-
+    
+    def iter_patient_batches(self, batch_size: int, files: List[Path] = None) -> Iterator[List[Dict]]:
+        """Parse patient files (default: list_patient_files) batch_size at a time, like parse_all_patients"""
+        if files is None:
+            files = self.list_patient_files()
+        
+        for start in range(0, len(files), batch_size):
+            extracted_patients = self._process_files(self._parse_patient_file, files[start:start + batch_size])
+            yield [p for p in extracted_patients if p.get('patient_id')]
+        
+        if self.cache is not None:
+            self.cache.prune()
+    
+    def iter_bundle_batches(self, batch_size: int, files: List[Path] = None) -> Iterator[ClinicalBatch]:
+        """Decode bundles (default: list_patient_files) batch_size at a time, like extract_bundle_resources"""
+        if files is None:
+            files = self.list_patient_files()
+        
+        for start in range(0, len(files), batch_size):
+            batch = ClinicalBatch()
+            for file_batch in self._process_files(self._parse_bundle_file, files[start:start + batch_size]):
+                batch.merge(file_batch)
+            yield batch
+    
+    def extract_bundle_resources(self) -> ClinicalBatch:
+        """
+        Decode every bundle once and sort its resources into per-type batches
+        Returns: ClinicalBatch with patients plus conditions, observations,
+        encounters and medications keyed by patient id
+        """
+        batch = ClinicalBatch()
+        
+        for file_batch in self._process_files(self._parse_bundle_file):
+            batch.merge(file_batch)
+        
+        logger.info(f"Extracted bundle resources: {batch.counts()}")
+        return batch
+    
+    def _parse_bundle_file(self, file_path: Path) -> FileResult:
+        """Sort all resources of one bundle into a ClinicalBatch (runs inside worker processes)"""
+        batch = ClinicalBatch()
+        header = {}
+        bundle_patient_id = ''
+        # fullUrl / resource id of the Patient -> patient_id, to resolve subject references
+        aliases = {}
+        
+        try:
+            with open_input(file_path, 'r') as f:
+                for key, value in iter_bundle_items(f):
+                    if key != 'entry':
+                        header[key] = value
+                        continue
+                    
+                    if not isinstance(value, dict):
+                        continue
+                    resource = value.get('resource', {})
+                    
+                    if resource.get('resourceType') == 'Patient':
+                        patient = self.extract_patient_info(resource)
+                        if patient.get('patient_id'):
+                            batch.patients.append(patient)
+                            bundle_patient_id = patient['patient_id']
+                            aliases[bundle_patient_id] = bundle_patient_id
+                            aliases[reference_id(value.get('fullUrl'))] = bundle_patient_id
+                        continue
+                    
+                    subject = resource.get('subject') or resource.get('patient') or {}
+                    batch.add_resource(resource, reference_id(subject.get('reference')))
+        
+        except Exception as e:
+            return None, 'error', f"Error reading {file_path}: {e}"
+        
+        resource_type = header.get('resourceType')
+        if resource_type == 'Patient':
+            patient = self.extract_patient_info(header)
+            if patient.get('patient_id'):
+                batch.patients.append(patient)
+        elif resource_type != 'Bundle':
+            return None, 'warning', f"Unknown resource type in {file_path.name}: {resource_type}"
+        
+        batch.rekey(aliases, default=bundle_patient_id)
+        return batch, 'debug', f"Extracted bundle resources: {file_path.name}"
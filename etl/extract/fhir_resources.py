@@ -0,0 +1,220 @@
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# LOINC codes mapped to the test types used by the lab CSV and RiskCalculator
+LOINC_TEST_TYPES = {
+    '4548-4': 'A1C',
+    '2339-0': 'Glucose',
+    '2345-7': 'Glucose',
+    '2093-3': 'Cholesterol',
+}
+
+# Observation category of lab results (vital signs, surveys etc. are not Lab_Result__c rows)
+LABORATORY_CATEGORY = 'laboratory'
+
+# SNOMED CT codes mapped to the condition names used by RiskCalculator
+SNOMED_CONDITIONS = {
+    '44054006': 'Type 2 Diabetes',
+    '38341003': 'Hypertension',
+    '59621000': 'Hypertension',
+    '55822004': 'Hyperlipidemia',
+}
+
+# Observation interpretation codes mapped to Lab_Result__c Status__c values
+INTERPRETATION_STATUS = {
+    'N': 'Normal',
+    'H': 'Abnormal',
+    'L': 'Abnormal',
+    'A': 'Abnormal',
+    'HH': 'Critical',
+    'LL': 'Critical',
+    'AA': 'Critical',
+}
+
+
+def reference_id(reference: str) -> str:
+    """Return the resource id from a 'Patient/<id>' or 'urn:uuid:<id>' reference"""
+    if not reference:
+        return ''
+    return reference.rsplit('/', 1)[-1].rsplit(':', 1)[-1]
+
+
+def _first_coding(concept: Dict) -> Dict:
+    codings = (concept or {}).get('coding', [])
+    return codings[0] if codings else {}
+
+
+def _concept_text(concept: Dict) -> str:
+    concept = concept or {}
+    return concept.get('text') or _first_coding(concept).get('display', '')
+
+
+def _format_datetime(value: str) -> str:
+    """Convert a FHIR dateTime to the 'YYYY-MM-DD HH:MM:SS' format used by the CSVs"""
+    if not value:
+        return ''
+    return value[:19].replace('T', ' ')
+
+
+def condition_to_record(resource: Dict, patient_id: str) -> Dict:
+    """Map a FHIR Condition to a conditions CSV-style record"""
+    coding = _first_coding(resource.get('code'))
+
+    return {
+        'patient_id': patient_id,
+        'condition': SNOMED_CONDITIONS.get(coding.get('code'), _concept_text(resource.get('code'))),
+        'code': coding.get('code', ''),
+        'onset_date': (resource.get('onsetDateTime') or '')[:10],
+        'clinical_status': _first_coding(resource.get('clinicalStatus')).get('code', '')
+    }
+
+
+def is_laboratory(resource: Dict, loinc_code: str) -> bool:
+    """
+    True for lab Observations
+    Observations with a category must be in the 'laboratory' one;
+    uncategorized ones only count when their LOINC code is a known lab test.
+    """
+    categories = resource.get('category') or []
+    if not categories:
+        return loinc_code in LOINC_TEST_TYPES
+    return any(coding.get('code') == LABORATORY_CATEGORY
+               for category in categories for coding in (category or {}).get('coding', []))
+
+
+def observation_to_lab(resource: Dict, patient_id: str) -> Optional[Dict]:
+    """Map a numeric lab Observation to a lab_results CSV-style record (None for other Observations)"""
+    quantity = resource.get('valueQuantity')
+    if not quantity or quantity.get('value') is None:
+        return None
+
+    coding = _first_coding(resource.get('code'))
+    if not is_laboratory(resource, coding.get('code')):
+        return None
+
+    reference_range = ''
+    ranges = resource.get('referenceRange', [])
+    if ranges:
+        low = ranges[0].get('low', {}).get('value')
+        high = ranges[0].get('high', {}).get('value')
+        if low is not None and high is not None:
+            reference_range = f"{low}-{high}"
+        elif high is not None:
+            reference_range = f"<{high}"
+        elif low is not None:
+            reference_range = f">{low}"
+
+    interpretations = resource.get('interpretation', [])
+    interpretation = _first_coding(interpretations[0]).get('code') if interpretations else None
+
+    return {
+        'patient_id': patient_id,
+        'test_type': LOINC_TEST_TYPES.get(coding.get('code'), _concept_text(resource.get('code'))),
+        'value': quantity['value'],
+        'reference_range': reference_range,
+        'test_datetime': _format_datetime(resource.get('effectiveDateTime') or resource.get('issued')),
+        'status': INTERPRETATION_STATUS.get(interpretation, 'Normal'),
+        'loinc_code': coding.get('code', '')
+    }
+
+
+def encounter_to_record(resource: Dict, patient_id: str) -> Dict:
+    """Map a FHIR Encounter to a flat record"""
+    types = resource.get('type', [])
+    period = resource.get('period', {})
+
+    return {
+        'patient_id': patient_id,
+        'encounter_id': resource.get('id', ''),
+        'encounter_type': _concept_text(types[0]) if types else '',
+        'start': _format_datetime(period.get('start')),
+        'end': _format_datetime(period.get('end')),
+        'status': resource.get('status', '')
+    }
+
+
+def medication_to_record(resource: Dict, patient_id: str) -> Dict:
+    """Map a FHIR MedicationRequest to a flat record"""
+    return {
+        'patient_id': patient_id,
+        'medication': _concept_text(resource.get('medicationCodeableConcept')),
+        'authored_on': _format_datetime(resource.get('authoredOn')),
+        'status': resource.get('status', '')
+    }
+
+
+class ClinicalBatch:
+    """Clinical records from FHIR bundles, sorted into per-type batches keyed by patient id"""
+
+    RESOURCE_TYPES = {
+        'Condition': ('conditions', condition_to_record),
+        'Observation': ('observations', observation_to_lab),
+        'Encounter': ('encounters', encounter_to_record),
+        'MedicationRequest': ('medications', medication_to_record),
+    }
+
+    def __init__(self):
+        self.patients: List[Dict] = []
+        self.conditions: Dict[str, List[Dict]] = defaultdict(list)
+        self.observations: Dict[str, List[Dict]] = defaultdict(list)
+        self.encounters: Dict[str, List[Dict]] = defaultdict(list)
+        self.medications: Dict[str, List[Dict]] = defaultdict(list)
+
+    def add_resource(self, resource: Dict, patient_id: str) -> bool:
+        """Convert and file a non-Patient resource; returns False if the type is not tracked"""
+        handler = self.RESOURCE_TYPES.get(resource.get('resourceType'))
+        if not handler:
+            return False
+
+        batch_name, convert = handler
+        record = convert(resource, patient_id)
+        if record:
+            getattr(self, batch_name)[patient_id].append(record)
+        return True
+
+    def rekey(self, aliases: Dict[str, str], default: str = ''):
+        """
+        Re-key records by resolved patient id
+        Subject references are looked up in `aliases`; records without a
+        subject fall back to `default`, and are dropped if that is empty.
+        """
+        for batch_name, _ in self.RESOURCE_TYPES.values():
+            rekeyed = defaultdict(list)
+            for reference, records in getattr(self, batch_name).items():
+                patient_id = aliases.get(reference) or reference or default
+                if not patient_id:
+                    continue
+                for record in records:
+                    record['patient_id'] = patient_id
+                rekeyed[patient_id].extend(records)
+            setattr(self, batch_name, rekeyed)
+
+    def merge(self, other: 'ClinicalBatch'):
+        """Append another batch (e.g. from a worker process) to this one"""
+        self.patients.extend(other.patients)
+        for batch_name, _ in self.RESOURCE_TYPES.values():
+            target = getattr(self, batch_name)
+            for patient_id, records in getattr(other, batch_name).items():
+                target[patient_id].extend(records)
+
+    @classmethod
+    def from_records(cls, patients: List[Dict], records: Dict[str, List[Dict]]) -> 'ClinicalBatch':
+        """Batch from patients and flat per-type record lists (as returned by records())"""
+        batch = cls()
+        batch.patients = patients
+        for batch_name, batch_records in records.items():
+            target = getattr(batch, batch_name)
+            for record in batch_records:
+                target[record['patient_id']].append(record)
+        return batch
+
+    def records(self, batch_name: str) -> List[Dict]:
+        """Flatten one per-type batch into a list of records"""
+        return [record for records in getattr(self, batch_name).values() for record in records]
+
+    def counts(self) -> Dict[str, int]:
+        """Record counts per batch"""
+        counts = {'patients': len(self.patients)}
+        for batch_name, _ in self.RESOURCE_TYPES.values():
+            counts[batch_name] = sum(len(records) for records in getattr(self, batch_name).values())
+        return counts
@@ -0,0 +1,142 @@
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+from .compression import open_input
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_CHUNK_SIZE = 64 * 1024
+
+
+class _JSONStream:
+    """Buffered reader that decodes one JSON value at a time from a text file"""
+
+    def __init__(self, fp: TextIO, chunk_size: int = _CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        """Drop the consumed prefix and append at least `size` more characters"""
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of file)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def expect(self, char: str):
+        """Consume `char` or raise ValueError"""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}, found '{found}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        # Grow reads geometrically so a large value is re-scanned O(log n) times
+        read_size = self.chunk_size
+
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill(read_size):
+                    raise
+                read_size = max(read_size * 2, len(self.buf) - self.pos)
+                continue
+
+            # A number or literal ending exactly at the buffer edge may be truncated
+            if end == len(self.buf) and not isinstance(obj, (dict, list, str)):
+                if self._fill(read_size):
+                    continue
+
+            self.pos = end
+            return obj
+
+
+def iter_bundle_items(fp: TextIO, chunk_size: int = _CHUNK_SIZE) -> Iterator[Tuple[str, object]]:
+    """
+    Incrementally walk a top-level FHIR JSON object
+    Yields (key, value) for each top-level member, except that the `entry`
+    array is yielded one element at a time as ('entry', element).
+    """
+    stream = _JSONStream(fp, chunk_size)
+    stream.expect('{')
+
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(':')
+
+        if key == 'entry' and stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.pos += 1
+            else:
+                while True:
+                    yield 'entry', stream.value()
+                    sep = stream.peek()
+                    stream.pos += 1
+                    if sep == ']':
+                        break
+                    if sep != ',':
+                        raise ValueError(f"Malformed entry array near offset {stream.pos}")
+        else:
+            yield key, stream.value()
+
+        sep = stream.peek()
+        stream.pos += 1
+        if sep == '}':
+            return
+        if sep != ',':
+            raise ValueError(f"Malformed JSON object near offset {stream.pos}")
+
+
+def read_patient_resource(file_path: Path, chunk_size: int = _CHUNK_SIZE,
+                          data: bytes = None) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Read the Patient resource from a FHIR file, stopping as soon as it is complete
+    data: the file's raw bytes, if they were already read
+    Returns: (top-level resourceType, Patient resource or None)
+    """
+    header = {}
+
+    with open_input(file_path, 'r', data) as f:
+        for key, value in iter_bundle_items(f, chunk_size):
+            if key != 'entry':
+                header[key] = value
+                continue
+
+            if header.get('resourceType', 'Bundle') != 'Bundle' or not isinstance(value, dict):
+                continue
+
+            resource = value.get('resource', {})
+            if resource.get('resourceType') == 'Patient':
+                return 'Bundle', resource
+
+    resource_type = header.get('resourceType')
+    if resource_type == 'Patient':
+        return resource_type, header
+
+    return resource_type, None
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence
+from utils import setup_logger, decimal_floats
+from utils.frames import DATETIME_FORMAT
+
+logger = setup_logger(__name__)
+
+DEFAULT_MANIFEST_PATH = "data/state/extract_manifest.json"
+
+
+def file_digest(file_path: Path, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's raw bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_digest(data: bytes) -> str:
+    """SHA-256 of a file's raw bytes already read into memory (same as file_digest)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _row_text(value) -> str:
+    """Canonical text of a record value (None/NaN empty, whole floats without '.0')"""
+    if value is None or value != value:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def row_hashes(rows, columns: Sequence[str]) -> np.ndarray:
+    """
+    64-bit hash of each row's values in the given columns
+    Rows may be a list of dicts/records or a typed DataFrame; a row hashes
+    the same either way (datetimes as CSV text, float32 in short decimal
+    form), and columns a row does not have count as empty.
+    """
+    if isinstance(rows, pd.DataFrame):
+        values = {}
+        for name in columns:
+            if name not in rows.columns:
+                values[name] = [None] * len(rows)
+                continue
+            col = rows[name]
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                col = col.astype(object)
+            if pd.api.types.is_datetime64_any_dtype(col):
+                col = col.dt.strftime(DATETIME_FORMAT)
+            values[name] = decimal_floats(col).astype(object).tolist()
+    else:
+        values = {name: [row.get(name) for row in rows] for name in columns}
+
+    if not len(rows):
+        return np.array([], dtype=np.uint64)
+
+    frame = pd.DataFrame({name: [_row_text(value) for value in column] for name, column in values.items()})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+class FileManifest:
+    """
+    Persistent record of extracted input files (path, size, mtime, content hash)
+    It also keeps hashes of the lab, condition, ... rows already loaded, so
+    inputs that are always read in full (CSVs, NDJSON exports, changed
+    bundles) only load their new rows.
+    """
+
+    def __init__(self, manifest_path: str = DEFAULT_MANIFEST_PATH):
+        self.manifest_path = Path(manifest_path)
+        self.rows_path = self.manifest_path.with_suffix('.rows.npz')
+        self.entries: Dict[str, Dict] = self._load()
+        # Entries for files seen this run; only written by commit() after a successful run
+        self.pending: Dict[str, Dict] = {}
+        # Sorted hashes of loaded rows per kind, and (hashes, patient ids) of new rows staged this run
+        self.row_entries: Dict[str, np.ndarray] = self._load_rows()
+        self.pending_rows: Dict[str, List] = {}
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.manifest_path.exists():
+            return {}
+
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f).get('files', {})
+        except Exception as e:
+            logger.error(f"Error reading manifest {self.manifest_path}, starting empty: {e}")
+            return {}
+
+    def _load_rows(self) -> Dict[str, np.ndarray]:
+        if not self.rows_path.exists():
+            return {}
+
+        try:
+            with np.load(self.rows_path) as rows:
+                return {kind: rows[kind] for kind in rows.files}
+        except Exception as e:
+            logger.error(f"Error reading row hashes {self.rows_path}, starting empty: {e}")
+            return {}
+
+    def is_changed(self, file_path: Path) -> bool:
+        """
+        Check a file against the manifest and stage its new entry
+        Size and mtime are compared first; the content hash is only computed
+        when they differ, so touched-but-identical files are not reprocessed.
+        """
+        key = str(Path(file_path).resolve())
+        stat = os.stat(file_path)
+        previous = self.entries.get(key)
+
+        if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+            return False
+
+        entry = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha256': file_digest(file_path)
+        }
+        self.pending[key] = entry
+
+        return not previous or previous['sha256'] != entry['sha256']
+
+    def filter_changed(self, file_paths: Iterable[Path], full_rescan: bool = False) -> List[Path]:
+        """Return new or modified files (all files when full_rescan, still updating the manifest)"""
+        changed = []
+
+        for file_path in file_paths:
+            if self.is_changed(file_path) or full_rescan:
+                changed.append(file_path)
+
+        return changed
+
+    def new_rows(self, kind: str, hashes: np.ndarray) -> np.ndarray:
+        """Mask of rows (by row_hashes) not loaded by an earlier committed run"""
+        loaded = self.row_entries.get(kind)
+        if loaded is None or not len(loaded):
+            return np.ones(len(hashes), dtype=bool)
+        return ~np.isin(hashes, loaded)
+
+    def stage_rows(self, kind: str, hashes: np.ndarray, patient_ids: np.ndarray):
+        """Stage hashes of rows loaded this run, with their patient ids, for commit()"""
+        if len(hashes):
+            self.pending_rows.setdefault(kind, []).append((hashes, patient_ids))
+
+    def commit(self, failed_patient_ids: Iterable[str] = (), include_files: bool = True):
+        """
+        Persist entries staged during this run
+        Rows of failed_patient_ids are not recorded, so they are loaded again
+        next run. Without include_files (a run with load errors), staged file
+        entries are dropped so those files are extracted again.
+        """
+        failed = set(failed_patient_ids)
+        rows_changed = False
+
+        for kind, staged in self.pending_rows.items():
+            hashes = np.concatenate([h for h, _ in staged])
+            patient_ids = np.concatenate([p for _, p in staged])
+            if failed:
+                hashes = hashes[np.array([patient_id not in failed for patient_id in patient_ids.tolist()],
+                                         dtype=bool)]
+            if len(hashes):
+                self.row_entries[kind] = np.union1d(self.row_entries.get(kind, np.array([], dtype=np.uint64)),
+                                                    hashes)
+                rows_changed = True
+        self.pending_rows = {}
+
+        if rows_changed:
+            self.rows_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.rows_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **self.row_entries)
+            os.replace(tmp_path, self.rows_path)
+
+        if not include_files:
+            if self.pending:
+                logger.warning(f"Not saving {len(self.pending)} extract manifest entries after load errors; "
+                               f"those files are extracted again next run")
+            self.pending = {}
+            return
+
+        if not self.pending:
+            return
+
+        self.entries.update(self.pending)
+        self.pending = {}
+
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+        logger.info(f"Saved extract manifest with {len(self.entries)} files to {self.manifest_path}")
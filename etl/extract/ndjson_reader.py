@@ -0,0 +1,181 @@
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from utils import setup_logger
+from .compression import glob_inputs, is_compressed, open_input
+from .fhir_parser import FHIRParser
+from .fhir_resources import ClinicalBatch, reference_id
+
+logger = setup_logger(__name__)
+
+DEFAULT_SHARD_BYTES = 64 * 1024 * 1024
+
+# (file path, start offset, end offset) of a byte-range shard; end is None for whole files
+Shard = Tuple[Path, int, int]
+
+
+def iter_ndjson(file_path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (offset, line) for lines of a memory-mapped NDJSON file
+    Only lines that *start* inside [start, end) are yielded, so adjacent
+    byte-range shards cover every line exactly once. Compressed files
+    cannot be mapped and are streamed whole (offsets are then positions
+    in the decompressed stream).
+    """
+    if is_compressed(file_path):
+        offset = 0
+        with open_input(file_path, 'rb') as f:
+            for line in f:
+                stripped = line.strip()
+                if stripped:
+                    yield offset, stripped
+                offset += len(line)
+        return
+
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return
+
+    end = size if end is None else min(end, size)
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        if start > 0:
+            # Skip the partial line owned by the previous shard
+            newline = mm.find(b'\n', start - 1)
+            pos = size if newline == -1 else newline + 1
+
+        while pos < end:
+            newline = mm.find(b'\n', pos)
+            line_end = size if newline == -1 else newline
+            line = mm[pos:line_end].strip()
+            if line:
+                yield pos, line
+            pos = line_end + 1
+
+
+def _parse_shard(shard: Shard) -> Tuple[ClinicalBatch, int, Optional[str]]:
+    """Decode one shard into a ClinicalBatch; returns (batch, error count, first error)"""
+    file_path, start, end = shard
+    parser = FHIRParser(data_dir=file_path.parent)
+    batch = ClinicalBatch()
+    errors = 0
+    first_error = None
+
+    for offset, line in iter_ndjson(file_path, start, end):
+        try:
+            resource = json.loads(line)
+
+            if resource.get('resourceType') == 'Patient':
+                patient = parser.extract_patient_info(resource)
+                if patient.get('patient_id'):
+                    batch.patients.append(patient)
+                continue
+
+            subject = resource.get('subject') or resource.get('patient') or {}
+            patient_id = reference_id(subject.get('reference'))
+            if patient_id:
+                batch.add_resource(resource, patient_id)
+
+        except Exception as e:
+            errors += 1
+            if first_error is None:
+                first_error = f"Error decoding {file_path.name} at byte {offset}: {e}"
+
+    return batch, errors, first_error
+
+
+class NDJSONReader:
+    """Read FHIR Bulk Data NDJSON exports (one resource per line) via memory-mapped shards"""
+
+    def __init__(self, data_dir: str = "data/raw/bulk_export", workers: int = 1,
+                 shard_bytes: int = DEFAULT_SHARD_BYTES):
+        self.data_dir = Path(data_dir)
+        # Number of worker processes (None = one per CPU core)
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.shard_bytes = shard_bytes
+        # Lines that failed to decode so far
+        self.read_errors = 0
+
+    def list_files(self, resource_type: str = None) -> List[Path]:
+        """List NDJSON files, optionally only those for one resource type (e.g. Patient.ndjson)"""
+        if not self.data_dir.exists():
+            logger.error(f"Directory not found: {self.data_dir}")
+            return []
+
+        pattern = f"{resource_type}*.ndjson" if resource_type else "*.ndjson"
+        return glob_inputs(self.data_dir, pattern)
+
+    def iter_resources(self, file_path: Path) -> Iterator[Dict]:
+        """Lazily decode resources from one NDJSON file"""
+        for offset, line in iter_ndjson(file_path):
+            try:
+                yield json.loads(line)
+            except Exception as e:
+                logger.error(f"Error decoding {file_path.name} at byte {offset}: {e}")
+                self.read_errors += 1
+
+    def _shards(self, files: List[Path]) -> List[Shard]:
+        """Split files into byte ranges of at most shard_bytes"""
+        shards = []
+        for file_path in files:
+            if is_compressed(file_path):
+                shards.append((file_path, 0, None))
+                continue
+            size = os.path.getsize(file_path)
+            for start in range(0, max(size, 1), self.shard_bytes):
+                shards.append((file_path, start, min(start + self.shard_bytes, size)))
+        return shards
+
+    def extract_resources(self, resource_type: str = None) -> ClinicalBatch:
+        """
+        Decode NDJSON files into the same ClinicalBatch produced by FHIRParser
+        Shards are decoded in parallel when workers > 1 and merged in file order.
+        """
+        batch = ClinicalBatch()
+        for shard_batch in self.iter_shard_batches(resource_type):
+            batch.merge(shard_batch)
+
+        logger.info(f"Extracted NDJSON resources: {batch.counts()}")
+        return batch
+
+    def iter_shard_batches(self, resource_type: str = None) -> Iterator[ClinicalBatch]:
+        """
+        Decode NDJSON files one shard at a time, in file order
+        With workers > 1, up to `workers` shards are decoded at once, so at
+        most that many shard batches are in memory.
+        """
+        files = self.list_files(resource_type)
+        shards = self._shards(files)
+        logger.info(f"Found {len(files)} NDJSON files ({len(shards)} shards)")
+
+        if self.workers > 1 and len(shards) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for start in range(0, len(shards), self.workers):
+                    for shard_result in executor.map(_parse_shard, shards[start:start + self.workers]):
+                        yield self._shard_batch(*shard_result)
+        else:
+            for shard in shards:
+                yield self._shard_batch(*_parse_shard(shard))
+
+    def _shard_batch(self, batch: ClinicalBatch, errors: int, first_error: Optional[str]) -> ClinicalBatch:
+        """Log and count a decoded shard's errors"""
+        if errors:
+            logger.error(f"{first_error} ({errors} bad lines in shard)")
+            self.read_errors += errors
+        return batch
+
+    def count_patients(self) -> int:
+        """Number of lines in Patient*.ndjson (one Patient resource each), without decoding them"""
+        return sum(1 for file_path in self.list_files('Patient') for _ in iter_ndjson(file_path))
+
+    def read_patients(self) -> List[Dict]:
+        """Extract patient records from Patient*.ndjson"""
+        return self.extract_resources('Patient').patients
+
+    def read_observations(self) -> List[Dict]:
+        """Extract lab records from Observation*.ndjson"""
+        return self.extract_resources('Observation').records('observations')
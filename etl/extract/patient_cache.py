@@ -0,0 +1,104 @@
+import marshal
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_CACHE_DIR = "data/cache/patients"
+
+# Fields of FHIRParser.extract_patient_info, stored positionally
+PATIENT_FIELDS = ('patient_id', 'first_name', 'last_name', 'date_of_birth',
+                  'gender', 'email', 'phone', 'address')
+
+# Bump when PATIENT_FIELDS or extraction rules change so old entries are ignored
+CACHE_FORMAT = 1
+
+
+class PatientCache:
+    """
+    Content-addressed on-disk cache of extracted patient records
+    Used by FHIRParser.parse_all_patients/iter_patient_batches (CSV-source
+    runs); bundle extraction for the fhir source decodes every bundle.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = 512 * 1024 * 1024,
+                 max_age_days: float = 30):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+
+    def _entry_path(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.bin"
+
+    def get(self, digest: str) -> Optional[Dict]:
+        """Return the cached patient for a bundle content hash, or None on a miss"""
+        entry_path = self._entry_path(digest)
+
+        try:
+            with open(entry_path, 'rb') as f:
+                cache_format, values = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {entry_path}: {e}")
+            return None
+
+        if cache_format != CACHE_FORMAT:
+            return None
+
+        # Refresh mtime so eviction drops least recently used entries first
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return dict(zip(PATIENT_FIELDS, values))
+
+    def put(self, digest: str, patient: Dict):
+        """Store an extracted patient under its bundle content hash"""
+        entry_path = self._entry_path(digest)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        values = tuple(patient.get(field, '') for field in PATIENT_FIELDS)
+
+        # Write then rename so concurrent workers never see a partial entry
+        tmp_path = entry_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            marshal.dump((CACHE_FORMAT, values), f)
+        os.replace(tmp_path, entry_path)
+
+    def prune(self) -> int:
+        """Evict entries older than max_age, then least recently used until under max_bytes"""
+        if not self.cache_dir.exists():
+            return 0
+
+        now = time.time()
+        entries = []
+        removed = 0
+
+        for entry_path in self.cache_dir.glob("*/*.bin"):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+
+            if now - stat.st_mtime > self.max_age_seconds:
+                entry_path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"Evicted {removed} patient cache entries")
+        return removed
@@ -0,0 +1,187 @@
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# (target, source, default[, converter]): source is a key of the input record, or a
+# callable taking the whole record for derived fields; converter is applied to the value
+FieldSpec = Tuple
+Projector = Callable[[Dict], Dict]
+
+
+def normalize_gender(gender: str) -> str:
+    """Normalize gender values to match Salesforce picklist"""
+    gender_lower = gender.lower()
+
+    if gender_lower in ['male', 'm']:
+        return 'Male'
+    elif gender_lower in ['female', 'f']:
+        return 'Female'
+    else:
+        return 'Other'
+
+
+def select_fields(fields: Sequence[str]) -> List[FieldSpec]:
+    """Spec copying the given fields unchanged (None when missing)"""
+    return [(field, field, None) for field in fields]
+
+
+def compile_projector(name: str, spec: Sequence[FieldSpec], drop_none: bool = False) -> Projector:
+    """
+    Compile a mapping spec into a projector function
+    The spec is resolved once into (target, source, default, converter)
+    tuples and each record is projected by one dict comprehension over
+    them, so the mapper and loaders share one definition per object. With
+    drop_none, fields whose value is None are left out (Salesforce treats
+    an explicit null as "clear this field").
+    """
+    fields = tuple((field[0], field[1], field[2], field[3] if len(field) > 3 else None) for field in spec)
+
+    def project(record: Dict) -> Dict:
+        get = record.get
+        return {target: value if converter is None else converter(value)
+                for target, source, default, converter in fields
+                for value in (source(record) if callable(source) else get(source, default),)}
+
+    if drop_none:
+        def project_present(record: Dict) -> Dict:
+            return {key: value for key, value in project(record).items() if value is not None}
+        projector = project_present
+    else:
+        projector = project
+
+    projector.__name__ = projector.__qualname__ = f'project_{name}'
+    projector.spec = list(spec)
+    return projector
+
+
+# Salesforce objects (see docs/salesforce_schema.md)
+
+# Extracted patient -> Patient_Medical_Record__c
+PATIENT_MEDICAL_RECORD_FIELDS = [
+    ('Patient_ID__c', 'patient_id', ''),
+    ('First_Name__c', 'first_name', ''),
+    ('Last_Name__c', 'last_name', ''),
+    ('Date_of_Birth__c', 'date_of_birth', ''),
+    ('Gender__c', 'gender', '', normalize_gender),
+    ('Email__c', 'email', ''),
+    ('Phone__c', 'phone', ''),
+    ('Address__c', 'address', ''),
+]
+
+# Extracted lab result -> Lab_Result__c (patient_id is kept to resolve the Patient__c lookup)
+LAB_RESULT_FIELDS = [
+    ('patient_id', 'patient_id', ''),
+    ('Test_Type__c', 'test_type', ''),
+    ('Test_Value__c', 'value', 0, float),
+    ('Reference_Range__c', 'reference_range', ''),
+    ('Test_Datetime__c', 'test_datetime', ''),
+    ('Status__c', 'status', 'Normal'),
+]
+
+# Care plan record -> Care_Plan__c
+CARE_PLAN_FIELDS = [
+    ('patient_id', 'patient_id', ''),
+    ('Plan_Name__c', 'plan_name', ''),
+    ('Start_Date__c', 'start_date', None),
+    ('End_Date__c', 'end_date', None),
+    ('Status__c', 'status', 'Active'),
+    ('Goals__c', 'goals', ''),
+]
+
+# RiskCalculator assessment -> Risk_Assessment__c
+RISK_ASSESSMENT_FIELDS = select_fields(['Risk_Level__c', 'Risk_Score__c', 'Assessment_Date__c', 'Risk_Factors__c']) + [
+    ('Rule_Set_Version__c', 'rule_set_version', None),
+]
+
+map_patient = compile_projector('patient', PATIENT_MEDICAL_RECORD_FIELDS)
+map_lab_result = compile_projector('lab_result', LAB_RESULT_FIELDS)
+map_care_plan = compile_projector('care_plan', CARE_PLAN_FIELDS)
+
+# API payloads built from mapped records (external ID and lookup keys are added by the loader)
+patient_payload = compile_projector(
+    'patient_payload', select_fields([f[0] for f in PATIENT_MEDICAL_RECORD_FIELDS if f[0] != 'Patient_ID__c'])
+)
+lab_result_payload = compile_projector(
+    'lab_result_payload', select_fields([f[0] for f in LAB_RESULT_FIELDS if f[0] != 'patient_id']), drop_none=True
+)
+care_plan_payload = compile_projector(
+    'care_plan_payload', select_fields([f[0] for f in CARE_PLAN_FIELDS if f[0] != 'patient_id']), drop_none=True
+)
+risk_assessment_payload = compile_projector('risk_assessment_payload', RISK_ASSESSMENT_FIELDS, drop_none=True)
+
+# BigQuery tables (see scripts/setup_bigquery_schema.py)
+
+# Mapped patient (with sf_id) -> patients_snapshot
+PATIENTS_SNAPSHOT_COLUMNS = [
+    ('patient_id', 'Patient_ID__c', ''),
+    ('salesforce_id', 'sf_id', ''),
+    ('first_name', 'First_Name__c', ''),
+    ('last_name', 'Last_Name__c', ''),
+    ('date_of_birth', 'Date_of_Birth__c', None),
+    ('gender', 'Gender__c', ''),
+    ('email', 'Email__c', ''),
+    ('phone', 'Phone__c', ''),
+    ('address', 'Address__c', ''),
+]
+
+# Risk assessment -> risk_scores_history
+RISK_SCORES_HISTORY_COLUMNS = [
+    ('patient_id', 'patient_id', ''),
+    ('risk_level', 'Risk_Level__c', ''),
+    ('risk_score', 'Risk_Score__c', 0, int),
+    ('risk_factors', 'Risk_Factors__c', ''),
+    ('assessment_date', 'Assessment_Date__c', None),
+    ('rule_set_version', 'rule_set_version', None),
+]
+
+# Extracted records -> clinical_events, one spec per event type
+# (event_id and created_timestamp depend on the load and are added by the loader)
+LAB_EVENT_COLUMNS = [
+    ('patient_id', 'patient_id', ''),
+    ('event_type', lambda record: 'LAB', None),
+    ('event_date', 'test_datetime', None),
+    ('event_value', 'value', '', str),
+    ('event_status', 'status', ''),
+    ('event_details', lambda record: {
+        'test_type': record.get('test_type', ''),
+        'reference_range': record.get('reference_range', '')
+    }, None),
+]
+
+CONDITION_EVENT_COLUMNS = [
+    ('patient_id', 'patient_id', ''),
+    ('event_type', lambda record: 'CONDITION', None),
+    ('event_date', lambda record: record.get('onset_date') or None, None),
+    ('event_value', 'condition', ''),
+    ('event_status', 'clinical_status', ''),
+    ('event_details', lambda record: {'code': record.get('code', '')}, None),
+]
+
+ENCOUNTER_EVENT_COLUMNS = [
+    ('patient_id', 'patient_id', ''),
+    ('event_type', lambda record: 'ENCOUNTER', None),
+    ('event_date', lambda record: (record.get('start') or '')[:10] or None, None),
+    ('event_value', 'encounter_type', ''),
+    ('event_status', 'status', ''),
+    ('event_details', lambda record: {'end': record.get('end', '')}, None),
+]
+
+MEDICATION_EVENT_COLUMNS = [
+    ('patient_id', 'patient_id', ''),
+    ('event_type', lambda record: 'MEDICATION', None),
+    ('event_date', lambda record: (record.get('authored_on') or '')[:10] or None, None),
+    ('event_value', 'medication', ''),
+    ('event_status', 'status', ''),
+    ('event_details', lambda record: {}, None),
+]
+
+# Lab trend features (see etl/transform/lab_trends.py) -> lab_trends
+LAB_TRENDS_COLUMNS = select_fields(['patient_id', 'test_type', 'test_count', 'latest_value', 'latest_test_datetime',
+                                    'days_since_last_test', 'slope_per_year', 'rolling_mean',
+                                    'count_last_90_days'])
+
+patient_snapshot_row = compile_projector('patient_snapshot_row', PATIENTS_SNAPSHOT_COLUMNS)
+risk_history_row = compile_projector('risk_history_row', RISK_SCORES_HISTORY_COLUMNS)
+lab_event_row = compile_projector('lab_event_row', LAB_EVENT_COLUMNS)
+condition_event_row = compile_projector('condition_event_row', CONDITION_EVENT_COLUMNS)
+encounter_event_row = compile_projector('encounter_event_row', ENCOUNTER_EVENT_COLUMNS)
+medication_event_row = compile_projector('medication_event_row', MEDICATION_EVENT_COLUMNS)
+lab_trend_row = compile_projector('lab_trend_row', LAB_TRENDS_COLUMNS)
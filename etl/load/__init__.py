@@ -1,4 +1,6 @@
 from .salesforce_loader import SalesforceLoader
 from .bigquery_loader import BigQueryLoader
+from .patient_id_store import PatientIdStore
+from .rate_limiter import RateLimiter
 
-__all__ = ['SalesforceLoader', 'BigQueryLoader']
\ No newline at end of file
+__all__ = ['SalesforceLoader', 'BigQueryLoader', 'PatientIdStore', 'RateLimiter']
\ No newline at end of file
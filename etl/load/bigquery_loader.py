@@ -1,13 +1,19 @@
 import os
-from typing import List, Dict
+import pandas as pd
+from typing import List, Dict, Union
 from datetime import datetime
 from dotenv import load_dotenv
 from google.cloud import bigquery
-from utils import setup_logger
+from etl.field_mappings import (condition_event_row, encounter_event_row, lab_event_row, lab_trend_row,
+                                medication_event_row, patient_snapshot_row, risk_history_row)
+from utils import setup_logger, frame_to_records
 
 load_dotenv(override=True)
 logger = setup_logger(__name__)
 
+# Records to load: a list of dicts/records, or a columnar DataFrame
+Records = Union[List[Dict], pd.DataFrame]
+
 class BigQueryLoader:
     """Load data into BigQuery for analytics"""
     
@@ -26,71 +32,103 @@ class BigQueryLoader:
         snapshot_time = datetime.utcnow()
         
         for patient in patients:
-            row = {
-                'patient_id': patient.get('Patient_ID__c', ''),
-                'salesforce_id': patient.get('sf_id', ''),
-                'first_name': patient.get('First_Name__c', ''),
-                'last_name': patient.get('Last_Name__c', ''),
-                'date_of_birth': patient.get('Date_of_Birth__c'),
-                'gender': patient.get('Gender__c', ''),
-                'email': patient.get('Email__c', ''),
-                'phone': patient.get('Phone__c', ''),
-                'address': patient.get('Address__c', ''),
-                'snapshot_date': snapshot_time.isoformat()
-            }
+            row = patient_snapshot_row(patient)
+            row['snapshot_date'] = snapshot_time.isoformat()
             rows.append(row)
         
+        if not rows:
+            return {'success': True, 'count': 0}
+        
         # Insert rows
         try:
             errors = self.client.insert_rows_json(table_id, rows)
             
             if errors:
                 logger.error(f"Errors inserting patients: {errors}")
-                return {'success': False, 'errors': errors}
+                return {'success': False, 'errors': errors,
+                        'failed_patient_ids': self._failed_patient_ids(rows, errors)}
             else:
                 logger.info(f"Loaded {len(rows)} patients to BigQuery")
                 return {'success': True, 'count': len(rows)}
                 
         except Exception as e:
             logger.error(f"Error loading patients to BigQuery: {e}")
-            return {'success': False, 'error': str(e)}
+            return {'success': False, 'error': str(e),
+                    'failed_patient_ids': self._failed_patient_ids(rows)}
     
-    def load_clinical_events(self, lab_results: List[Dict]) -> Dict:
-        """Load lab results as clinical events"""
+    def load_clinical_events(self, lab_results: Records, conditions: Records = None,
+                             encounters: Records = None, medications: Records = None) -> Dict:
+        """
+        Load lab results as clinical events
+        Conditions, encounters and medications (e.g. from a FHIRParser
+        ClinicalBatch) are loaded as additional event types when provided.
+        Each may be a list of records or a columnar DataFrame.
+        """
         table_id = f"{self.project_id}.{self.dataset_id}.clinical_events"
         
         rows = []
         timestamp = datetime.utcnow()
         
-        for lab in lab_results:
-            row = {
-                'event_id': f"LAB_{lab.get('patient_id', '')}_{timestamp.timestamp()}",
-                'patient_id': lab.get('patient_id', ''),
-                'event_type': 'LAB',
-                'event_date': lab.get('test_datetime'),
-                'event_value': str(lab.get('value', '')),
-                'event_status': lab.get('status', ''),
-                'event_details': {
-                    'test_type': lab.get('test_type', ''),
-                    'reference_range': lab.get('reference_range', '')
-                },
-                'created_timestamp': timestamp.isoformat()
-            }
+        for lab in self._records(lab_results):
+            row = lab_event_row(lab)
+            row['event_id'] = f"LAB_{row['patient_id']}_{timestamp.timestamp()}"
+            row['created_timestamp'] = timestamp.isoformat()
+            rows.append(row)
+        
+        for condition in self._records(conditions):
+            row = condition_event_row(condition)
+            row['event_id'] = f"CONDITION_{row['patient_id']}_{timestamp.timestamp()}"
+            row['created_timestamp'] = timestamp.isoformat()
+            rows.append(row)
+        
+        for encounter in self._records(encounters):
+            row = encounter_event_row(encounter)
+            row['event_id'] = f"ENCOUNTER_{encounter.get('encounter_id', '')}"
+            row['created_timestamp'] = timestamp.isoformat()
             rows.append(row)
         
+        for medication in self._records(medications):
+            row = medication_event_row(medication)
+            row['event_id'] = f"MEDICATION_{row['patient_id']}_{timestamp.timestamp()}"
+            row['created_timestamp'] = timestamp.isoformat()
+            rows.append(row)
+        
+        if not rows:
+            return {'success': True, 'count': 0}
+        
         try:
             errors = self.client.insert_rows_json(table_id, rows)
             
             if errors:
                 logger.error(f"Errors inserting events: {errors}")
-                return {'success': False, 'errors': errors}
+                return {'success': False, 'errors': errors,
+                        'failed_patient_ids': self._failed_patient_ids(rows, errors)}
             else:
                 logger.info(f"Loaded {len(rows)} clinical events to BigQuery")
                 return {'success': True, 'count': len(rows)}
                 
         except Exception as e:
             logger.error(f"Error loading events to BigQuery: {e}")
-            return {'success': False, 'error': str(e)}
+            return {'success': False, 'error': str(e),
+                    'failed_patient_ids': self._failed_patient_ids(rows)}
+    
+    @staticmethod
+    def _failed_patient_ids(rows: List[Dict], errors: List[Dict] = None) -> List[str]:
+        """Patients of rows rejected by insert_rows_json (all rows when the insert failed as a whole)"""
+        if errors is None:
+            failed_rows = rows
+        else:
+            failed_rows = [rows[error['index']] for error in errors if error.get('index') is not None]
+        return list(dict.fromkeys(row.get('patient_id') for row in failed_rows))
+    
+    @staticmethod
+    def _records(records: Records) -> List[Dict]:
+        """Row dicts of a list of records or a DataFrame (columnar batches are only serialized here)"""
+        if records is None:
+            return []
+        if isinstance(records, pd.DataFrame):
+            return frame_to_records(records)
+        return records
     
     def load_risk_scores(self, risk_assessments: List[Dict]) -> Dict:
         """Load risk assessments to BigQuery"""
@@ -100,28 +138,57 @@ class BigQueryLoader:
         timestamp = datetime.utcnow()
         
         for risk in risk_assessments:
-            row = {
-                'patient_id': risk.get('patient_id', ''),
-                'risk_level': risk.get('Risk_Level__c', ''),
-                'risk_score': int(risk.get('Risk_Score__c', 0)),
-                'risk_factors': risk.get('Risk_Factors__c', ''),
-                'assessment_date': risk.get('Assessment_Date__c'),
-                'created_timestamp': timestamp.isoformat()
-            }
+            row = risk_history_row(risk)
+            row['created_timestamp'] = timestamp.isoformat()
             rows.append(row)
         
+        # Nothing was rescored (e.g. incremental risk mode with unchanged inputs)
+        if not rows:
+            return {'success': True, 'count': 0}
+        
         try:
             errors = self.client.insert_rows_json(table_id, rows)
             
             if errors:
                 logger.error(f"Errors inserting risks: {errors}")
-                return {'success': False, 'errors': errors}
+                return {'success': False, 'errors': errors,
+                        'failed_patient_ids': self._failed_patient_ids(rows, errors)}
             else:
                 logger.info(f"Loaded {len(rows)} risk assessments to BigQuery")
                 return {'success': True, 'count': len(rows)}
                 
         except Exception as e:
             logger.error(f"Error loading risks to BigQuery: {e}")
+            return {'success': False, 'error': str(e),
+                    'failed_patient_ids': self._failed_patient_ids(rows)}
+    
+    def load_lab_trends(self, trends: pd.DataFrame) -> Dict:
+        """Load per patient and test type lab trend features to BigQuery"""
+        table_id = f"{self.project_id}.{self.dataset_id}.lab_trends"
+        
+        rows = []
+        timestamp = datetime.utcnow()
+        
+        for trend in frame_to_records(trends):
+            row = lab_trend_row(trend)
+            row['created_timestamp'] = timestamp.isoformat()
+            rows.append(row)
+        
+        if not rows:
+            return {'success': True, 'count': 0}
+        
+        try:
+            errors = self.client.insert_rows_json(table_id, rows)
+            
+            if errors:
+                logger.error(f"Errors inserting lab trends: {errors}")
+                return {'success': False, 'errors': errors}
+            else:
+                logger.info(f"Loaded {len(rows)} lab trends to BigQuery")
+                return {'success': True, 'count': len(rows)}
+                
+        except Exception as e:
+            logger.error(f"Error loading lab trends to BigQuery: {e}")
             return {'success': False, 'error': str(e)}
     
     def query_patients(self, limit: int = 10) -> List[Dict]:
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_STORE_PATH = "data/state/patient_ids.sqlite"
+# Entries not verified against Salesforce for this long are checked again before reuse
+DEFAULT_MAX_AGE_DAYS = 7
+
+# Stay under SQLite's default limit on bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def payload_digest(payload: Dict) -> str:
+    """Hash of a patient's Salesforce payload, to tell whether it changed since it was upserted"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class PatientIdStore:
+    """Persistent Patient_ID__c -> Salesforce Id map (with payload digest and last-verified time) across runs"""
+
+    def __init__(self, db_path: str = DEFAULT_STORE_PATH, max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        self.db_path = Path(db_path)
+        self.max_age = max_age_days * 86400
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # One connection shared by loader threads, serialized by the lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS patient_ids ("
+                "patient_id TEXT PRIMARY KEY, sf_id TEXT NOT NULL, "
+                "payload_digest TEXT NOT NULL, last_verified REAL NOT NULL)"
+            )
+
+    def lookup(self, patient_ids: Iterable[str]) -> Dict[str, Tuple[str, str, bool]]:
+        """
+        Stored entries of the given patients
+        Returns: patient_id -> (sf_id, payload_digest, fresh), where fresh
+        means verified within max_age; patients without an entry are left out
+        """
+        patient_ids = list(dict.fromkeys(patient_ids))
+        cutoff = time.time() - self.max_age
+        entries = {}
+
+        with self.lock:
+            for start in range(0, len(patient_ids), _LOOKUP_CHUNK):
+                chunk = patient_ids[start:start + _LOOKUP_CHUNK]
+                rows = self.conn.execute(
+                    "SELECT patient_id, sf_id, payload_digest, last_verified FROM patient_ids "
+                    f"WHERE patient_id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for patient_id, sf_id, digest, last_verified in rows:
+                    entries[patient_id] = (sf_id, digest, last_verified >= cutoff)
+
+        return entries
+
+    def record(self, entries: Dict[str, Tuple[str, str]]):
+        """Store patient_id -> (sf_id, payload_digest) as verified now"""
+        if not entries:
+            return
+
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO patient_ids (patient_id, sf_id, payload_digest, last_verified) "
+                "VALUES (?, ?, ?, ?)",
+                [(patient_id, sf_id, digest, now) for patient_id, (sf_id, digest) in entries.items()]
+            )
+        logger.debug(f"Stored Salesforce IDs of {len(entries)} patients in {self.db_path}")
+
+    def forget(self, patient_ids: Iterable[str]):
+        """Drop entries (e.g. records deleted in Salesforce) so those patients are upserted again"""
+        patient_ids = [(patient_id,) for patient_id in set(patient_ids) if patient_id]
+        if not patient_ids:
+            return
+
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM patient_ids WHERE patient_id = ?", patient_ids)
+        logger.info(f"Dropped {len(patient_ids)} stale patient Salesforce IDs from {self.db_path}")
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM patient_ids").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import deque
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Salesforce allows 25 concurrent long-running requests per org
+DEFAULT_MAX_CONCURRENT = 25
+DAY_SECONDS = 86400
+
+
+class ApiLimitExceeded(RuntimeError):
+    """The 24-hour API request budget is used up"""
+
+
+class RateLimiter:
+    """
+    Org-wide limit on Salesforce API requests, shared by loader threads
+    Each request holds one of max_concurrent slots, takes a token from a
+    bucket refilled at requests_per_second (up to burst tokens), and counts
+    against daily_limit requests in any rolling 24 hours. Running out of the
+    daily budget raises ApiLimitExceeded instead of waiting for hours.
+    A request can take several HTTP calls (query_all pages, bulk polls); with
+    count_session() every call after the first also takes a token and counts.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, requests_per_second: float = None,
+                 burst: int = None, daily_limit: int = None):
+        self.max_concurrent = max_concurrent
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1, int(requests_per_second or 1))
+        # None = no daily cap (SalesforceLoader seeds it from the org's remaining requests)
+        self.daily_limit = daily_limit
+
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        # (minute, requests) for the last 24 hours; a bounded alternative to one timestamp per request
+        self._minutes = deque()
+        self._window_count = 0
+        # Per thread: whether the slot it holds has an acquired-but-unused call
+        self._local = threading.local()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def acquire(self):
+        """Wait for a request slot and a token, and count the request against the daily budget"""
+        self._slots.acquire()
+        try:
+            self._take_token()
+            self._count_request()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._local.prepaid = True
+
+    def release(self):
+        self._local.prepaid = False
+        self._slots.release()
+
+    def count_call(self):
+        """Count one HTTP call; the first call of an acquired request was counted by acquire()"""
+        if getattr(self._local, 'prepaid', False):
+            self._local.prepaid = False
+            return
+        self._take_token()
+        self._count_request()
+
+    def count_session(self, session):
+        """Route every call of a requests session through count_call()"""
+        request = session.request
+
+        def counted_request(*args, **kwargs):
+            self.count_call()
+            return request(*args, **kwargs)
+
+        session.request = counted_request
+        return session
+
+    def requests_last_24h(self) -> int:
+        with self._lock:
+            self._expire(int(time.time() // 60))
+            return self._window_count
+
+    def _count_request(self):
+        minute = int(time.time() // 60)
+        with self._lock:
+            self._expire(minute)
+            if self.daily_limit is not None and self._window_count >= self.daily_limit:
+                raise ApiLimitExceeded(f"API request budget of {self.daily_limit} per 24 hours used up")
+
+            if self._minutes and self._minutes[-1][0] == minute:
+                self._minutes[-1][1] += 1
+            else:
+                self._minutes.append([minute, 1])
+            self._window_count += 1
+
+    def _expire(self, minute: int):
+        while self._minutes and self._minutes[0][0] <= minute - DAY_SECONDS // 60:
+            self._window_count -= self._minutes.popleft()[1]
+
+    def _take_token(self):
+        if not self.requests_per_second:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.requests_per_second)
+                self._refilled = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.requests_per_second
+            time.sleep(wait)
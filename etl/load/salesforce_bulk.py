@@ -0,0 +1,236 @@
+import csv
+import io
+import time
+import requests
+from datetime import date, datetime
+from collections import defaultdict, deque
+from typing import Dict, Iterator, List, Tuple
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Bulk API 2.0 takes at most 150 MB of base64-encoded CSV per job, i.e. about 100 MB raw
+DEFAULT_MAX_JOB_BYTES = 100 * 1024 * 1024
+# Status polling starts at poll_interval seconds and backs off to MAX_POLL_INTERVAL
+DEFAULT_POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 30.0
+DEFAULT_JOB_TIMEOUT = 3600
+
+FINAL_STATES = ('JobComplete', 'Failed', 'Aborted')
+# An empty cell leaves a field unchanged; this marker sets it to null (as None/'' do over REST)
+NULL_VALUE = '#N/A'
+# Result row key holding the position of its record in load()'s input (None if it could not be matched)
+RECORD_INDEX = 'record_index'
+
+
+def csv_value(value) -> str:
+    """Format a payload value as a Bulk API 2.0 CSV cell"""
+    # value != value catches NaN of any float type
+    if value is None or value == '' or value != value:
+        return NULL_VALUE
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class SalesforceBulkClient:
+    """Run record loads as Bulk API 2.0 ingest jobs (CSV upload, status polling, per-record results)"""
+
+    def __init__(self, base_url: str, session_id: str, session: requests.Session = None,
+                 max_job_bytes: int = DEFAULT_MAX_JOB_BYTES, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 job_timeout: float = DEFAULT_JOB_TIMEOUT):
+        # REST base such as https://<instance>.my.salesforce.com/services/data/v59.0/ (or a local fake)
+        self.jobs_url = base_url.rstrip('/') + '/jobs/ingest'
+        self.session = session or requests.Session()
+        self.headers = {'Authorization': f'Bearer {session_id}'}
+        self.max_job_bytes = max_job_bytes
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+
+    def load(self, sobject: str, operation: str, records: List[Dict],
+             external_id_field: str = None) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Insert or upsert records with as many ingest jobs as their CSV needs
+        All jobs are uploaded before polling, so Salesforce processes them in
+        parallel. Records of a job that could not be created, uploaded or
+        finished are reported as failed with the job's error.
+        Returns: (successful rows, failed rows) as dicts of the result CSV
+        columns: sf__Id (successful) or sf__Error (failed) plus the uploaded
+        fields, as strings, and RECORD_INDEX, the position of the row's record
+        in records
+        """
+        successful, failed = [], []
+        jobs = []
+
+        for csv_text, rows in self._csv_chunks(records):
+            try:
+                jobs.append((self._submit_job(sobject, operation, external_id_field, csv_text), rows))
+            except Exception as e:
+                logger.error(f"Error submitting {sobject} bulk job: {e}")
+                failed.extend(dict(row, sf__Error=str(e)) for row in rows)
+
+        if jobs:
+            logger.info(f"Submitted {len(jobs)} {sobject} bulk {operation} jobs for {len(records)} records")
+
+        states = self._wait([job_id for job_id, _ in jobs])
+
+        for job_id, rows in jobs:
+            try:
+                job_successful, job_failed = self._job_results(job_id, states.get(job_id, {}))
+                self._match_records(job_successful + job_failed, rows)
+                successful.extend(job_successful)
+                failed.extend(job_failed)
+            except Exception as e:
+                logger.error(f"Error reading results of bulk job {job_id}: {e}")
+                failed.extend(dict(row, sf__Error=str(e)) for row in rows)
+
+        return successful, failed
+
+    @staticmethod
+    def _match_records(results: List[Dict], rows: List[Dict]):
+        """
+        Set RECORD_INDEX on a job's result rows
+        Bulk API 2.0 returns results in no particular order and the objects
+        have no field to carry a row id, but every result row repeats the
+        uploaded cells, so a row's formatted values are its key; rows
+        uploaded more than once are matched in turn.
+        """
+        fields = [field for field in rows[0] if field != RECORD_INDEX] if rows else []
+        positions = defaultdict(deque)
+        for row in rows:
+            positions[tuple(row[field] for field in fields)].append(row[RECORD_INDEX])
+
+        for result in results:
+            matches = positions.get(tuple(result.get(field) or '' for field in fields))
+            result[RECORD_INDEX] = matches.popleft() if matches else None
+
+    def _csv_chunks(self, records: List[Dict]) -> Iterator[Tuple[str, List[Dict]]]:
+        """(CSV text, formatted rows with their RECORD_INDEX) per job, each under max_job_bytes"""
+        # Payload projectors may drop None fields, so the header is the union of keys;
+        # fields a record does not have are left empty (unchanged)
+        fields = list(dict.fromkeys(field for record in records for field in record))
+        header = self._csv_line(fields)
+        lines, rows, size = [header], [], len(header.encode('utf-8'))
+
+        for index, record in enumerate(records):
+            row = {field: csv_value(record[field]) if field in record else '' for field in fields}
+            line = self._csv_line(row.values())
+            line_size = len(line.encode('utf-8'))
+
+            if rows and size + line_size > self.max_job_bytes:
+                yield ''.join(lines), rows
+                lines, rows, size = [header], [], len(header.encode('utf-8'))
+
+            lines.append(line)
+            rows.append(dict(row, **{RECORD_INDEX: index}))
+            size += line_size
+
+        if rows:
+            yield ''.join(lines), rows
+
+    @staticmethod
+    def _csv_line(values) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerow(values)
+        return buffer.getvalue()
+
+    def _submit_job(self, sobject: str, operation: str, external_id_field: str, csv_text: str) -> str:
+        """Create a job, upload its CSV and mark the upload complete; returns the job id"""
+        job = {'object': sobject, 'operation': operation, 'contentType': 'CSV', 'lineEnding': 'LF'}
+        if external_id_field:
+            job['externalIdFieldName'] = external_id_field
+
+        response = self.session.post(self.jobs_url, json=job, headers=self.headers)
+        response.raise_for_status()
+        job_id = response.json()['id']
+
+        try:
+            response = self.session.put(f"{self.jobs_url}/{job_id}/batches", data=csv_text.encode('utf-8'),
+                                        headers={**self.headers, 'Content-Type': 'text/csv'})
+            response.raise_for_status()
+            self._set_state(job_id, 'UploadComplete')
+        except Exception:
+            # Don't leave an open job behind in the org
+            self._abort(job_id)
+            raise
+
+        logger.debug(f"Uploaded {sobject} bulk job {job_id}")
+        return job_id
+
+    def _set_state(self, job_id: str, state: str):
+        response = self.session.patch(f"{self.jobs_url}/{job_id}", json={'state': state}, headers=self.headers)
+        response.raise_for_status()
+
+    def _abort(self, job_id: str):
+        try:
+            self._set_state(job_id, 'Aborted')
+        except Exception as e:
+            logger.warning(f"Could not abort bulk job {job_id}: {e}")
+
+    def _wait(self, job_ids: List[str]) -> Dict[str, Dict]:
+        """Poll jobs until they finish (aborting them after job_timeout); returns job id -> last status"""
+        states = {}
+        pending = list(job_ids)
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.job_timeout
+
+        while pending:
+            for job_id in list(pending):
+                try:
+                    response = self.session.get(f"{self.jobs_url}/{job_id}", headers=self.headers)
+                    response.raise_for_status()
+                    states[job_id] = response.json()
+                except Exception as e:
+                    # Transient errors are retried on the next poll, up to job_timeout
+                    logger.warning(f"Error polling bulk job {job_id}: {e}")
+                    continue
+
+                if states[job_id].get('state') in FINAL_STATES:
+                    pending.remove(job_id)
+
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                for job_id in pending:
+                    logger.error(f"Bulk job {job_id} did not finish within {self.job_timeout}s, aborting")
+                    self._abort(job_id)
+                    states[job_id] = {'state': 'Aborted', 'errorMessage': f"Timed out after {self.job_timeout}s"}
+                break
+
+            time.sleep(interval)
+            interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+
+        return states
+
+    def _job_results(self, job_id: str, status: Dict) -> Tuple[List[Dict], List[Dict]]:
+        """Successful and failed rows of a finished job (unprocessed rows count as failed)"""
+        state = status.get('state')
+        successful = self._result_rows(job_id, 'successfulResults')
+        failed = self._result_rows(job_id, 'failedResults')
+
+        if state != 'JobComplete':
+            error = status.get('errorMessage') or f"Bulk job {state}"
+            unprocessed = self._result_rows(job_id, 'unprocessedrecords')
+            failed.extend(dict(row, sf__Error=error) for row in unprocessed)
+            logger.error(f"Bulk job {job_id} ended in state {state}: {error}")
+
+        logger.info(f"Bulk job {job_id}: {len(successful)} success, {len(failed)} failed")
+        return successful, failed
+
+    def _result_rows(self, job_id: str, result_type: str) -> List[Dict]:
+        """Result CSV rows, following Sforce-Locator pages"""
+        rows = []
+        params = {}
+
+        while True:
+            response = self.session.get(f"{self.jobs_url}/{job_id}/{result_type}/", params=params,
+                                        headers=self.headers)
+            response.raise_for_status()
+            rows.extend(csv.DictReader(io.StringIO(response.content.decode('utf-8'))))
+
+            locator = response.headers.get('Sforce-Locator')
+            if not locator or locator == 'null':
+                return rows
+            params = {'locator': locator}
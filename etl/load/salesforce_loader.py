@@ -1,17 +1,53 @@
+import json
 import os
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Iterable, Iterator, List, Dict, Tuple
+from urllib.parse import quote_plus
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from simple_salesforce import Salesforce
+from etl.field_mappings import care_plan_payload, lab_result_payload, patient_payload, risk_assessment_payload
 from utils import setup_logger
+from .patient_id_store import PatientIdStore, payload_digest
+from .rate_limiter import RateLimiter
+from .salesforce_bulk import RECORD_INDEX, SalesforceBulkClient
 
 load_dotenv(override=True)
 logger = setup_logger(__name__)
 
+# 'rest': one request per record; 'collections': sObject Collections requests of up to
+# COLLECTION_SIZE records; 'bulk': Bulk API 2.0 CSV ingest jobs
+LOAD_APIS = ['rest', 'collections', 'bulk']
+COLLECTION_SIZE = 200
+
+# (success, salesforce_id, message) per record
+Outcome = Tuple[bool, str, str]
+
+# Child insert errors meaning the Patient__c record no longer exists (deleted or merged)
+STALE_REFERENCE_ERRORS = ('ENTITY_IS_DELETED', 'INVALID_CROSS_REFERENCE_KEY')
+
+# Share of the org's remaining daily API requests left to other integrations
+DAILY_API_RESERVE = 0.2
+
+# REST query URIs (SOQL included, URL-encoded) are limited to 16,384 characters;
+# keep some room for the instance URL and API version
+SOQL_URI_BUDGET = 16000
+
+
+def soql_literal(value: str) -> str:
+    """Quoted SOQL string literal"""
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
 class SalesforceLoader:
     """Load data into Salesforce via REST API"""
     
-    def __init__(self):
+    def __init__(self, api: str = 'rest', id_store: PatientIdStore = None, workers: int = 1,
+                 rate_limiter: RateLimiter = None):
         """Initialize Salesforce connection"""
+        if api not in LOAD_APIS:
+            raise ValueError(f"Unknown Salesforce load API {api!r}; expected one of {LOAD_APIS}")
+        
         try:
             self.sf = Salesforce(
                 os.getenv('SALESFORCE_USERNAME'),
@@ -23,10 +59,64 @@ class SalesforceLoader:
         except Exception as e:
             logger.error(f"Failed to connect to Salesforce: {e}")
             raise
+        
+        self.api = api
+        # With an id store, patients already in Salesforce (unchanged, recently verified) are not upserted
+        self.id_store = id_store
+        # Patients whose last upsert failed; child records never look them up in Salesforce
+        self.failed_patient_ids = set()
+        
+        # Concurrent mode runs up to `workers` requests at once; every API call goes through the
+        # rate limiter (shared by all threads), whose daily cap defaults to the org's remaining requests.
+        # Each HTTP call on the session counts, including query_all pages, bulk polls and limits()
+        self.workers = workers
+        self.limiter = rate_limiter or nullcontext()
+        if rate_limiter is not None:
+            rate_limiter.count_session(self.sf.session)
+            if rate_limiter.daily_limit is None:
+                rate_limiter.daily_limit = self._daily_api_budget()
+        if workers > 1:
+            # Keep one pooled connection per worker instead of requests' default of 10
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            self.sf.session.mount('https://', adapter)
+        
+        # Batch loads go through Bulk API 2.0 jobs in bulk mode; SALESFORCE_BULK_URL
+        # points them at another endpoint (e.g. a local fake) instead of the org's REST base
+        self.bulk = None
+        if api == 'bulk':
+            self.bulk = SalesforceBulkClient(os.getenv('SALESFORCE_BULK_URL') or self.sf.base_url,
+                                             self.sf.session_id, session=self.sf.session)
+    
+    def _daily_api_budget(self) -> int:
+        """Daily request cap for this loader: the org's remaining API requests, less DAILY_API_RESERVE"""
+        try:
+            daily = self.sf.limits()['DailyApiRequests']
+            budget = int(daily['Remaining'] * (1 - DAILY_API_RESERVE))
+            logger.info(f"API budget: {budget} of {daily['Remaining']} remaining daily requests "
+                       f"(org limit {daily['Max']})")
+            return budget
+        except Exception as e:
+            logger.warning(f"Could not read the org's API limits, not capping daily requests: {e}")
+            return None
+    
+    def _map_requests(self, func: Callable, items: List) -> Iterable:
+        """
+        func over items, on a pool of `workers` threads in concurrent mode
+        Results come back in item order, so callers aggregate them into the
+        summary dicts in their own thread; func must not raise.
+        """
+        if self.workers <= 1 or len(items) <= 1:
+            return map(func, items)
+        
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sf-load') as pool:
+            return list(pool.map(func, items))
     
-    def upsert_patient(self, patient_data: Dict) -> Tuple[bool, str, str]:
+    def upsert_patient(self, patient_data: Dict, resolve_id: bool = True) -> Tuple[bool, str, str]:
         """
         Upsert a single patient record
+        If the response carries no id and resolve_id is False, the patient
+        is reported as upserted with salesforce_id None and left for the
+        caller to resolve (upsert_patients_batch does so in bulk).
         Returns: (success, salesforce_id, message)
         """
         try:
@@ -36,18 +126,24 @@ class SalesforceLoader:
             if not patient_id:
                 return False, None, "Missing Patient_ID__c"
             
-            # Create a copy without Patient_ID__c for the upsert
-            upsert_data = {k:v for k, v in patient_data.items() if k != 'Patient_ID__c'}
+            # Patient_ID__c is the upsert key, not part of the body
+            upsert_data = patient_payload(patient_data)
             
             # Upsert using Patient_ID__c as external ID
-            result = self.sf.Patient_Medical_Record__c.upsert(
-                f"Patient_ID__c/{patient_id}",
-                upsert_data
-            )
+            with self.limiter:
+                result = self.sf.Patient_Medical_Record__c.upsert(
+                    f"Patient_ID__c/{patient_id}",
+                    upsert_data
+                )
 
             # Handle different result formats 
             # result variants: int (200/201), dict with 'id', dict with 'created' 
             sf_id = None 
+            
+            response_id = result.get('id') if isinstance(result, dict) else None
+            if not resolve_id and not response_id and isinstance(result, (dict, int)):
+                # Left to the caller, which resolves many patients per query
+                return True, None, "Success"
 
             # 1) New record created or existing updated (result is dict)
             if isinstance(result, dict):
@@ -56,14 +152,16 @@ class SalesforceLoader:
                 if not sf_id:
                     # Try to query to get the ID 
                     query = f"SELECT Id FROM Patient_Medical_Record__c WHERE Patient_ID__c = '{patient_id}' LIMIT 1"
-                    query_result = self.sf.query(query)
+                    with self.limiter:
+                        query_result = self.sf.query(query)
                     if query_result['records']:
                         sf_id = query_result['records'][0]['Id']
             
             # 2) HTTP status code returned (result is a numeric code)
             elif isinstance(result, int):
                 query = f"SELECT Id FROM Patient_Medical_Record__c WHERE Patient_ID__c = '{patient_id}' LIMIT 1" 
-                query_result = self.sf.query(query)
+                with self.limiter:
+                    query_result = self.sf.query(query)
                 if query_result['records']:
                     sf_id = query_result['records'][0]['Id']
                 else:
@@ -82,11 +180,17 @@ class SalesforceLoader:
             logger.error(f"Error upserting patient {patient_data.get('Patient_ID__c')}: {error_msg}")
             return False, None, error_msg
     
-    def upsert_patients_batch(self, patients: List[Dict]) -> Dict:
+    def upsert_patients_batch(self, patients: List[Dict], duplicates: Dict = None) -> Dict:
         """
         Upsert multiple patients
+        duplicates (from PatientDeduplicator.find_clusters) maps duplicate
+        patient ids to their canonical id: duplicates are not upserted but
+        resolve to the canonical record in patient_id_map.
         Returns: Summary with success/failure counts
         """
+        duplicates = duplicates or {}
+        patients = [patient for patient in patients if patient.get('Patient_ID__c') not in duplicates]
+        
         results = {
             'total': len(patients),
             'success': 0,
@@ -97,11 +201,26 @@ class SalesforceLoader:
         
         logger.info(f"Starting batch upsert of {len(patients)} patients")
         
-        for patient in patients:
+        digests = {}
+        if self.id_store is not None:
+            patients, digests = self._reuse_stored_ids(patients, results)
+        
+        if self.bulk is not None:
+            self._bulk_upsert_patients(patients, results)
+            outcomes = []
+        elif self.api == 'collections':
+            outcomes = self._upsert_patients_collections(patients)
+        else:
+            # Ids missing from upsert responses are looked up together afterwards, not one query each
+            outcomes = self._map_requests(lambda patient: self.upsert_patient(patient, resolve_id=False), patients)
+        
+        unresolved = []
+        for patient, (success, sf_id, message) in zip(patients, outcomes):
             patient_id = patient.get('Patient_ID__c')
-            success, sf_id, message = self.upsert_patient(patient)
             
-            if success:
+            if success and not sf_id:
+                unresolved.append(patient_id)
+            elif success:
                 results['success'] += 1
                 results['patient_id_map'][patient_id] = sf_id
             else:
@@ -111,29 +230,242 @@ class SalesforceLoader:
                     'error': message
                 })
         
+        if unresolved:
+            resolved = self.resolve_patient_ids(unresolved)
+            for patient_id in unresolved:
+                if patient_id in resolved:
+                    results['success'] += 1
+                    results['patient_id_map'][patient_id] = resolved[patient_id]
+                else:
+                    results['failed'] += 1
+                    results['errors'].append({
+                        'patient_id': patient_id,
+                        'error': "Could not resolve Salesforce ID after upsert"
+                    })
+        
+        if self.id_store is not None:
+            self.id_store.record({patient_id: (results['patient_id_map'][patient_id], digest)
+                                  for patient_id, digest in digests.items()
+                                  if patient_id in results['patient_id_map']})
+        
+        failed_ids = {error['patient_id'] for error in results['errors']}
+        for duplicate_id, canonical_id in duplicates.items():
+            if canonical_id in results['patient_id_map']:
+                results['patient_id_map'][duplicate_id] = results['patient_id_map'][canonical_id]
+            elif canonical_id in failed_ids:
+                failed_ids.add(duplicate_id)
+        self.failed_patient_ids.difference_update(results['patient_id_map'])
+        self.failed_patient_ids.update(failed_ids)
+        
         logger.info(f"Batch upsert complete: {results['success']} success, {results['failed']} failed")
         return results
     
+    def _reuse_stored_ids(self, patients: List[Dict], results: Dict) -> Tuple[List[Dict], Dict[str, str]]:
+        """
+        Take Salesforce IDs of unchanged patients from the id store
+        Entries older than the store's max age are checked first, with
+        batched queries; ids no longer found are upserted again.
+        Returns: (patients still to upsert, their payload digests)
+        """
+        digests = {}
+        for patient in patients:
+            patient_id = patient.get('Patient_ID__c')
+            if patient_id:
+                digests[patient_id] = payload_digest(patient_payload(patient))
+        
+        stored = self.id_store.lookup(digests)
+        reusable = {patient_id: sf_id for patient_id, (sf_id, digest, _) in stored.items()
+                    if digest == digests[patient_id]}
+        
+        stale = [patient_id for patient_id in reusable if not stored[patient_id][2]]
+        if stale:
+            verified = self.resolve_patient_ids(stale)
+            for patient_id in stale:
+                if verified.get(patient_id) != reusable[patient_id]:
+                    del reusable[patient_id]
+            self.id_store.record({patient_id: (reusable[patient_id], digests[patient_id])
+                                  for patient_id in stale if patient_id in reusable})
+        
+        to_upsert = []
+        for patient in patients:
+            patient_id = patient.get('Patient_ID__c')
+            if patient_id in reusable:
+                results['success'] += 1
+                results['patient_id_map'][patient_id] = reusable[patient_id]
+            else:
+                to_upsert.append(patient)
+        
+        logger.info(f"Reused stored Salesforce IDs for {len(reusable)} unchanged patients "
+                   f"({len(stale)} re-verified), {len(to_upsert)} to upsert")
+        return to_upsert, {patient_id: digests[patient_id] for patient_id in digests if patient_id not in reusable}
+    
+    def resolve_patient_ids(self, patient_ids: List[str]) -> Dict[str, str]:
+        """
+        Look up Salesforce IDs of patients by Patient_ID__c
+        Ids go into as few IN (...) queries as the query URI length allows
+        (a few hundred ids each) instead of one query per patient.
+        Returns: Patient_ID__c -> Salesforce ID for the patients found
+        """
+        def query_ids(id_list: str) -> List[Dict]:
+            query = f"SELECT Id, Patient_ID__c FROM Patient_Medical_Record__c WHERE Patient_ID__c IN ({id_list})"
+            try:
+                with self.limiter:
+                    return self.sf.query_all(query)['records']
+            except Exception as e:
+                logger.error(f"Error resolving patient Salesforce IDs: {e}")
+                return []
+        
+        resolved = {}
+        for records in self._map_requests(query_ids, list(self._soql_in_lists(list(dict.fromkeys(patient_ids))))):
+            resolved.update((record['Patient_ID__c'], record['Id']) for record in records)
+        
+        logger.info(f"Resolved {len(resolved)} of {len(set(patient_ids))} patient Salesforce IDs")
+        return resolved
+    
+    def add_missing_patient_ids(self, patient_ids: Iterable[str], patient_id_map: Dict) -> int:
+        """
+        Add Salesforce IDs of patients missing from patient_id_map (updated in place)
+        Recently verified ids come from the id store; stale entries and
+        store misses are looked up with resolve_patient_ids.
+        Returns: number of ids added
+        """
+        missing = [patient_id for patient_id in dict.fromkeys(patient_ids)
+                   if patient_id and patient_id not in patient_id_map]
+        if not missing:
+            return 0
+        
+        found = {}
+        stored = {}
+        if self.id_store is not None:
+            stored = self.id_store.lookup(missing)
+            found = {patient_id: sf_id for patient_id, (sf_id, _, fresh) in stored.items() if fresh}
+        
+        unresolved = [patient_id for patient_id in missing if patient_id not in found]
+        if unresolved:
+            resolved = self.resolve_patient_ids(unresolved)
+            found.update(resolved)
+            
+            if stored:
+                # Stale entries that still match are verified again; the others are dropped
+                stale = [patient_id for patient_id in unresolved if patient_id in stored]
+                self.id_store.record({patient_id: (resolved[patient_id], stored[patient_id][1])
+                                      for patient_id in stale if resolved.get(patient_id) == stored[patient_id][0]})
+                self.id_store.forget(patient_id for patient_id in stale
+                                     if resolved.get(patient_id) != stored[patient_id][0])
+        
+        patient_id_map.update(found)
+        return len(found)
+    
+    @staticmethod
+    def _soql_in_lists(values: List[str]) -> Iterator[str]:
+        """Comma-separated SOQL literals, split so each query stays under SOQL_URI_BUDGET once URL-encoded"""
+        # Room for the rest of the query around the IN list
+        budget = SOQL_URI_BUDGET - 500
+        literals, size = [], 0
+        
+        for value in values:
+            literal = soql_literal(value)
+            literal_size = len(quote_plus(literal)) + len(quote_plus(','))
+            if literals and size + literal_size > budget:
+                yield ','.join(literals)
+                literals, size = [], 0
+            literals.append(literal)
+            size += literal_size
+        
+        if literals:
+            yield ','.join(literals)
+    
+    def _upsert_patients_collections(self, patients: List[Dict]) -> List[Outcome]:
+        """Upsert patients by Patient_ID__c with sObject Collections requests; one outcome per patient"""
+        # A request may not repeat an external id, so each patient id is sent once with its
+        # last payload (as sequential upserts would leave it) and repeats share the outcome
+        records = {}
+        for patient in patients:
+            patient_id = patient.get('Patient_ID__c')
+            if patient_id:
+                records[patient_id] = {'Patient_ID__c': patient_id, **patient_payload(patient)}
+        
+        saved = dict(zip(records, self._save_collection('Patient_Medical_Record__c', list(records.values()),
+                                                        external_id_field='Patient_ID__c')))
+        
+        return [saved[patient.get('Patient_ID__c')] if patient.get('Patient_ID__c')
+                else (False, None, "Missing Patient_ID__c") for patient in patients]
+    
+    def _save_collection(self, sobject: str, records: List[Dict], external_id_field: str = None) -> List[Outcome]:
+        """
+        Create (or upsert by external_id_field) records through sObject Collections
+        Records go COLLECTION_SIZE per request with allOrNone off, so one bad
+        record does not fail the others; a failed request fails all of its
+        records with the request error.
+        Returns: one (success, salesforce_id, message) per record, in order
+        """
+        if external_id_field:
+            path, method = f"composite/sobjects/{sobject}/{external_id_field}", 'PATCH'
+        else:
+            path, method = "composite/sobjects", 'POST'
+        
+        def save_chunk(chunk: List[Dict]) -> List[Outcome]:
+            body = {
+                'allOrNone': False,
+                'records': [{'attributes': {'type': sobject}, **record} for record in chunk]
+            }
+            
+            try:
+                # Results come back in request order
+                with self.limiter:
+                    saved = self.sf.restful(path, method=method, data=json.dumps(body, default=str))
+                return [self._collection_outcome(result) for result in saved]
+            except Exception as e:
+                error_msg = str(e)
+                logger.error(f"Error saving {len(chunk)} {sobject} records: {error_msg}")
+                return [(False, None, error_msg)] * len(chunk)
+        
+        chunks = [records[start:start + COLLECTION_SIZE] for start in range(0, len(records), COLLECTION_SIZE)]
+        outcomes = [outcome for chunk_outcomes in self._map_requests(save_chunk, chunks) for outcome in chunk_outcomes]
+        
+        logger.debug(f"Saved {len(records)} {sobject} records via sObject Collections")
+        return outcomes
+    
+    @staticmethod
+    def _collection_outcome(result: Dict) -> Outcome:
+        """(success, salesforce_id, message) of one sObject Collections save result"""
+        if result.get('success'):
+            return True, result.get('id'), "Success"
+        errors = '; '.join(f"{error.get('statusCode')}: {error.get('message')}" for error in result.get('errors', []))
+        return False, None, errors or "Unknown error"
+    
+    def _bulk_upsert_patients(self, patients: List[Dict], results: Dict):
+        """Upsert patients as Bulk API 2.0 jobs keyed by Patient_ID__c, filling in results"""
+        rows = []
+        for patient in patients:
+            patient_id = patient.get('Patient_ID__c')
+            if not patient_id:
+                results['failed'] += 1
+                results['errors'].append({'patient_id': patient_id, 'error': "Missing Patient_ID__c"})
+                continue
+            rows.append({'Patient_ID__c': patient_id, **patient_payload(patient)})
+        
+        successful, failed = self.bulk.load('Patient_Medical_Record__c', 'upsert', rows,
+                                            external_id_field='Patient_ID__c')
+        
+        results['success'] += len(successful)
+        results['patient_id_map'].update((row['Patient_ID__c'], row['sf__Id']) for row in successful)
+        results['failed'] += len(failed)
+        results['errors'].extend({'patient_id': row.get('Patient_ID__c'), 'error': row.get('sf__Error')}
+                                 for row in failed)
+    
     def insert_lab_result(self, lab_data: Dict, patient_sf_id: str) -> Tuple[bool, str]:
         """
         Insert a single lab result
         Returns: (success, message)
         """
         try:
-            # Create clean data with only valid Salesforce fields
-            clean_data = {
-                'Patient__c': patient_sf_id,
-                'Test_Type_c': lab_data.get('Test_Type__c'),
-                'Test_Value__c': lab_data.get('Test_Value__c'),
-                'Reference_Range__c': lab_data.get('Reference_Range__c'),
-                'Test_Datetime__c': lab_data.get('Test_Datetime__c'),
-                'Status__c': lab_data.get('Status__c')
-            }
-
-            # Remove None values 
-            clean_data = {k: v for k, v in clean_data.items() if k is not None}
+            # Only Lab_Result__c fields are sent (raw fields such as patient_id are dropped)
+            clean_data = lab_result_payload(lab_data)
+            clean_data['Patient__c'] = patient_sf_id
             
-            result = self.sf.Lab_Result__c.create(lab_data)
+            with self.limiter:
+                result = self.sf.Lab_Result__c.create(clean_data)
             
             logger.debug(f"Inserted lab result for patient {patient_sf_id}")
             return True, "Success"
@@ -144,71 +476,23 @@ class SalesforceLoader:
             return False, error_msg
     
     def insert_lab_results_batch(self, lab_results: List[Dict], 
-                                  patient_id_map: Dict) -> Dict:
+                                  patient_id_map: Dict, incremental: bool = False) -> Dict:
         """
         Insert multiple lab results
         patient_id_map: Maps patient_id to Salesforce ID
+        incremental: look up patients missing from patient_id_map (not upserted in this run)
         """
-        results = {
-            'total': len(lab_results),
-            'success': 0,
-            'failed': 0,
-            'errors': []
-        }
-        
-        logger.info(f"Starting batch insert of {len(lab_results)} lab results")
-        
-        for lab in lab_results:
-            # Get patient's Salesforce ID
-            patient_id = lab.get('patient_id')
-            patient_sf_id = patient_id_map.get(patient_id)
-            
-            if not patient_sf_id:
-                results['failed'] += 1
-                results['errors'].append({
-                    'patient_id': patient_id,
-                    'error': 'Patient Salesforce ID not found'
-                })
-                continue
-
-            # Extract only the fields we need (remove patient_id and other raw fields)
-            lab_clean = {
-                'Test_Type__c': lab.get('Test_Type__c'),
-                'Test_Value__c': lab.get('Test_Value__c'),
-                'Reference_Range__c': lab.get('Reference_Range__c'),
-                'Test_Datetime__c': lab.get('Test_Datetime__c'),
-                'Status__c': lab.get('Status__c')
-            }
-            
-            success, message = self.insert_lab_result(lab_clean, patient_sf_id)
-            
-            if success:
-                results['success'] += 1
-            else:
-                results['failed'] += 1
-                results['errors'].append({
-                    'patient_id': patient_id,
-                    'error': message
-                })
-        
-        logger.info(f"Batch insert complete: {results['success']} success, {results['failed']} failed")
-        return results
+        return self._insert_child_records("lab results", self.insert_lab_result, lab_results, patient_id_map,
+                                          'Lab_Result__c', lab_result_payload, incremental)
     
     def insert_risk_assessment(self, risk_data: Dict, patient_sf_id: str) -> Tuple[bool, str]:
         """Insert a single risk assessment"""
         try:
-            clean_data = {
-                'Patient__c': patient_sf_id,
-                'Risk_Level__c': risk_data.get('Risk_Level__c'),
-                'Risk_Score__c': risk_data.get('Risk_Score__c'),
-                'Assessment_Date__c': risk_data.get('Assessment_Date__c'),
-                'Risk_Factors__c': risk_data.get('Risk_Factors__c')
-            }
-
-            # Remove None Values 
-            clean_data = {k: v for k, v in clean_data.items() if k is not None}
+            clean_data = risk_assessment_payload(risk_data)
+            clean_data['Patient__c'] = patient_sf_id
 
-            result = self.sf.Risk_Assessment__c.create(clean_data)
+            with self.limiter:
+                result = self.sf.Risk_Assessment__c.create(clean_data)
 
             logger.debug(f"Inserted risk assessment for patient {patient_sf_id}")
             return True, "Success"
@@ -219,19 +503,65 @@ class SalesforceLoader:
             return False, error_msg
     
     def insert_risk_assessments_batch(self, risk_assessments: List[Dict],
-                                      patient_id_map: Dict) -> Dict:
-        """Insert multiple risk assessments"""
+                                      patient_id_map: Dict, incremental: bool = False) -> Dict:
+        """Insert multiple risk assessments (incremental: as in insert_lab_results_batch)"""
+        return self._insert_child_records("risk assessments", self.insert_risk_assessment,
+                                          risk_assessments, patient_id_map,
+                                          'Risk_Assessment__c', risk_assessment_payload, incremental)
+    
+    def insert_care_plan(self, care_plan: Dict, patient_sf_id: str) -> Tuple[bool, str]:
+        """Insert a single care plan"""
+        try:
+            clean_data = care_plan_payload(care_plan)
+            clean_data['Patient__c'] = patient_sf_id
+
+            with self.limiter:
+                result = self.sf.Care_Plan__c.create(clean_data)
+
+            logger.debug(f"Inserted care plan for patient {patient_sf_id}")
+            return True, "Success"
+            
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error inserting care plan: {error_msg}")
+            return False, error_msg
+    
+    def insert_care_plans_batch(self, care_plans: List[Dict], patient_id_map: Dict,
+                                incremental: bool = False) -> Dict:
+        """Insert multiple care plans (incremental: as in insert_lab_results_batch)"""
+        return self._insert_child_records("care plans", self.insert_care_plan, care_plans, patient_id_map,
+                                          'Care_Plan__c', care_plan_payload, incremental)
+    
+    def _insert_child_records(self, label: str, insert_one, records: List[Dict],
+                              patient_id_map: Dict, sobject: str, payload, incremental: bool = False) -> Dict:
+        """
+        Insert records that look up their patient via Patient__c
+        insert_one creates a single record over REST; in collections and
+        bulk mode the payloads of all records with a known patient are saved
+        to sobject in batches. Patients missing from patient_id_map are
+        looked up (id store, then Salesforce) only in incremental runs or
+        with an id store, and never if their upsert failed.
+        Returns: Summary with success/failure counts
+        """
         results = {
-            'total': len(risk_assessments),
+            'total': len(records),
             'success': 0,
             'failed': 0,
             'errors': []
         }
         
-        logger.info(f"Starting batch insert of {len(risk_assessments)} risk assessments")
+        logger.info(f"Starting batch insert of {len(records)} {label}")
         
-        for risk in risk_assessments:
-            patient_id = risk.get('patient_id')
+        # Patients not upserted in this batch (e.g. unchanged in an incremental run) are looked up
+        if incremental or self.id_store is not None:
+            self.add_missing_patient_ids((record.get('patient_id') for record in records
+                                          if record.get('patient_id') not in self.failed_patient_ids),
+                                         patient_id_map)
+        
+        pending = []
+        for record in records:
+            # Get patient's Salesforce ID
+            patient_id = record.get('patient_id')
             patient_sf_id = patient_id_map.get(patient_id)
             
             if not patient_sf_id:
@@ -241,16 +571,21 @@ class SalesforceLoader:
                     'error': 'Patient Salesforce ID not found'
                 })
                 continue
-
-            # Extract only the fields we need (remove patient_id)
-            risk_clean = {
-                'Risk_Level__c': risk.get('Risk_Level__c'),
-                'Risk_Score__c': risk.get('Risk_Score__c'),
-                'Assessment_Date__c': risk.get('Assessment_Date__c'),
-                'Risk_Factors__c': risk.get('Risk_Factors__c')
-            }
             
-            success, message = self.insert_risk_assessment(risk, patient_sf_id)
+            pending.append((record, patient_sf_id))
+        
+        if self.bulk is not None:
+            self._bulk_insert_child_records(sobject, payload, pending, patient_id_map, results)
+            outcomes = []
+        elif self.api == 'collections':
+            outcomes = [(success, message) for success, _, message in self._save_collection(
+                sobject, [{**payload(record), 'Patient__c': patient_sf_id} for record, patient_sf_id in pending]
+            )]
+        else:
+            outcomes = self._map_requests(lambda pair: insert_one(*pair), pending)
+        
+        for (record, _), (success, message) in zip(pending, outcomes):
+            patient_id = record.get('patient_id')
             
             if success:
                 results['success'] += 1
@@ -261,9 +596,34 @@ class SalesforceLoader:
                     'error': message
                 })
         
+        if self.id_store is not None:
+            # Patients whose record is gone from Salesforce are upserted again next time
+            self.id_store.forget(error['patient_id'] for error in results['errors']
+                                 if any(code in str(error['error']) for code in STALE_REFERENCE_ERRORS))
+        
         logger.info(f"Batch insert complete: {results['success']} success, {results['failed']} failed")
         return results
     
+    def _bulk_insert_child_records(self, sobject: str, payload, pending: List[Tuple[Dict, str]],
+                                   patient_id_map: Dict, results: Dict):
+        """Insert (record, patient Salesforce ID) pairs as Bulk API 2.0 jobs, filling in results"""
+        if not pending:
+            return
+        
+        rows = [{**payload(record), 'Patient__c': patient_sf_id} for record, patient_sf_id in pending]
+        successful, failed = self.bulk.load(sobject, 'insert', rows)
+        
+        # Failed rows are matched to their record (RECORD_INDEX); a row that could not be matched
+        # falls back to the patient_id of its Patient__c lookup (the canonical one for duplicates)
+        patient_ids = {sf_id: patient_id for patient_id, sf_id in reversed(list(patient_id_map.items()))}
+        results['success'] += len(successful)
+        results['failed'] += len(failed)
+        for row in failed:
+            index = row.get(RECORD_INDEX)
+            patient_id = (pending[index][0].get('patient_id') if index is not None
+                          else patient_ids.get(row.get('Patient__c')))
+            results['errors'].append({'patient_id': patient_id, 'error': row.get('sf__Error')})
+    
     def query_patients(self, limit: int = 100) -> List[Dict]:
         """Query patients from Salesforce"""
         try:
@@ -274,7 +634,8 @@ class SalesforceLoader:
                 LIMIT {limit}
             """
             
-            results = self.sf.query(query)
+            with self.limiter:
+                results = self.sf.query(query)
             records = results['records']
             
             logger.info(f"Queried {len(records)} patients from Salesforce")
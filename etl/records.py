@@ -0,0 +1,158 @@
+import sys
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Tuple
+import pandas as pd
+from etl.field_mappings import (lab_event_row, lab_result_payload, map_lab_result, map_patient, risk_assessment_payload,
+                                risk_history_row)
+
+
+class _Absent:
+    """Marker for a field the source record did not have (so get() falls back to its default)"""
+
+    def __repr__(self):
+        return 'ABSENT'
+
+    def __reduce__(self):
+        return 'ABSENT'
+
+
+ABSENT = _Absent()
+
+
+def _intern(value):
+    """Share one string object per distinct categorical value"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class Record(Mapping):
+    """
+    Read-only mapping over __slots__ fields
+    Stages read records through get()/[] exactly as they read the dicts they
+    replace (field projectors included), so records flow through mapping,
+    risk scoring and loading and only become dicts in the payloads built at
+    the Salesforce/BigQuery edge.
+    """
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+    _FIELD_SET = frozenset()
+
+    @classmethod
+    def from_dict(cls, record: Dict) -> 'Record':
+        """Build from a dict, ignoring keys that are not fields"""
+        return cls(**{key: value for key, value in record.items() if key in cls._FIELD_SET})
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> List['Record']:
+        """Build one record per row, straight from the columns (no per-row dicts)"""
+        columns = [frame[field].tolist() if field in frame.columns else [ABSENT] * len(frame)
+                   for field in cls.FIELDS]
+        return [cls(*values) for values in zip(*columns)]
+
+    def get(self, key, default=None):
+        if key not in self._FIELD_SET:
+            return default
+        value = getattr(self, key)
+        return default if value is ABSENT else value
+
+    def __getitem__(self, key):
+        value = getattr(self, key) if key in self._FIELD_SET else ABSENT
+        if value is ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return (field for field in self.FIELDS if getattr(self, field) is not ABSENT)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def _replace(self, **changes) -> 'Record':
+        """Copy with some fields changed"""
+        return type(self)(**{**dict(self), **changes})
+
+    def to_dict(self) -> Dict:
+        return dict(self)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(cls.__slots__)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+
+class Patient(Record):
+    """Extracted patient (FHIRParser.extract_patient_info fields)"""
+    __slots__ = ('patient_id', 'first_name', 'last_name', 'date_of_birth', 'gender', 'email', 'phone', 'address')
+
+    def __init__(self, patient_id=ABSENT, first_name=ABSENT, last_name=ABSENT, date_of_birth=ABSENT,
+                 gender=ABSENT, email=ABSENT, phone=ABSENT, address=ABSENT):
+        self.patient_id = patient_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.date_of_birth = date_of_birth
+        self.gender = _intern(gender)
+        self.email = email
+        self.phone = phone
+        self.address = address
+
+    def to_salesforce(self) -> Dict:
+        """Patient_Medical_Record__c fields"""
+        return map_patient(self)
+
+
+class LabResult(Record):
+    """Extracted lab result (lab_results CSV columns, or a FHIR Observation)"""
+    __slots__ = ('patient_id', 'test_type', 'value', 'reference_range', 'test_datetime', 'status', 'loinc_code')
+
+    def __init__(self, patient_id=ABSENT, test_type=ABSENT, value=ABSENT, reference_range=ABSENT,
+                 test_datetime=ABSENT, status=ABSENT, loinc_code=ABSENT):
+        self.patient_id = patient_id
+        self.test_type = _intern(test_type)
+        self.value = value
+        self.reference_range = _intern(reference_range)
+        self.test_datetime = test_datetime
+        self.status = _intern(status)
+        self.loinc_code = _intern(loinc_code)
+
+    def to_salesforce(self) -> Dict:
+        """Lab_Result__c payload (without the Patient__c lookup)"""
+        return lab_result_payload(map_lab_result(self))
+
+    def to_bigquery(self) -> Dict:
+        """clinical_events row (without event_id/created_timestamp)"""
+        return lab_event_row(self)
+
+
+class RiskAssessment(Record):
+    """RiskCalculator output, keyed like the Risk_Assessment__c record"""
+    __slots__ = ('patient_id', 'Risk_Level__c', 'Risk_Score__c', 'Assessment_Date__c', 'Risk_Factors__c',
+                 'rule_set_version')
+
+    def __init__(self, patient_id=ABSENT, Risk_Level__c=ABSENT, Risk_Score__c=ABSENT, Assessment_Date__c=ABSENT,
+                 Risk_Factors__c=ABSENT, rule_set_version=ABSENT):
+        self.patient_id = patient_id
+        self.Risk_Level__c = _intern(Risk_Level__c)
+        self.Risk_Score__c = Risk_Score__c
+        self.Assessment_Date__c = _intern(Assessment_Date__c)
+        self.Risk_Factors__c = Risk_Factors__c
+        self.rule_set_version = _intern(rule_set_version)
+
+    def to_salesforce(self) -> Dict:
+        """Risk_Assessment__c payload (without the Patient__c lookup)"""
+        return risk_assessment_payload(self)
+
+    def to_bigquery(self) -> Dict:
+        """risk_scores_history row (without created_timestamp)"""
+        return risk_history_row(self)
+
+
+def with_values(record: Mapping, **changes) -> Mapping:
+    """Copy of a record or plain dict with some fields changed, keeping its type"""
+    if isinstance(record, Record):
+        return record._replace(**changes)
+    return dict(record, **changes)
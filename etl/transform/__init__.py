@@ -1,5 +1,8 @@
 from .data_mapper import DataMapper
 from .validator import DataValidator
 from .risk_calculator import RiskCalculator
+from .risk_fingerprints import RiskFingerprints
+from .deduplicator import PatientDeduplicator
+from .reference_ranges import LabStatusDeriver
 
-__all__ = ['DataMapper', 'DataValidator', 'RiskCalculator']
\ No newline at end of file
+__all__ = ['DataMapper', 'DataValidator', 'RiskCalculator', 'RiskFingerprints', 'PatientDeduplicator', 'LabStatusDeriver']
\ No newline at end of file
@@ -1,28 +1,22 @@
+import pandas as pd
 from typing import Dict, List
 from datetime import datetime
+from etl.field_mappings import (LAB_RESULT_FIELDS, map_care_plan, map_lab_result, map_patient,
+                                normalize_gender)
 from utils import setup_logger
 
 logger = setup_logger(__name__)
 
+# Source column -> Lab_Result__c field for columnar batches
+LAB_FRAME_COLUMNS = {field[1]: field[0] for field in LAB_RESULT_FIELDS if field[0] != 'patient_id'}
+
 class DataMapper:
     """Map extracted data to Salesforce object schemas"""
     
     def map_patient_to_salesforce(self, patient: Dict) -> Dict:
         """Map patient data to Patient_Medical_Record__c fields"""
         try:
-            mapped = {
-                'Patient_ID__c': patient.get('patient_id', ''),
-                'First_Name__c': patient.get('first_name', ''),
-                'Last_Name__c': patient.get('last_name', ''),
-                'Date_of_Birth__c': patient.get('date_of_birth', ''),
-                'Gender__c': self._normalize_gender(patient.get('gender', '')),
-                'Email__c': patient.get('email', ''),
-                'Phone__c': patient.get('phone', ''),
-                'Address__c': patient.get('address', '')
-            }
-            
-            logger.debug(f"Mapped patient: {mapped['Patient_ID__c']}")
-            return mapped
+            return map_patient(patient)
             
         except Exception as e:
             logger.error(f"Error mapping patient: {e}")
@@ -31,26 +25,27 @@ class DataMapper:
     def map_lab_result_to_salesforce(self, lab: Dict, patient_sf_id: str = None) -> Dict:
         """Map lab result to Lab_Result__c fields"""
         try:
-            mapped = {
-                'patient_id': lab.get('patient_id', ''),
-                'Test_Type__c': lab.get('test_type', ''),
-                'Test_Value__c': float(lab.get('value', 0)),
-                'Reference_Range__c': lab.get('reference_range', ''),
-                'Test_Datetime__c': lab.get('test_datetime', ''),
-                'Status__c': lab.get('status', 'Normal')
-            }
+            mapped = map_lab_result(lab)
             
             # Add patient lookup if provided
             if patient_sf_id:
                 mapped['Patient__c'] = patient_sf_id
             
-            logger.debug(f"Mapped lab result: {mapped['Test_Type__c']}")
             return mapped
             
         except Exception as e:
             logger.error(f"Error mapping lab result: {e}")
             return {}
     
+    def map_care_plan_to_salesforce(self, care_plan: Dict) -> Dict:
+        """Map care plan to Care_Plan__c fields"""
+        try:
+            return map_care_plan(care_plan)
+            
+        except Exception as e:
+            logger.error(f"Error mapping care plan: {e}")
+            return {}
+    
     def map_multiple_patients(self, patients: List[Dict]) -> List[Dict]:
         """Map multiple patients"""
         mapped_patients = []
@@ -75,13 +70,27 @@ class DataMapper:
         logger.info(f"Mapped {len(mapped_labs)} lab results")
         return mapped_labs
     
+    def map_labs_frame(self, labs: pd.DataFrame) -> pd.DataFrame:
+        """Map a columnar lab batch to Lab_Result__c columns (same rules as map_multiple_labs)"""
+        mapped = labs.reindex(columns=['patient_id', *LAB_FRAME_COLUMNS]).rename(columns=LAB_FRAME_COLUMNS)
+        
+        if 'status' not in labs.columns:
+            mapped['Status__c'] = 'Normal'
+        if 'value' not in labs.columns:
+            mapped['Test_Value__c'] = 0.0
+        
+        # Rows whose value cannot be coerced to a number are dropped, like the dict path
+        raw_values = mapped['Test_Value__c']
+        if not pd.api.types.is_float_dtype(raw_values):
+            mapped['Test_Value__c'] = pd.to_numeric(raw_values, errors='coerce')
+        keep = mapped['Test_Value__c'].notna() | raw_values.isna()
+        
+        keep &= mapped['patient_id'].notna() & (mapped['patient_id'] != '')
+        mapped = mapped[keep]
+        
+        logger.info(f"Mapped {len(mapped)} lab results")
+        return mapped
+    
     def _normalize_gender(self, gender: str) -> str:
         """Normalize gender values to match Salesforce picklist"""
-        gender_lower = gender.lower()
-        
-        if gender_lower in ['male', 'm']:
-            return 'Male'
-        elif gender_lower in ['female', 'f']:
-            return 'Female'
-        else:
-            return 'Other'
+        return normalize_gender(gender)
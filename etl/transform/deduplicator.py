@@ -0,0 +1,197 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Blocks larger than this are too unspecific to compare pairwise (e.g. a placeholder DOB)
+DEFAULT_MAX_BLOCK_SIZE = 500
+
+_NON_LETTERS = re.compile(r'[^a-z]')
+_NON_DIGITS = re.compile(r'\D')
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+@lru_cache(maxsize=None)
+def normalize_name(name: str) -> str:
+    """Lowercase letters only (Synthea appends digits to names, e.g. 'Smith123')"""
+    return _NON_LETTERS.sub('', (name or '').lower())
+
+
+@lru_cache(maxsize=None)
+def soundex(name: str) -> str:
+    """American Soundex code of a normalized name ('' for an empty name)"""
+    if not name:
+        return ''
+
+    code = name[0].upper()
+    previous = _SOUNDEX_CODES.get(name[0], '')
+
+    for char in name[1:]:
+        digit = _SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code; vowels do
+        if char not in 'hw':
+            previous = digit
+
+    return code.ljust(4, '0')
+
+
+class _DisjointSet:
+    """Union-find over record positions; the earliest record is the root of its cluster"""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+class PatientDeduplicator:
+    """Detect mapped patient records that describe the same person"""
+
+    def __init__(self, max_block_size: int = DEFAULT_MAX_BLOCK_SIZE):
+        self.max_block_size = max_block_size
+
+    def find_clusters(self, patients: List[Dict]) -> Dict[str, str]:
+        """
+        Cluster duplicate patients (Patient_Medical_Record__c field names)
+        Records are only compared within blocks sharing a key (same patient
+        id, DOB + last name, or DOB + Soundex of both names), so the work
+        grows with block sizes rather than with all pairs. Matches are
+        merged with union-find.
+        Returns: duplicate Patient_ID__c -> canonical Patient_ID__c (the
+        first record of its cluster); unique patients are not listed
+        """
+        keys = [self._match_key(patient) for patient in patients]
+        blocks = defaultdict(list)
+
+        for position, (patient, key) in enumerate(zip(patients, keys)):
+            patient_id, dob, first, last = key[:4]
+            if patient_id:
+                blocks[('id', patient_id)].append(position)
+            if dob and last:
+                blocks[('name', dob, last)].append(position)
+                blocks[('soundex', dob, soundex(last), soundex(first))].append(position)
+
+        clusters = _DisjointSet(len(patients))
+        # position -> (position it was first matched with, reason), for the merge audit log
+        links = {}
+        skipped = 0
+
+        for block_key, positions in blocks.items():
+            if len(positions) < 2:
+                continue
+            if len(positions) > self.max_block_size:
+                skipped += 1
+                continue
+
+            for n, i in enumerate(positions):
+                for j in positions[n + 1:]:
+                    reason = 'same patient id' if block_key[0] == 'id' else self._match_reason(keys[i], keys[j])
+                    if reason:
+                        clusters.union(i, j)
+                        links.setdefault(j, (i, reason))
+
+        if skipped:
+            logger.warning(f"Skipped {skipped} blocks larger than {self.max_block_size} records")
+
+        duplicates = {}
+        for position, key in enumerate(keys):
+            root = clusters.find(position)
+            # Repeats of the same id need no mapping; collapse() merges them anyway
+            if root != position and key[0] and key[0] != keys[root][0]:
+                duplicates[key[0]] = keys[root][0]
+                matched, reason = links.get(position, (root, ''))
+                logger.info(f"Merging patient {key[0]} into {keys[root][0]} "
+                            f"(matched {keys[matched][0]}: {reason})")
+
+        num_clusters = len(set(duplicates.values()))
+        logger.info(f"Found {len(duplicates)} duplicate patients in {num_clusters} clusters")
+        return duplicates
+
+    def collapse(self, patients: List[Dict], clusters: Dict[str, str]) -> List[Dict]:
+        """Keep one record per cluster, filling its empty fields from the duplicates"""
+        canonical = {}
+        collapsed = []
+
+        for patient in patients:
+            patient_id = patient.get('Patient_ID__c')
+            target_id = clusters.get(patient_id, patient_id)
+
+            if target_id not in canonical:
+                record = dict(patient)
+                canonical[target_id] = record
+                collapsed.append(record)
+                continue
+
+            record = canonical[target_id]
+            for field, value in patient.items():
+                if value and not record.get(field):
+                    record[field] = value
+
+        if len(collapsed) < len(patients):
+            logger.info(f"Collapsed {len(patients)} patients into {len(collapsed)}")
+        return collapsed
+
+    def _match_key(self, patient: Dict) -> Tuple:
+        """(patient_id, dob, first, last, email, phone) with names normalized"""
+        return (
+            patient.get('Patient_ID__c') or '',
+            patient.get('Date_of_Birth__c') or '',
+            normalize_name(patient.get('First_Name__c') or ''),
+            normalize_name(patient.get('Last_Name__c') or ''),
+            (patient.get('Email__c') or '').strip().lower(),
+            _NON_DIGITS.sub('', patient.get('Phone__c') or ''),
+        )
+
+    def _match_reason(self, a: Tuple, b: Tuple) -> str:
+        """
+        Why two match keys describe the same person ('' if they do not)
+        Same DOB and a matching last name, plus the same first name; a first
+        name that only shares its initial (Rob/Robert, a Soundex match, a
+        typo) also needs the same email or phone.
+        """
+        _, dob_a, first_a, last_a, email_a, phone_a = a
+        _, dob_b, first_b, last_b, email_b, phone_b = b
+
+        if not dob_a or dob_a != dob_b:
+            return ''
+        if last_a != last_b and soundex(last_a) != soundex(last_b):
+            return ''
+
+        if not first_a or not first_b:
+            return ''
+        if first_a == first_b:
+            return 'same first name and DOB, matching last name'
+        if first_a[0] != first_b[0]:
+            return ''
+
+        if email_a and email_a == email_b:
+            return 'similar name, same DOB and email'
+        if phone_a and phone_a == phone_b:
+            return 'similar name, same DOB and phone'
+        return ''
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from typing import Dict
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Draws averaged by rolling_mean, and the look-back of count_last_90_days
+ROLLING_WINDOW = 3
+RECENT_DAYS = 90
+
+NS_PER_DAY = 86400 * 10**9
+DAYS_PER_YEAR = 365.25
+
+LAB_TREND_COLUMNS = ['patient_id', 'test_type', 'test_count', 'latest_value', 'latest_test_datetime',
+                     'days_since_last_test', 'slope_per_year', 'rolling_mean', 'count_last_90_days']
+
+
+def compute_lab_trends(labs: Dict, as_of: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    Per patient and test type trend features of lab columns
+    labs holds patient_id, test_type, value and test_datetime columns (as
+    built by RiskCalculator). Rows are sorted by (patient, test type, time)
+    once; every feature is then a segment reduction over the sorted arrays,
+    so there is no Python loop per patient. Labs without a numeric value or
+    a parseable datetime are ignored.
+    Returns: one row per (patient_id, test_type), LAB_TREND_COLUMNS
+    """
+    as_of = pd.Timestamp.now(tz='UTC') if as_of is None else pd.Timestamp(as_of)
+    if as_of.tzinfo is None:
+        as_of = as_of.tz_localize('UTC')
+
+    if not len(labs['patient_id']):
+        return pd.DataFrame(columns=LAB_TREND_COLUMNS)
+
+    values = pd.to_numeric(pd.Series(labs['value']), errors='coerce').to_numpy(dtype=float)
+    times = pd.Series(labs['test_datetime'])
+    if pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, utc=True)
+    else:
+        # Text is parsed in bulk; naive datetimes are taken as UTC
+        times = pd.to_datetime(times.astype(object), errors='coerce', utc=True, format='ISO8601')
+    nanos = times.dt.as_unit('ns').array.asi8
+
+    patient_codes, patient_ids = pd.factorize(pd.Series(labs['patient_id'], dtype=object))
+    # Sorted test types keep each patient's trend rows (and factors) in a stable order
+    test_codes, test_types = pd.factorize(pd.Series(labs['test_type'], dtype=object), sort=True)
+
+    usable = (patient_codes >= 0) & (test_codes >= 0) & ~np.isnan(values) & times.notna().to_numpy()
+    rows = np.flatnonzero(usable)
+    if not len(rows):
+        return pd.DataFrame(columns=LAB_TREND_COLUMNS)
+
+    # Sort once by group, then time; groups are contiguous runs afterwards
+    group_keys = patient_codes[rows].astype(np.int64) * len(test_types) + test_codes[rows]
+    seconds = (nanos[rows] - nanos[rows].min()) // 10**9
+    time_bits = int(seconds.max()).bit_length()
+    if int(group_keys.max()).bit_length() + time_bits <= 62:
+        # One packed int64 key sorts about twice as fast as lexsort; same-second draws keep input order
+        order = np.argsort((group_keys << time_bits) | seconds, kind='stable')
+    else:
+        order = np.lexsort((nanos[rows], group_keys))
+    rows = rows[order]
+    group_keys = group_keys[order]
+    values = values[rows]
+    nanos = nanos[rows]
+
+    starts = np.flatnonzero(np.r_[True, group_keys[1:] != group_keys[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+    counts = ends - starts
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    # Least-squares slope of value over time, in days since each group's first draw
+    days = (nanos - nanos[starts][group]) / NS_PER_DAY
+    sum_t = np.add.reduceat(days, starts)
+    sum_v = np.add.reduceat(values, starts)
+    sum_tt = np.add.reduceat(days * days, starts)
+    sum_tv = np.add.reduceat(days * values, starts)
+    denominator = counts * sum_tt - sum_t * sum_t
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denominator > 0, (counts * sum_tv - sum_t * sum_v) / denominator, np.nan)
+
+    # Mean of the last ROLLING_WINDOW draws
+    in_window = np.arange(len(rows)) >= np.repeat(ends - ROLLING_WINDOW, counts)
+    window_sum = np.bincount(group, weights=np.where(in_window, values, 0.0), minlength=len(starts))
+    window_count = np.bincount(group, weights=in_window, minlength=len(starts))
+
+    as_of_nanos = as_of.value
+    recent = nanos >= as_of_nanos - RECENT_DAYS * NS_PER_DAY
+    latest_nanos = nanos[ends - 1]
+
+    first_rows = rows[starts]
+    trends = pd.DataFrame({
+        'patient_id': patient_ids.to_numpy()[patient_codes[first_rows]],
+        'test_type': test_types.to_numpy()[test_codes[first_rows]],
+        'test_count': counts,
+        'latest_value': values[ends - 1],
+        'latest_test_datetime': pd.Series(latest_nanos.view('datetime64[ns]')).dt.tz_localize('UTC'),
+        'days_since_last_test': (as_of_nanos - latest_nanos) / NS_PER_DAY,
+        'slope_per_year': slope * DAYS_PER_YEAR,
+        'rolling_mean': window_sum / window_count,
+        'count_last_90_days': np.bincount(group, weights=recent, minlength=len(starts)).astype(np.int64),
+    })
+
+    logger.debug(f"Computed lab trends for {len(trends)} patient/test type pairs from {len(rows)} labs")
+    return trends
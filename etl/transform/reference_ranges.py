@@ -0,0 +1,161 @@
+import re
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple, Union
+from etl.records import with_values
+from utils import setup_logger
+from .validator import STATUS_VALUES
+
+logger = setup_logger(__name__)
+
+# A value beyond the violated bound by more than this fraction of the bound is Critical
+# (e.g. glucose above 120 for '70-100'), in line with the sample data generators
+DEFAULT_CRITICAL_MARGIN = 0.2
+
+STATUS_MODES = ['reported', 'verify', 'derive']
+# Derived statuses are codes into the Status__c values DataValidator accepts
+STATUS_LABELS = STATUS_VALUES
+
+_NUMBER = r'[-+]?\d+(?:\.\d+)?'
+_RANGE_PATTERN = re.compile(
+    rf'^\s*(?P<op><=|>=|<|>|≤|≥)?\s*(?P<low>{_NUMBER})\s*(?:(?:-|–|to)\s*(?P<high>{_NUMBER}))?\s*(?:[a-zA-Z%/].*)?$'
+)
+
+
+class ReferenceRange(NamedTuple):
+    """Numeric bounds of a reference range; NaN marks an open side"""
+    low: float
+    high: float
+    low_inclusive: bool
+    high_inclusive: bool
+
+
+UNPARSED_RANGE = ReferenceRange(np.nan, np.nan, False, False)
+
+
+@lru_cache(maxsize=None)
+def parse_reference_range(text: str) -> ReferenceRange:
+    """
+    Parse '70-100', '4.0 - 5.6 %', '<200', '>=40' and similar range strings
+    Each distinct string is parsed once; unparseable ranges have no bounds.
+    """
+    match = _RANGE_PATTERN.match(text or '')
+    if not match:
+        return UNPARSED_RANGE
+
+    op, low, high = match.group('op'), float(match.group('low')), match.group('high')
+    if high is not None:
+        if op:
+            return UNPARSED_RANGE
+        return ReferenceRange(low, float(high), True, True)
+    if op in ('<', '<=', '≤'):
+        return ReferenceRange(np.nan, low, False, op != '<')
+    if op in ('>', '>=', '≥'):
+        return ReferenceRange(low, np.nan, op != '>', False)
+    return UNPARSED_RANGE
+
+
+def range_bounds(ranges) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(low, high, low_inclusive, high_inclusive) arrays for a column of range strings"""
+    # Missing ranges get code -1, which picks the trailing unparsed row
+    codes, uniques = pd.factorize(pd.Series(ranges))
+    parsed = [parse_reference_range(str(text)) for text in uniques.tolist()]
+    table = pd.DataFrame(parsed + [UNPARSED_RANGE], columns=ReferenceRange._fields)
+
+    return tuple(table[field].to_numpy()[codes] for field in ReferenceRange._fields)
+
+
+def lab_status_codes(values, ranges, critical_margin: float = DEFAULT_CRITICAL_MARGIN) -> np.ndarray:
+    """
+    Derived status per lab as an index into STATUS_LABELS
+    Returns: int8 array, -1 where the value is not numeric or the range has
+    no parseable bound
+    """
+    values = pd.to_numeric(pd.Series(values), errors='coerce')
+    low, high, low_inclusive, high_inclusive = range_bounds(ranges)
+
+    # Compare float32 values against float32 bounds so '5.7' in the range equals 5.7 in the data
+    dtype = np.float32 if values.dtype == np.float32 else float
+    values = values.to_numpy(dtype=dtype)
+    low, high = low.astype(dtype), high.astype(dtype)
+
+    with np.errstate(invalid='ignore'):
+        below = np.where(low_inclusive, values < low, values <= low)
+        above = np.where(high_inclusive, values > high, values >= high)
+        critical = (values < low - critical_margin * np.abs(low)) | (values > high + critical_margin * np.abs(high))
+
+    codes = np.where(critical, 2, np.where(below | above, 1, 0)).astype(np.int8)
+    codes[np.isnan(values) | (np.isnan(low) & np.isnan(high))] = -1
+    return codes
+
+
+def derive_lab_status(values, ranges, critical_margin: float = DEFAULT_CRITICAL_MARGIN) -> np.ndarray:
+    """Normal/Abnormal/Critical per lab from its value and reference range (None where unknown)"""
+    codes = lab_status_codes(values, ranges, critical_margin)
+    return np.append(STATUS_LABELS, None)[codes]
+
+
+class LabStatusDeriver:
+    """Check or derive lab Status from the value and its reference range"""
+
+    def __init__(self, mode: str = 'derive', critical_margin: float = DEFAULT_CRITICAL_MARGIN):
+        if mode not in STATUS_MODES:
+            raise ValueError(f"Unknown lab status mode {mode!r}; expected one of {STATUS_MODES}")
+        # 'reported' keeps the source status, 'verify' only logs disagreements,
+        # 'derive' replaces it wherever the range allows
+        self.mode = mode
+        self.critical_margin = critical_margin
+
+    def apply(self, lab_results: Union[List[Dict], pd.DataFrame]) -> Union[List[Dict], pd.DataFrame]:
+        """Lab results (row dicts/records or a frame) with statuses checked or derived according to the mode"""
+        if self.mode == 'reported' or not len(lab_results):
+            return lab_results
+
+        if isinstance(lab_results, pd.DataFrame):
+            reported = lab_results['status']
+            derived = lab_status_codes(lab_results['value'], lab_results['reference_range'], self.critical_margin)
+        else:
+            reported = pd.Series([lab.get('status', 'Normal') for lab in lab_results], dtype=object)
+            derived = lab_status_codes([lab.get('value') for lab in lab_results],
+                                       [lab.get('reference_range') for lab in lab_results],
+                                       self.critical_margin)
+
+        # Statuses outside STATUS_LABELS (e.g. 'Bogus') get code -1 and always disagree
+        reported_codes = pd.Categorical(reported, categories=STATUS_LABELS).codes
+        known = derived >= 0
+        mismatched = np.flatnonzero(known & (derived != reported_codes))
+        self._log_mismatches(reported_codes[mismatched], derived[mismatched], int(known.sum()), len(lab_results))
+
+        if self.mode == 'verify' or not len(mismatched):
+            return lab_results
+
+        if isinstance(lab_results, pd.DataFrame):
+            status = reported.astype('category')
+            missing = [label for label in STATUS_LABELS if label not in status.cat.categories]
+            status = status.cat.add_categories(missing)
+            label_codes = status.cat.categories.get_indexer(STATUS_LABELS)
+            codes = status.cat.codes.to_numpy().copy()
+            codes[known] = label_codes[derived[known]]
+            return lab_results.assign(status=pd.Categorical.from_codes(codes, status.cat.categories))
+
+        lab_results = list(lab_results)
+        for row, code in zip(mismatched.tolist(), derived[mismatched].tolist()):
+            lab_results[row] = with_values(lab_results[row], status=STATUS_LABELS[code])
+        return lab_results
+
+    def _log_mismatches(self, reported: np.ndarray, derived: np.ndarray, num_known: int, num_labs: int):
+        """One summary line per batch, with the most common reported -> derived changes"""
+        if not len(reported):
+            logger.info(f"Lab status agrees with the reference range for all {num_known} checkable labs")
+            return
+
+        labels = STATUS_LABELS + ['other']
+        changes = np.bincount((reported.astype(np.int64) % 4) * 3 + derived, minlength=12)
+        top = np.argsort(changes, kind='stable')[::-1][:5]
+        summary = ', '.join(f"{labels[key // 3]} -> {labels[key % 3]}: {changes[key]}"
+                            for key in top.tolist() if changes[key])
+        action = 'replaced' if self.mode == 'derive' else 'kept'
+        logger.warning(f"Reported status disagrees with the reference range for {len(reported)} of "
+                       f"{num_known} checkable labs ({num_labs - num_known} without range/value), "
+                       f"{action}: {summary}")
@@ -1,104 +1,326 @@
-from typing import Dict, List
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Tuple, Union
 from datetime import datetime
-from utils import setup_logger
+from etl.records import RiskAssessment
+from utils import setup_logger, decimal_floats
+from .lab_trends import compute_lab_trends
+from .risk_fingerprints import RiskFingerprints
+from .risk_rules import CompiledRuleSet
 
 logger = setup_logger(__name__)
 
+ASSESSMENT_COLUMNS = ['patient_id', 'Risk_Level__c', 'Risk_Score__c', 'Assessment_Date__c', 'Risk_Factors__c',
+                      'rule_set_version']
+
 class RiskCalculator:
     """Calculate patient risk scores based on lab results and conditions"""
-    
-    def calculate_patient_risk(self, patient_id: str, lab_results: List[Dict], 
+
+    def __init__(self, rules_path: str = None, fingerprints: RiskFingerprints = None,
+                 compact_records: bool = False):
+        # Thresholds, condition weights and level cut-offs come from a versioned spec
+        self.rules = CompiledRuleSet.load(rules_path)
+        # When set, batch scoring skips patients whose inputs are unchanged since the last run
+        self.fingerprints = fingerprints
+        # Cleared by the caller when some inputs failed to read; fingerprints of
+        # partial lab/condition context are not recorded
+        self.context_complete = True
+        # Compact mode returns slotted RiskAssessment records instead of dicts
+        self.assessment_type = RiskAssessment if compact_records else dict
+        logger.info(f"Loaded risk rule set version {self.rules.version}")
+
+    def calculate_patient_risk(self, patient_id: str, lab_results: List[Dict],
                                conditions: List[Dict] = None) -> Dict:
         """Calculate risk assessment for a patient"""
-        
-        risk_score = 0
-        risk_factors = []
-        
+
         # Analyze lab results
         patient_labs = [lab for lab in lab_results if lab.get('patient_id') == patient_id]
-        
-        for lab in patient_labs:
-            test_type = lab.get('test_type', '')
-            status = lab.get('status', 'Normal')
-            value = lab.get('value', 0)
-            
-            # A1C risk scoring
-            if test_type == 'A1C':
-                if value > 6.5:
-                    risk_score += 20
-                    risk_factors.append(f"Elevated A1C: {value}")
-                elif value > 5.7:
-                    risk_score += 10
-                    risk_factors.append(f"Pre-diabetic A1C: {value}")
-            
-            # Glucose risk scoring
-            elif test_type == 'Glucose':
-                if value > 140:
-                    risk_score += 15
-                    risk_factors.append(f"High glucose: {value}")
-                elif value > 100:
-                    risk_score += 5
-                    risk_factors.append(f"Elevated glucose: {value}")
-            
-            # Cholesterol risk scoring
-            elif test_type == 'Cholesterol':
-                if value > 240:
-                    risk_score += 15
-                    risk_factors.append(f"High cholesterol: {value}")
-                elif value > 200:
-                    risk_score += 5
-                    risk_factors.append(f"Elevated cholesterol: {value}")
-            
-            # General critical status
-            if status == 'Critical':
-                risk_score += 10
-                risk_factors.append(f"Critical {test_type} result")
-        
+
+        risk_score, risk_factors = self._score_labs(
+            (lab.get('test_type', ''), lab.get('status', 'Normal'), lab.get('value', 0))
+            for lab in patient_labs
+        )
+
+        # Trends over the patient's draws of each test type
+        trend_score, trend_factors = self._score_trends(self._lab_columns(patient_labs))
+        risk_score += trend_score
+        risk_factors.extend(trend_factors)
+
         # Analyze conditions if provided
         if conditions:
             patient_conditions = [c for c in conditions if c.get('patient_id') == patient_id]
-            
-            high_risk_conditions = ['Type 2 Diabetes', 'Hypertension', 'Hyperlipidemia']
-            
-            for condition in patient_conditions:
-                condition_name = condition.get('condition', '')
-                if condition_name in high_risk_conditions:
-                    risk_score += 15
-                    risk_factors.append(f"Chronic condition: {condition_name}")
-        
-        # Determine risk level
-        if risk_score >= 50:
-            risk_level = 'Critical'
-        elif risk_score >= 30:
-            risk_level = 'High'
-        elif risk_score >= 15:
-            risk_level = 'Medium'
-        else:
-            risk_level = 'Low'
-        
-        risk_assessment = {
-            'patient_id': patient_id,
-            'Risk_Level__c': risk_level,
-            'Risk_Score__c': min(risk_score, 100),  # Cap at 100
-            'Assessment_Date__c': datetime.now().strftime('%Y-%m-%d'),
-            'Risk_Factors__c': '; '.join(risk_factors) if risk_factors else 'No significant risk factors'
-        }
-        
+
+            condition_score, condition_factors = self._score_conditions(
+                condition.get('condition', '') for condition in patient_conditions
+            )
+            risk_score += condition_score
+            risk_factors.extend(condition_factors)
+
+        return self._build_assessment(patient_id, risk_score, risk_factors)
+
+    def _score_labs(self, labs: Iterable[Tuple[str, str, float]]) -> Tuple[int, List[str]]:
+        """Score (test_type, status, value) tuples; returns (score, factors)"""
+        risk_score = 0
+        risk_factors = []
+
+        for test_type, status, value in labs:
+            points, factors = self.rules.score_lab(test_type, status, value)
+            risk_score += points
+            risk_factors.extend(factors)
+
+        return risk_score, risk_factors
+
+    def _score_trends(self, labs: Dict) -> Tuple[int, List[str]]:
+        """Score the trend rules on lab columns; returns (score, factors)"""
+        if not self.rules.trend_rules:
+            return 0, []
+
+        points, _, factors = self.rules.evaluate_trends(compute_lab_trends(labs))
+        return int(points.sum()), factors
+
+    def _score_conditions(self, condition_names: Iterable[str]) -> Tuple[int, List[str]]:
+        """Score condition names; returns (score, factors)"""
+        risk_score = 0
+        risk_factors = []
+
+        for condition_name in condition_names:
+            points, factor = self.rules.score_condition(condition_name)
+            if factor:
+                risk_score += points
+                risk_factors.append(factor)
+
+        return risk_score, risk_factors
+
+    def _build_assessment(self, patient_id: str, risk_score: int, risk_factors: List[str]) -> Dict:
+        """Determine risk level and build the Risk_Assessment__c record"""
+        risk_level = self.rules.risk_level(risk_score)
+
+        risk_assessment = self.assessment_type(
+            patient_id=patient_id,
+            Risk_Level__c=risk_level,
+            Risk_Score__c=self.rules.cap(risk_score),
+            Assessment_Date__c=datetime.now().strftime('%Y-%m-%d'),
+            Risk_Factors__c='; '.join(risk_factors) if risk_factors else 'No significant risk factors',
+            rule_set_version=self.rules.version
+        )
+
         logger.debug(f"Calculated risk for {patient_id}: {risk_level} ({risk_score})")
         return risk_assessment
-    
+
+    def lab_trends(self, lab_results: Union[List[Dict], pd.DataFrame]) -> pd.DataFrame:
+        """Trend features per patient and test type (see lab_trends.compute_lab_trends)"""
+        return compute_lab_trends(self._lab_columns(lab_results))
+
+    def _lab_columns(self, lab_results: Union[List[Dict], pd.DataFrame]) -> Dict:
+        """Lab columns used for scoring, from row dicts (with calculate_patient_risk's defaults) or a frame"""
+        if isinstance(lab_results, pd.DataFrame):
+            return {
+                'patient_id': lab_results['patient_id'].astype(object).to_numpy(),
+                'test_type': lab_results['test_type'].astype(object).to_numpy(),
+                'status': lab_results['status'].astype(object).to_numpy(),
+                'value': decimal_floats(lab_results['value']).astype(object).to_numpy(),
+                # Parsed datetimes stay typed so trends do not re-parse them
+                'test_datetime': (lab_results['test_datetime'].to_numpy()
+                                  if 'test_datetime' in lab_results else np.full(len(lab_results), None))
+            }
+
+        return {
+            'patient_id': [lab.get('patient_id') for lab in lab_results],
+            'test_type': [lab.get('test_type', '') for lab in lab_results],
+            'status': [lab.get('status', 'Normal') for lab in lab_results],
+            'value': [lab.get('value', 0) for lab in lab_results],
+            'test_datetime': [lab.get('test_datetime') for lab in lab_results]
+        }
+
     def calculate_all_patient_risks(self, patients: List[Dict], lab_results: List[Dict],
-                                    conditions: List[Dict] = None) -> List[Dict]:
-        """Calculate risk assessments for all patients"""
-        risk_assessments = []
-        
-        for patient in patients:
-            patient_id = patient.get('patient_id') or patient.get('Patient_ID__c')
-            
-            if patient_id:
-                risk = self.calculate_patient_risk(patient_id, lab_results, conditions)
-                risk_assessments.append(risk)
-        
+                                    conditions: List[Dict] = None, trends: pd.DataFrame = None) -> List[Dict]:
+        """
+        Calculate risk assessments for all patients
+        Same output as calling calculate_patient_risk per patient, but labs and
+        conditions are indexed by patient once and scored with array operations.
+        Precomputed lab trends (from lab_trends) are reused when given.
+        """
+        patient_ids = [patient.get('patient_id') or patient.get('Patient_ID__c') for patient in patients]
+
+        labs = self._lab_columns(lab_results)
+        conditions = conditions or []
+        condition_columns = {
+            'patient_id': [c.get('patient_id') for c in conditions],
+            'condition': [c.get('condition', '') for c in conditions]
+        }
+
+        patient_ids = self._patients_to_score([pid for pid in patient_ids if pid], labs, condition_columns)
+        risk_assessments = self._evaluate_batch(patient_ids, labs, condition_columns, trends)
+
         logger.info(f"Calculated {len(risk_assessments)} risk assessments")
         return risk_assessments
-    
+
+    def calculate_risks_frame(self, patients: List[Dict], labs: pd.DataFrame,
+                              conditions: pd.DataFrame = None, trends: pd.DataFrame = None) -> pd.DataFrame:
+        """Calculate risk assessments from columnar lab/condition batches"""
+        patient_ids = [patient.get('patient_id') or patient.get('Patient_ID__c') for patient in patients]
+
+        lab_columns = self._lab_columns(labs)
+        condition_columns = {'patient_id': [], 'condition': []}
+        if conditions is not None and len(conditions):
+            condition_columns = {
+                'patient_id': conditions['patient_id'].astype(object).to_numpy(),
+                'condition': conditions['condition'].astype(object).to_numpy()
+            }
+
+        patient_ids = self._patients_to_score([pid for pid in patient_ids if pid], lab_columns,
+                                              condition_columns)
+        risk_assessments = self._evaluate_batch(patient_ids, lab_columns, condition_columns, trends)
+
+        logger.info(f"Calculated {len(risk_assessments)} risk assessments")
+        return pd.DataFrame(risk_assessments, columns=ASSESSMENT_COLUMNS)
+
+    def _patients_to_score(self, patient_ids: List[str], labs: Dict, conditions: Dict) -> List[str]:
+        """Drop patients whose input fingerprint matches the last committed run"""
+        if self.fingerprints is None or not patient_ids:
+            return patient_ids
+
+        fingerprints = self.input_fingerprints(patient_ids, labs, conditions)
+        changed = set(self.fingerprints.filter_changed(fingerprints, stage=self.context_complete))
+        if not self.context_complete:
+            logger.warning("Inputs failed to read; not recording risk fingerprints for this batch")
+
+        logger.info(f"Rescoring {len(changed)} of {len(fingerprints)} patients with changed inputs")
+        return [patient_id for patient_id in patient_ids if patient_id in changed]
+
+    def input_fingerprints(self, patient_ids: List[str], labs: Dict, conditions: Dict) -> Dict[str, str]:
+        """
+        Fingerprint each patient's scoring inputs
+        Rows are hashed column-wise with pandas and combined per patient in
+        row order (which fixes the factor text order), together with the
+        rule set version so a rule change rescores everyone. Rule sets with
+        date-relative trend rules also fold in the run date.
+        """
+        index = pd.Index(list(dict.fromkeys(patient_ids)))
+        num_patients = len(index)
+
+        lab_digests = self._group_row_hashes(index, labs, ['test_type', 'status', 'value', 'test_datetime'])
+        condition_digests = self._group_row_hashes(index, conditions, ['condition'])
+        version = self.rules.version.encode()
+        if self.rules.uses_as_of:
+            version += datetime.now().strftime('%Y-%m-%d').encode()
+
+        fingerprints = {}
+        for position, patient_id in enumerate(index.tolist()):
+            digest = hashlib.blake2b(version, digest_size=16)
+            lab_bytes = lab_digests[position]
+            digest.update(len(lab_bytes).to_bytes(8, 'little'))
+            digest.update(lab_bytes)
+            digest.update(condition_digests[position])
+            fingerprints[patient_id] = digest.hexdigest()
+
+        return fingerprints
+
+    def _group_row_hashes(self, index: pd.Index, columns: Dict, names: List[str]) -> List[bytes]:
+        """Concatenated 64-bit row hashes of the given columns for each patient position, in row order"""
+        grouped = [b''] * len(index)
+        if not len(columns['patient_id']):
+            return grouped
+
+        codes = index.get_indexer(pd.Index(columns['patient_id'], dtype=object))
+        # Values are hashed by their text, which is also what ends up in the factor text
+        frame = pd.DataFrame({name: pd.Series(columns[name], dtype=object).astype(str) for name in names})
+        row_hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+        matched = np.flatnonzero(codes >= 0)
+        order = matched[np.argsort(codes[matched], kind='stable')]
+        sorted_codes = codes[order]
+        sorted_hashes = row_hashes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), len(order)]):
+            if end > start:
+                grouped[sorted_codes[start]] = sorted_hashes[start:end].tobytes()
+
+        return grouped
+
+    def _evaluate_batch(self, patient_ids: List[str], labs: Dict, conditions: Dict,
+                        trends: pd.DataFrame = None) -> List[Dict]:
+        """
+        Score all patients in one pass over the lab and condition columns
+        Lab/condition rows are mapped to patient positions with a hash index
+        and scored by the compiled rule set; scores are summed per patient
+        with bincount and factor texts joined per patient in row order.
+        """
+        index = pd.Index(list(dict.fromkeys(patient_ids)))
+        num_patients = len(index)
+        scores = np.zeros(num_patients, dtype=np.int64)
+        lab_factors = [''] * num_patients
+        trend_factors = [''] * num_patients
+        condition_factors = [''] * num_patients
+
+        if len(labs['patient_id']):
+            lab_factors = self._add_scores(index, labs['patient_id'], scores, self.rules.evaluate_labs(
+                np.asarray(labs['test_type'], dtype=object),
+                np.asarray(labs['status'], dtype=object),
+                np.asarray(labs['value'], dtype=object)
+            ))
+
+        if self.rules.trend_rules:
+            if trends is None:
+                trends = compute_lab_trends(labs)
+            if len(trends):
+                trend_factors = self._add_scores(index, trends['patient_id'].to_numpy(dtype=object), scores,
+                                                 self.rules.evaluate_trends(trends))
+
+        if len(conditions['patient_id']):
+            condition_factors = self._add_scores(index, conditions['patient_id'], scores,
+                                                 self.rules.evaluate_conditions(
+                                                     np.asarray(conditions['condition'], dtype=object)
+                                                 ))
+
+        assessment_date = datetime.now().strftime('%Y-%m-%d')
+        positions = index.get_indexer(pd.Index(patient_ids, dtype=object)).tolist()
+        scores = scores.tolist()
+
+        risk_assessments = []
+        for patient_id, position in zip(patient_ids, positions):
+            risk_score = scores[position]
+            # Trend and then condition factors follow all lab factors, as in calculate_patient_risk
+            risk_factors = '; '.join(filter(None, (lab_factors[position], trend_factors[position],
+                                                   condition_factors[position])))
+            risk_assessments.append(self.assessment_type(
+                patient_id=patient_id,
+                Risk_Level__c=self.rules.risk_level(risk_score),
+                Risk_Score__c=self.rules.cap(risk_score),
+                Assessment_Date__c=assessment_date,
+                Risk_Factors__c=risk_factors or 'No significant risk factors',
+                rule_set_version=self.rules.version
+            ))
+
+        return risk_assessments
+
+    def _add_scores(self, index: pd.Index, row_patient_ids, scores: np.ndarray,
+                    evaluated: Tuple[np.ndarray, np.ndarray, List[str]]) -> List[str]:
+        """Add evaluated (points, rows, texts) into per-patient scores; returns joined factors per patient"""
+        row_scores, rows, texts = evaluated
+        codes = index.get_indexer(pd.Index(row_patient_ids, dtype=object))
+        matched = codes >= 0
+        scores += np.bincount(codes[matched], weights=row_scores[matched],
+                              minlength=len(index)).astype(np.int64)
+
+        keep = matched[rows]
+        return self._join_by_patient(codes[rows][keep], [text for text, k in zip(texts, keep.tolist()) if k],
+                                     len(index))
+
+    def _join_by_patient(self, codes: np.ndarray, texts: List[str], num_patients: int) -> List[str]:
+        """'; '-join factor texts per patient position, keeping their original order"""
+        joined = [''] * num_patients
+        if not texts:
+            return joined
+
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        sorted_texts = [texts[i] for i in order.tolist()]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), len(sorted_texts)]):
+            joined[sorted_codes[start]] = '; '.join(sorted_texts[start:end])
+
+        return joined
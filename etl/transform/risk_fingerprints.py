@@ -0,0 +1,65 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_FINGERPRINTS_PATH = "data/state/risk_fingerprints.json"
+
+
+class RiskFingerprints:
+    """Persistent per-patient fingerprint of the inputs (labs, conditions, rule set) behind each risk score"""
+
+    def __init__(self, state_path: str = DEFAULT_FINGERPRINTS_PATH):
+        self.state_path = Path(state_path)
+        self.entries: Dict[str, str] = self._load()
+        # Fingerprints of patients rescored this run; only written by commit() after a successful load
+        self.pending: Dict[str, str] = {}
+
+    def _load(self) -> Dict[str, str]:
+        if not self.state_path.exists():
+            return {}
+
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f).get('patients', {})
+        except Exception as e:
+            logger.error(f"Error reading risk fingerprints {self.state_path}, starting empty: {e}")
+            return {}
+
+    def filter_changed(self, fingerprints: Dict[str, str], stage: bool = True) -> List[str]:
+        """
+        Return patients whose fingerprint differs from the last committed run
+        New fingerprints are staged for commit() unless stage is False (inputs
+        known to be incomplete), so those patients are rescored next run.
+        """
+        changed = []
+
+        for patient_id, fingerprint in fingerprints.items():
+            if self.entries.get(patient_id) != fingerprint:
+                changed.append(patient_id)
+                if stage:
+                    self.pending[patient_id] = fingerprint
+
+        return changed
+
+    def commit(self, failed_patient_ids: Iterable[str] = ()):
+        """Persist staged fingerprints, except for patients whose assessment failed to load"""
+        for patient_id in failed_patient_ids:
+            self.pending.pop(patient_id, None)
+
+        if not self.pending:
+            return
+
+        self.entries.update(self.pending)
+        self.pending = {}
+
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'patients': self.entries}, f)
+        os.replace(tmp_path, self.state_path)
+
+        logger.info(f"Saved risk fingerprints for {len(self.entries)} patients to {self.state_path}")
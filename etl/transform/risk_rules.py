@@ -0,0 +1,249 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_RULES_PATH = Path(__file__).with_name('risk_rules.json')
+
+
+def load_rule_set(path: str = None) -> Dict:
+    """Load a risk rule spec from JSON (or YAML, if PyYAML is installed)"""
+    path = Path(path) if path else DEFAULT_RULES_PATH
+
+    with open(path, 'r') as f:
+        if path.suffix in ('.yaml', '.yml'):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _to_float(value) -> float:
+    """Numeric lab value, or NaN if it cannot be compared"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class _ThresholdTable:
+    """Sorted thresholds for one test type and direction, searched with np.searchsorted"""
+
+    def __init__(self, rules: List[Dict], above: bool, first_rule: int):
+        # Ascending thresholds; rule ids index into CompiledRuleSet.rule_points/templates
+        order = sorted(range(len(rules)), key=lambda i: rules[i]['threshold'])
+        self.thresholds = np.array([rules[i]['threshold'] for i in order], dtype=float)
+        self.rule_ids = np.array([first_rule + i for i in order], dtype=np.int64)
+        self.above = above
+
+    def match(self, values: np.ndarray) -> np.ndarray:
+        """Rule id of the most severe threshold crossed by each value (-1 if none)"""
+        if self.above:
+            # value > threshold: the largest threshold strictly below the value
+            positions = np.searchsorted(self.thresholds, values, side='left') - 1
+            hit = positions >= 0
+        else:
+            # value < threshold: the smallest threshold strictly above the value
+            positions = np.searchsorted(self.thresholds, values, side='right')
+            hit = positions < len(self.thresholds)
+
+        hit &= ~np.isnan(values)
+        return np.where(hit, self.rule_ids[np.clip(positions, 0, len(self.rule_ids) - 1)], -1)
+
+
+# Trend features that depend on the run date rather than only on the labs
+_AS_OF_FEATURES = ('days_since_last_test', 'count_last_90_days')
+
+
+class CompiledRuleSet:
+    """
+    Risk rule spec compiled into lookup tables
+    Each test type gets sorted threshold arrays (one per direction), so a
+    lab is matched with a binary search however many thresholds it has;
+    status and condition rules are plain dict lookups. Trend rules compare
+    one lab trend feature (see lab_trends) per patient and test type.
+    """
+
+    def __init__(self, spec: Dict):
+        self.version = str(spec.get('version', 'unversioned'))
+        self.max_score = spec.get('max_score', 100)
+
+        # Flat rule tables indexed by rule id; -1 means "no rule", so the vectorized
+        # evaluators prepend a 0-point entry and index with rule id + 1
+        self.rule_points: List[int] = []
+        self.rule_templates: List[str] = []
+        self.lab_tables: Dict[str, List[_ThresholdTable]] = {}
+
+        for test_type, directions in spec.get('lab_rules', {}).items():
+            tables = []
+            for direction in ('above', 'below'):
+                rules = directions.get(direction) or []
+                if not rules:
+                    continue
+                tables.append(_ThresholdTable(rules, direction == 'above', len(self.rule_points)))
+                self.rule_points.extend(rule['points'] for rule in rules)
+                self.rule_templates.extend(rule['factor'] for rule in rules)
+            self.lab_tables[test_type] = tables
+
+        self.status_rules: Dict[str, Tuple[int, str]] = {
+            status: (rule['points'], rule['factor'])
+            for status, rule in spec.get('status_rules', {}).items()
+        }
+        self.condition_rules: Dict[str, Tuple[int, str]] = {
+            condition: (rule['points'], rule['factor'])
+            for condition, rule in spec.get('condition_rules', {}).items()
+        }
+
+        # (test_type, feature, above, threshold, min_tests, points, factor). The default spec
+        # scores no trends; a rule set opts in per test type, e.g. "A1C": [{"feature":
+        # "slope_per_year", "above": 0.5, "min_tests": 3, "points": 10, "factor": "Rising A1C: ..."}]
+        self.trend_rules: List[Tuple[str, str, bool, float, int, int, str]] = [
+            (test_type, rule['feature'], 'above' in rule, float(rule['above'] if 'above' in rule else rule['below']),
+             rule.get('min_tests', 2), rule['points'], rule['factor'])
+            for test_type, rules in spec.get('trend_rules', {}).items()
+            for rule in rules
+        ]
+        # Scores depend on the run date, not only on the inputs
+        self.uses_as_of = any(rule[1] in _AS_OF_FEATURES for rule in self.trend_rules)
+
+        # Highest cut-off first
+        self.levels = sorted(((level['min_score'], level['level']) for level in spec.get('levels', [])),
+                             reverse=True)
+
+        logger.debug(f"Compiled risk rule set {self.version}: {len(self.rule_points)} lab thresholds, "
+                     f"{len(self.condition_rules)} condition rules")
+
+    @classmethod
+    def load(cls, path: str = None) -> 'CompiledRuleSet':
+        """Load and compile a rule spec file"""
+        return cls(load_rule_set(path))
+
+    def _match_lab(self, test_types: np.ndarray, values: np.ndarray) -> List[np.ndarray]:
+        """Matched rule id per row for each threshold direction (-1 where no rule fires)"""
+        hits = [np.full(len(values), -1, dtype=np.int64), np.full(len(values), -1, dtype=np.int64)]
+        if not len(values):
+            return hits
+
+        codes, uniques = pd.factorize(pd.Series(test_types, dtype=object))
+        for code, test_type in enumerate(uniques.tolist()):
+            tables = self.lab_tables.get(test_type)
+            if not tables:
+                continue
+            rows = np.flatnonzero(codes == code)
+            for slot, table in enumerate(tables):
+                hits[slot][rows] = table.match(values[rows])
+        return hits
+
+    def score_lab(self, test_type: str, status: str, value) -> Tuple[int, List[str]]:
+        """Score one lab result; returns (points, factors)"""
+        points = 0
+        factors = []
+
+        for table in self.lab_tables.get(test_type, ()):
+            rule_id = int(table.match(np.array([_to_float(value)]))[0])
+            if rule_id >= 0:
+                points += self.rule_points[rule_id]
+                factors.append(self.rule_templates[rule_id].format(value=value, test_type=test_type))
+
+        status_rule = self.status_rules.get(status)
+        if status_rule:
+            points += status_rule[0]
+            factors.append(status_rule[1].format(value=value, test_type=test_type))
+
+        return points, factors
+
+    def score_condition(self, condition: str) -> Tuple[int, Optional[str]]:
+        """Score one condition name; returns (points, factor or None)"""
+        rule = self.condition_rules.get(condition)
+        if not rule:
+            return 0, None
+        return rule[0], rule[1].format(condition=condition)
+
+    def evaluate_labs(self, test_types: np.ndarray, statuses: np.ndarray,
+                      raw_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        Score lab rows with array operations
+        Returns: (points per row, rows that produce factors, '; '-joined factor text per such row)
+        """
+        values = pd.to_numeric(pd.Series(raw_values, dtype=object), errors='coerce').to_numpy(dtype=float)
+        hits = self._match_lab(test_types, values)
+
+        rule_points = np.array([0] + self.rule_points, dtype=np.int64)
+        points = rule_points[hits[0] + 1] + rule_points[hits[1] + 1]
+
+        status_ids = {status: i for i, status in enumerate(self.status_rules)}
+        status_hit = pd.Series(statuses, dtype=object).map(status_ids).fillna(-1).to_numpy(dtype=np.int64)
+        status_points = np.array([0] + [rule[0] for rule in self.status_rules.values()], dtype=np.int64)
+        points += status_points[status_hit + 1]
+
+        # Only rows that produce a factor are formatted
+        rows = np.flatnonzero((hits[0] >= 0) | (hits[1] >= 0) | (status_hit >= 0))
+        status_templates = [rule[1] for rule in self.status_rules.values()]
+        texts = []
+        for first, second, status_id, value, test_type in zip(hits[0][rows].tolist(), hits[1][rows].tolist(),
+                                                               status_hit[rows].tolist(),
+                                                               np.asarray(raw_values, dtype=object)[rows].tolist(),
+                                                               np.asarray(test_types, dtype=object)[rows].tolist()):
+            templates = [self.rule_templates[rule_id] for rule_id in (first, second) if rule_id >= 0]
+            if status_id >= 0:
+                templates.append(status_templates[status_id])
+            texts.append('; '.join(template.format(value=value, test_type=test_type)
+                                   for template in templates))
+
+        return points, rows, texts
+
+    def evaluate_conditions(self, names: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        Score condition rows
+        Returns: (points per row, rows that produce factors, factor text per such row)
+        """
+        names = pd.Series(names, dtype=object)
+        points = names.map({name: rule[0] for name, rule in self.condition_rules.items()})
+        points = points.fillna(0).to_numpy(dtype=np.int64)
+
+        rows = np.flatnonzero(names.isin(list(self.condition_rules)).to_numpy())
+        texts = [self.condition_rules[name][1].format(condition=name) for name in names.iloc[rows].tolist()]
+        return points, rows, texts
+
+    def evaluate_trends(self, trends: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        Score lab trend rows (one per patient and test type)
+        Returns: (points per row, rows that produce factors, '; '-joined factor text per such row)
+        """
+        points = np.zeros(len(trends), dtype=np.int64)
+        fired = []
+        if not len(trends) or not self.trend_rules:
+            return points, np.array([], dtype=np.int64), []
+
+        test_types = trends['test_type'].to_numpy(dtype=object)
+        counts = trends['test_count'].to_numpy(dtype=np.int64)
+
+        for rule_id, (test_type, feature, above, threshold, min_tests, rule_points, _) in enumerate(self.trend_rules):
+            feature_values = trends[feature].to_numpy(dtype=float)
+            # NaN features (e.g. no slope from a single draw) never fire
+            crossed = feature_values > threshold if above else feature_values < threshold
+            hit = (test_types == test_type) & (counts >= min_tests) & crossed
+            points[hit] += rule_points
+            fired.append(hit)
+
+        fired = np.vstack(fired)
+        rows = np.flatnonzero(fired.any(axis=0))
+        records = trends.iloc[rows].to_dict('records')
+        texts = ['; '.join(self.trend_rules[rule_id][6].format(**record)
+                           for rule_id in np.flatnonzero(fired[:, row]).tolist())
+                 for row, record in zip(rows.tolist(), records)]
+        return points, rows, texts
+
+    def risk_level(self, risk_score: int) -> str:
+        """Map a raw (uncapped) score to a risk level"""
+        for min_score, level in self.levels:
+            if risk_score >= min_score:
+                return level
+        return self.levels[-1][1] if self.levels else 'Low'
+
+    def cap(self, risk_score: int) -> int:
+        """Clamp a raw score to the rule set's maximum"""
+        return min(risk_score, self.max_score)
@@ -1,9 +1,102 @@
+import numpy as np
+import pandas as pd
 from typing import Dict, List, Tuple
 from datetime import datetime
 from utils import setup_logger
 
 logger = setup_logger(__name__)
 
+GENDER_VALUES = ['Male', 'Female', 'Other']
+STATUS_VALUES = ['Normal', 'Abnormal', 'Critical']
+
+# Batch validation rules as (message, field whose value is appended to the message or None);
+# rule i sets bit 1 << i of a row's validation mask
+PATIENT_RULES = [
+    ("Missing Patient_ID__c", None),
+    ("Missing First_Name__c", None),
+    ("Missing Last_Name__c", None),
+    ("Invalid date format for Date_of_Birth__c", 'Date_of_Birth__c'),
+    ("Invalid Gender__c value", 'Gender__c'),
+    ("Invalid Email__c format", 'Email__c'),
+]
+LAB_RULES = [
+    ("Missing Test_Type__c", None),
+    ("Invalid Test_Value__c", 'Test_Value__c'),
+    ("Invalid date format for Test_Date__c", 'Test_Date__c'),
+    ("Invalid Status__c value", 'Status__c'),
+]
+
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _column(frame: pd.DataFrame, field: str) -> pd.Series:
+    """Column as object dtype, keeping categoricals so checks run on their categories"""
+    if field not in frame.columns:
+        return pd.Series(None, index=frame.index, dtype=object)
+    if isinstance(frame[field].dtype, pd.CategoricalDtype):
+        return frame[field]
+    return frame[field].astype(object)
+
+
+def _present(values: pd.Series) -> pd.Series:
+    """Truthy in the per-record checks: not null and not an empty string"""
+    return values.notna() & (values != '')
+
+
+def _invalid_numbers(frame: pd.DataFrame, field: str) -> pd.Series:
+    """Non-null values that float() would reject"""
+    if field not in frame.columns or pd.api.types.is_numeric_dtype(frame[field]):
+        return pd.Series(False, index=frame.index)
+
+    values = frame[field].astype(object)
+    # pd.to_numeric settles almost every row; its rejects are re-checked with float() once
+    # per distinct value, so strings such as 'nan' are judged exactly as in validate_lab_result
+    candidates = values.notna() & pd.to_numeric(values, errors='coerce').isna()
+    rejected = [value for value in values[candidates].drop_duplicates().tolist() if not _is_float(value)]
+
+    return candidates & values.isin(rejected)
+
+
+def _is_float(value) -> bool:
+    try:
+        float(value)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def _invalid_dates(frame: pd.DataFrame, field: str) -> pd.Series:
+    """
+    Present values that datetime.strptime(value, '%Y-%m-%d') would reject
+    Parsed with a regex and calendar arithmetic rather than pd.to_datetime,
+    whose nanosecond range would reject valid birth dates before 1677.
+    """
+    invalid = pd.Series(False, index=frame.index)
+    if field not in frame.columns or pd.api.types.is_datetime64_any_dtype(frame[field]):
+        return invalid
+
+    values = frame[field].astype(object)
+    present = _present(values)
+    if not present.any():
+        return invalid
+
+    strings = values[present]
+    is_str = strings.map(type).eq(str)
+    parts = strings[is_str].str.extract(r'^(\d{4})-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9])$')
+    matched = parts[0].notna()
+
+    year = pd.to_numeric(parts[0], errors='coerce').fillna(1).to_numpy(dtype=np.int64)
+    month = pd.to_numeric(parts[1], errors='coerce').fillna(1).to_numpy(dtype=np.int64)
+    day = pd.to_numeric(parts[2], errors='coerce').fillna(1).to_numpy(dtype=np.int64)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    max_day = _DAYS_IN_MONTH[month] + ((month == 2) & leap)
+    valid = matched.to_numpy() & (year >= 1) & (day <= max_day)
+
+    invalid[strings.index] = True
+    invalid[strings[is_str].index[valid]] = False
+    return invalid
+
+
 class DataValidator:
     """Validate data before loading to Salesforce"""
     
@@ -31,7 +124,7 @@ class DataValidator:
         
         # Validate gender
         gender = patient.get('Gender__c')
-        if gender and gender not in ['Male', 'Female', 'Other']:
+        if gender and gender not in GENDER_VALUES:
             errors.append(f"Invalid Gender__c value: {gender}")
         
         # Validate email format (basic check)
@@ -72,7 +165,7 @@ class DataValidator:
         
         # Validate status
         status = lab.get('Status__c')
-        if status and status not in ['Normal', 'Abnormal', 'Critical']:
+        if status and status not in STATUS_VALUES:
             errors.append(f"Invalid Status__c value: {status}")
         
         is_valid = len(errors) == 0
@@ -82,35 +175,139 @@ class DataValidator:
         
         return is_valid, errors
     
-    def validate_patients_batch(self, patients: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
-        """Validate batch of patients, return valid and invalid records"""
+    def check_patients_frame(self, patients: pd.DataFrame) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Check whole columns of mapped patients at once
+        Returns: (uint8 mask per row with bit i set if PATIENT_RULES[i] failed,
+                  failure count per rule message)
+        """
+        email = _column(patients, 'Email__c')
+        gender = _column(patients, 'Gender__c')
+        
+        return self._combine_checks(PATIENT_RULES, [
+            ~_present(_column(patients, 'Patient_ID__c')),
+            ~_present(_column(patients, 'First_Name__c')),
+            ~_present(_column(patients, 'Last_Name__c')),
+            _invalid_dates(patients, 'Date_of_Birth__c'),
+            _present(gender) & ~gender.isin(GENDER_VALUES),
+            _present(email) & ~email.astype(str).str.contains('@', regex=False).astype(bool),
+        ])
+    
+    def check_labs_frame(self, labs: pd.DataFrame) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Check whole columns of mapped lab results at once
+        Returns: (uint8 mask per row with bit i set if LAB_RULES[i] failed,
+                  failure count per rule message)
+        """
+        status = _column(labs, 'Status__c')
+        
+        return self._combine_checks(LAB_RULES, [
+            ~_present(_column(labs, 'Test_Type__c')),
+            _invalid_numbers(labs, 'Test_Value__c'),
+            _invalid_dates(labs, 'Test_Date__c'),
+            _present(status) & ~status.isin(STATUS_VALUES),
+        ])
+    
+    def _combine_checks(self, rules: List[Tuple[str, str]], failures: List[pd.Series]) -> Tuple[np.ndarray, Dict[str, int]]:
+        """Pack per-rule failure masks into one bitmask and count failures per rule"""
+        mask = np.zeros(len(failures[0]), dtype=np.uint8)
+        counts = {}
+        
+        for bit, ((message, _), failed) in enumerate(zip(rules, failures)):
+            failed = failed.to_numpy(dtype=bool)
+            mask |= failed.astype(np.uint8) << bit
+            count = int(failed.sum())
+            if count:
+                counts[message] = count
+        
+        return mask, counts
+    
+    def _decode_mask(self, rules: List[Tuple[str, str]], row_mask: int, record: Dict = None) -> List[str]:
+        """Error messages for a row's validation mask (with offending values when the record is given)"""
+        errors = []
+        for bit, (message, field) in enumerate(rules):
+            if row_mask >> bit & 1:
+                errors.append(f"{message}: {record.get(field)}" if record is not None and field else message)
+        return errors
+    
+    def _log_failures(self, kind: str, counts: Dict[str, int]):
+        """One warning per batch with failure counts per rule, instead of one per record"""
+        if counts:
+            summary = ', '.join(f"{message}: {count}" for message, count in counts.items())
+            logger.warning(f"{kind} validation failures by rule: {summary}")
+    
+    def _split_records(self, records: List[Dict], rules: List[Tuple[str, str]],
+                       mask: np.ndarray) -> Tuple[List[Dict], List[Dict]]:
+        """Split records into valid/invalid by mask, attaching _validation_errors to invalid ones"""
         valid = []
         invalid = []
         
-        for patient in patients:
-            is_valid, errors = self.validate_patient(patient)
-            if is_valid:
-                valid.append(patient)
+        for record, row_mask in zip(records, mask.tolist()):
+            if not row_mask:
+                valid.append(record)
             else:
-                patient['_validation_errors'] = errors
-                invalid.append(patient)
+                record['_validation_errors'] = self._decode_mask(rules, row_mask, record)
+                invalid.append(record)
         
+        return valid, invalid
+    
+    def validate_patients_batch(self, patients: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Validate batch of patients, return valid and invalid records"""
+        fields = ['Patient_ID__c', 'First_Name__c', 'Last_Name__c', 'Date_of_Birth__c', 'Gender__c', 'Email__c']
+        frame = pd.DataFrame({field: [patient.get(field) for patient in patients] for field in fields},
+                             dtype=object)
+        mask, counts = self.check_patients_frame(frame)
+        valid, invalid = self._split_records(patients, PATIENT_RULES, mask)
+        
+        self._log_failures("Patient", counts)
         logger.info(f"Validated patients: {len(valid)} valid, {len(invalid)} invalid")
         return valid, invalid
     
     def validate_labs_batch(self, labs: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
         """Validate batch of lab results"""
-        valid = []
-        invalid = []
+        fields = ['Test_Type__c', 'Test_Value__c', 'Test_Date__c', 'Status__c']
+        frame = pd.DataFrame({field: [lab.get(field) for lab in labs] for field in fields}, dtype=object)
+        mask, counts = self.check_labs_frame(frame)
+        valid, invalid = self._split_records(labs, LAB_RULES, mask)
         
-        for lab in labs:
-            is_valid, errors = self.validate_lab_result(lab)
-            if is_valid:
-                valid.append(lab)
-            else:
-                lab['_validation_errors'] = errors
-                invalid.append(lab)
+        self._log_failures("Lab result", counts)
+        logger.info(f"Validated lab results: {len(valid)} valid, {len(invalid)} invalid")
+        return valid, invalid
+    
+    def validate_patients_frame(self, patients: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Validate a columnar batch of mapped patients
+        Returns (valid, invalid); invalid rows carry _validation_mask and _validation_errors columns.
+        """
+        mask, counts = self.check_patients_frame(patients)
+        valid, invalid = self._split_frame(patients, PATIENT_RULES, mask)
+        
+        self._log_failures("Patient", counts)
+        logger.info(f"Validated patients: {len(valid)} valid, {len(invalid)} invalid")
+        return valid, invalid
+    
+    def validate_labs_frame(self, labs: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Validate a columnar batch of mapped lab results
+        Returns (valid, invalid); invalid rows carry _validation_mask and _validation_errors columns.
+        """
+        mask, counts = self.check_labs_frame(labs)
+        valid, invalid = self._split_frame(labs, LAB_RULES, mask)
         
+        self._log_failures("Lab result", counts)
         logger.info(f"Validated lab results: {len(valid)} valid, {len(invalid)} invalid")
         return valid, invalid
     
+    def _split_frame(self, frame: pd.DataFrame, rules: List[Tuple[str, str]],
+                     mask: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Split a frame by validation mask; messages are decoded once per distinct mask"""
+        failed = mask != 0
+        valid = frame[~failed]
+        invalid = frame[failed].copy()
+        
+        if len(invalid):
+            invalid['_validation_mask'] = mask[failed]
+            messages = {int(m): self._decode_mask(rules, int(m)) for m in np.unique(mask[failed])}
+            invalid['_validation_errors'] = [list(messages[m]) for m in mask[failed].tolist()]
+        
+        return valid, invalid
@@ -1,85 +1,360 @@
 import sys
+import math
+import queue
+import threading
+import numpy as np
+import pandas as pd
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from etl.extract import FHIRParser, CSVReader
-from etl.transform import DataMapper, DataValidator, RiskCalculator
-from etl.load import SalesforceLoader, BigQueryLoader
-from utils import setup_logger
+from etl.extract import FHIRParser, ClinicalBatch, CSVReader, FileManifest, NDJSONReader, PatientCache
+from etl.extract.manifest import row_hashes
+from etl.transform import (DataMapper, DataValidator, RiskCalculator, RiskFingerprints, PatientDeduplicator,
+                           LabStatusDeriver)
+from etl.load import SalesforceLoader, BigQueryLoader, PatientIdStore, RateLimiter
+from etl.load.rate_limiter import DEFAULT_MAX_CONCURRENT
+from etl.records import LabResult, Patient, with_values
+from utils import setup_logger, concat_frames, frame_to_records
+from pipeline.partitions import PatientPartitions
 
 logger = setup_logger(__name__)
 
+# Columns of FHIR-derived records when building columnar batches
+LAB_COLUMNS = ['patient_id', 'test_type', 'value', 'reference_range', 'test_datetime', 'status', 'loinc_code']
+CONDITION_COLUMNS = ['patient_id', 'condition', 'code', 'onset_date', 'clinical_status']
+# Columns that identify patient and event rows already loaded (incremental mode)
+PATIENT_COLUMNS = list(Patient.FIELDS)
+ENCOUNTER_COLUMNS = ['patient_id', 'encounter_id', 'encounter_type', 'start', 'end', 'status']
+MEDICATION_COLUMNS = ['patient_id', 'medication', 'authored_on', 'status']
+
 class ETLOrchestrator:
     """Orchestrate the complete ETL pipeline"""
     
-    def __init__(self):
-        self.fhir_parser = FHIRParser()
+    def __init__(self, clinical_source: str = 'csv', columnar: bool = False,
+                 incremental: bool = False, full_rescan: bool = False,
+                 patient_cache: bool = False, incremental_risk: bool = False,
+                 batch_size: Optional[int] = None, queue_depth: int = 2, deduplicate: bool = False,
+                 lab_status: str = 'reported', compact_records: bool = False, salesforce_api: str = 'rest',
+                 patient_id_store: bool = False, salesforce_workers: int = 1,
+                 salesforce_rate: Optional[float] = None, salesforce_daily_limit: Optional[int] = None):
+        # 'csv': labs/conditions from CSVReader; 'fhir': from the FHIR bundles in one pass;
+        # 'ndjson': everything from a FHIR Bulk Data export
+        self.clinical_source = clinical_source
+        # Columnar mode threads labs/conditions through transform as DataFrames
+        self.columnar = columnar
+        # Compact mode keeps patients, labs and risk assessments as slotted records (not dicts)
+        # until they are serialized to Salesforce/BigQuery payloads
+        self.compact_records = compact_records
+        # Incremental mode only extracts bundles that changed since the last successful run and
+        # only loads rows not loaded before; patients with new rows are rescored on all their rows
+        self.manifest = FileManifest() if incremental else None
+        self.full_rescan = full_rescan
+        self.fhir_parser = FHIRParser(manifest=self.manifest, full_rescan=full_rescan,
+                                      cache=PatientCache() if patient_cache else None,
+                                      compact_records=compact_records)
+        if patient_cache and clinical_source != 'csv':
+            # The cache holds extracted patients only; bundle extraction decodes every resource
+            logger.warning("The patient cache only applies to CSV-source runs, "
+                           f"not clinical_source={clinical_source!r}")
         self.csv_reader = CSVReader()
+        self.ndjson_reader = NDJSONReader()
         self.mapper = DataMapper()
         self.validator = DataValidator()
-        self.risk_calculator = RiskCalculator()
-        self.sf_loader = SalesforceLoader()
+        # 'verify' checks lab Status against the reference range, 'derive' replaces it
+        self.lab_status = LabStatusDeriver(lab_status)
+        # Deduplication collapses records of the same person (re-exports, several bundles) before loading
+        self.deduplicator = PatientDeduplicator() if deduplicate else None
+        # Incremental risk mode only rescores (and reloads) patients whose inputs changed
+        self.risk_fingerprints = RiskFingerprints() if incremental_risk else None
+        self.risk_calculator = RiskCalculator(fingerprints=self.risk_fingerprints,
+                                              compact_records=compact_records)
+        # 'rest' loads Salesforce records one request at a time, 'collections' 200 per request
+        # (sObject Collections), 'bulk' as Bulk API 2.0 jobs
+        # The patient id store keeps Salesforce ids across runs, so unchanged patients are not upserted again
+        self.patient_id_store = PatientIdStore() if patient_id_store else None
+        # Concurrent loading keeps salesforce_workers requests in flight; one limiter caps them org-wide
+        # (concurrent requests, requests per second, requests per 24h)
+        rate_limiter = None
+        if salesforce_workers > 1 or salesforce_rate or salesforce_daily_limit:
+            rate_limiter = RateLimiter(max_concurrent=min(salesforce_workers, DEFAULT_MAX_CONCURRENT),
+                                       requests_per_second=salesforce_rate, daily_limit=salesforce_daily_limit)
+        self.sf_loader = SalesforceLoader(api=salesforce_api, id_store=self.patient_id_store,
+                                          workers=salesforce_workers, rate_limiter=rate_limiter)
         self.bq_loader = BigQueryLoader()
+        # Micro-batch mode streams batch_size patient files at a time through transform and load;
+        # at most queue_depth transformed batches wait for the loader
+        self.batch_size = batch_size
+        self.queue_depth = queue_depth
     
     def run_pipeline(self):
-        """Execute the complete ETL pipeline"""
+        """
+        Execute the complete ETL pipeline
+        Returns: load results; results['success'] is True only if every
+        input read and every record loaded
+        """
         
         logger.info("="*60)
         logger.info("STARTING ETL PIPELINE")
         logger.info("="*60)
         
-        # EXTRACT
-        logger.info("\n[EXTRACT] Reading source data...")
+        read_errors = self._read_errors()
+        if self.batch_size:
+            results = self._run_micro_batches()
+        else:
+            # EXTRACT
+            logger.info("\n[EXTRACT] Reading source data...")
+            batch = self._extract()
+            self.risk_calculator.context_complete = self._read_errors() == read_errors
+            if self.manifest is not None:
+                batch = self._select_changed(batch)
+            
+            # TRANSFORM
+            logger.info("\n[TRANSFORM] Processing data...")
+            batch = self._transform(batch)
+            
+            results = self._load(batch)
+        
+        results = self._finish(results)
+        results['success'] = self._load_succeeded(results) and self._read_errors() == read_errors
+        return results
+    
+    def _extract(self) -> Dict:
+        """Read all source data into one batch"""
+        if self.clinical_source == 'ndjson':
+            return self._clinical_batch_input(self.ndjson_reader.extract_resources())
+        if self.clinical_source == 'fhir':
+            return self._clinical_batch_input(self.fhir_parser.extract_bundle_resources())
+        
         patients = self.fhir_parser.parse_all_patients()
-        lab_results = self.csv_reader.read_lab_results()
-        conditions = self.csv_reader.read_conditions()
+        if self.columnar:
+            lab_results = self.csv_reader.read_lab_results_frame()
+            conditions = self.csv_reader.read_conditions_frame()
+        else:
+            lab_results = self.csv_reader.read_lab_results(compact=self.compact_records)
+            conditions = self.csv_reader.read_conditions()
         
         logger.info(f"Extracted: {len(patients)} patients, {len(lab_results)} labs, "
                    f"{len(conditions)} conditions")
+        return {'patients': patients, 'lab_results': lab_results, 'conditions': conditions}
+    
+    def _clinical_batch_input(self, clinical_batch) -> Dict:
+        """Pipeline input from a ClinicalBatch (FHIR bundles or NDJSON export)"""
+        lab_results = clinical_batch.records('observations')
+        conditions = clinical_batch.records('conditions')
         
-        # TRANSFORM
-        logger.info("\n[TRANSFORM] Processing data...")
+        logger.info(f"Extracted: {len(clinical_batch.patients)} patients, {len(lab_results)} labs, "
+                   f"{len(conditions)} conditions")
         
-        # Map
-        mapped_patients = self.mapper.map_multiple_patients(patients)
-        mapped_labs = self.mapper.map_multiple_labs(lab_results)
+        batch = {
+            'patients': clinical_batch.patients,
+            'lab_results': lab_results,
+            'conditions': conditions,
+            # Only FHIR sources load conditions, encounters and medications as events
+            'events': {
+                'conditions': conditions,
+                'encounters': clinical_batch.records('encounters'),
+                'medications': clinical_batch.records('medications')
+            }
+        }
+        if self.compact_records:
+            batch['patients'] = [Patient.from_dict(patient) for patient in clinical_batch.patients]
+        if self.columnar:
+            batch['lab_results'] = pd.DataFrame(lab_results, columns=LAB_COLUMNS)
+            batch['conditions'] = pd.DataFrame(conditions, columns=CONDITION_COLUMNS)
+        elif self.compact_records:
+            batch['lab_results'] = [LabResult.from_dict(lab) for lab in lab_results]
+        return batch
+    
+    def _select_changed(self, batch: Dict) -> Dict:
+        """
+        Incremental mode: split an input batch into rows to load and rows to score
+        Patient, lab, condition and event rows loaded by an earlier run (by
+        row hash) are not loaded again. Patients with any new row are
+        rescored on all of their labs and conditions, not just the new ones.
+        """
+        patients = batch['patients']
+        lab_results = batch['lab_results']
+        conditions = batch['conditions']
+        
+        new_patients = self._stage_new_rows('patients', patients, PATIENT_COLUMNS)
+        new_labs = self._stage_new_rows('lab_results', lab_results, LAB_COLUMNS)
+        new_conditions = self._stage_new_rows('conditions', conditions, CONDITION_COLUMNS)
+        
+        lab_patient_ids = self._row_patient_ids(lab_results)
+        condition_patient_ids = self._row_patient_ids(conditions)
+        rescore = list(dict.fromkeys(patient_id for patient_id in [
+            *self._row_patient_ids(patients)[new_patients].tolist(),
+            *lab_patient_ids[new_labs].tolist(),
+            *condition_patient_ids[new_conditions].tolist()
+        ] if patient_id))
+        
+        selected = dict(batch, patients=self._take_rows(patients, new_patients),
+                        lab_results=self._take_rows(lab_results, new_labs))
+        selected['scoring'] = {
+            'patient_ids': rescore,
+            'lab_results': self._take_rows(lab_results, pd.Series(lab_patient_ids, dtype=object).isin(rescore)),
+            'conditions': self._take_rows(conditions, pd.Series(condition_patient_ids, dtype=object).isin(rescore))
+        }
         
-        # Validate
+        events = batch.get('events')
+        if events:
+            selected['events'] = {
+                # Condition events are the batch's conditions, as records
+                'conditions': self._take_rows(events['conditions'], new_conditions),
+                'encounters': self._take_rows(events['encounters'], self._stage_new_rows(
+                    'encounters', events['encounters'], ENCOUNTER_COLUMNS)),
+                'medications': self._take_rows(events['medications'], self._stage_new_rows(
+                    'medications', events['medications'], MEDICATION_COLUMNS))
+            }
+        
+        logger.info(f"Incremental: {new_patients.sum()} new or changed patients, {new_labs.sum()} new labs, "
+                   f"{new_conditions.sum()} new conditions; rescoring {len(rescore)} patients")
+        return selected
+    
+    def _stage_new_rows(self, kind: str, rows, columns: List[str]) -> np.ndarray:
+        """Mask of rows not loaded by an earlier run (all rows on a full rescan); stages their hashes"""
+        hashes = row_hashes(rows, columns)
+        new = np.ones(len(hashes), dtype=bool) if self.full_rescan else self.manifest.new_rows(kind, hashes)
+        self.manifest.stage_rows(kind, hashes[new], self._row_patient_ids(rows)[new])
+        return new
+    
+    @staticmethod
+    def _row_patient_ids(rows) -> np.ndarray:
+        """patient_id of each row (list of dicts/records or DataFrame)"""
+        if isinstance(rows, pd.DataFrame):
+            return rows['patient_id'].astype(object).to_numpy()
+        return np.array([row.get('patient_id') for row in rows], dtype=object)
+    
+    @staticmethod
+    def _take_rows(rows, mask):
+        """Rows (list of dicts/records or DataFrame) where mask is True"""
+        mask = np.asarray(mask, dtype=bool)
+        if isinstance(rows, pd.DataFrame):
+            return rows[mask].reset_index(drop=True)
+        return [row for row, keep in zip(rows, mask.tolist()) if keep]
+    
+    def _transform(self, batch: Dict) -> Dict:
+        """Map, validate and score one batch; returns the records to load"""
+        patients = batch['patients']
+        lab_results = batch['lab_results']
+        conditions = batch['conditions']
+        events = batch.get('events')
+        
+        # Incremental batches score patients on more rows than they load (see _select_changed)
+        scoring = batch.get('scoring')
+        
+        # Status drives validation and the risk "Critical" bonus, so settle it before either
+        lab_results = self.lab_status.apply(lab_results)
+        if scoring is None:
+            score_patients, score_labs, score_conditions = patients, lab_results, conditions
+        else:
+            score_patients = [{'patient_id': patient_id} for patient_id in scoring['patient_ids']]
+            score_labs = self.lab_status.apply(scoring['lab_results'])
+            score_conditions = scoring['conditions']
+        
+        mapped_patients = self.mapper.map_multiple_patients(patients)
         valid_patients, invalid_patients = self.validator.validate_patients_batch(mapped_patients)
-        valid_labs, invalid_labs = self.validator.validate_labs_batch(mapped_labs)
+        
+        duplicates = {}
+        if self.deduplicator is not None:
+            duplicates = self.deduplicator.find_clusters(valid_patients)
+            valid_patients = self.deduplicator.collapse(valid_patients, duplicates)
+        if duplicates:
+            # Labs, conditions and risk scores of duplicates belong to the canonical patient
+            score_patients = [patient for patient in score_patients if patient.get('patient_id') not in duplicates]
+            lab_results = self._rekey_rows(lab_results, duplicates)
+            score_labs = self._rekey_rows(score_labs, duplicates)
+            score_conditions = self._rekey_rows(score_conditions, duplicates)
+            if events:
+                events = {name: self._rekey_rows(rows, duplicates) for name, rows in events.items()}
+        
+        if self.columnar:
+            mapped_labs = self.mapper.map_labs_frame(lab_results)
+            valid_labs, invalid_labs = self.validator.validate_labs_frame(mapped_labs)
+            
+            lab_trends = self.risk_calculator.lab_trends(score_labs)
+            risk_frame = self.risk_calculator.calculate_risks_frame(score_patients, score_labs, score_conditions,
+                                                                    trends=lab_trends)
+            
+            # Row dicts are only built at the Salesforce serialization boundary
+            valid_labs = frame_to_records(valid_labs)
+            risk_assessments = frame_to_records(risk_frame)
+        else:
+            # Map
+            mapped_labs = self.mapper.map_multiple_labs(lab_results)
+            
+            # Validate
+            valid_labs, invalid_labs = self.validator.validate_labs_batch(mapped_labs)
+            
+            # Calculate risks (lab trends are also loaded to BigQuery)
+            lab_trends = self.risk_calculator.lab_trends(score_labs)
+            risk_assessments = self.risk_calculator.calculate_all_patient_risks(
+                score_patients, score_labs, score_conditions, trends=lab_trends
+            )
         
         logger.info(f"Validated: {len(valid_patients)} valid patients, "
                    f"{len(valid_labs)} valid labs")
         
-        if invalid_patients:
+        if len(invalid_patients):
             logger.warning(f"Invalid patients: {len(invalid_patients)}")
-        if invalid_labs:
+        if len(invalid_labs):
             logger.warning(f"Invalid labs: {len(invalid_labs)}")
         
-        # Calculate risks
-        risk_assessments = self.risk_calculator.calculate_all_patient_risks(
-            patients, lab_results, conditions
-        )
         logger.info(f"Calculated: {len(risk_assessments)} risk assessments")
         
+        return {
+            'patients': valid_patients,
+            'labs': valid_labs,
+            'risks': risk_assessments,
+            'lab_trends': lab_trends,
+            'lab_results': lab_results,
+            'events': events,
+            'duplicates': duplicates
+        }
+    
+    @staticmethod
+    def _rekey_rows(rows, duplicates: Dict[str, str]):
+        """Point rows (list of dicts/records or DataFrame) of duplicate patients at the canonical patient_id"""
+        if isinstance(rows, pd.DataFrame):
+            patient_ids = rows['patient_id'].astype(object)
+            is_duplicate = patient_ids.isin(list(duplicates))
+            if not is_duplicate.any():
+                return rows
+            return rows.assign(patient_id=patient_ids.where(~is_duplicate, patient_ids.map(duplicates)))
+        
+        return [with_values(row, patient_id=duplicates[row['patient_id']]) if row.get('patient_id') in duplicates
+                else row for row in rows]
+    
+    def _load(self, batch: Dict, patient_id_map: Dict = None) -> Dict:
+        """
+        Load one transformed batch to Salesforce and BigQuery
+        patient_id_map carries Salesforce ids of patients loaded by earlier
+        batches; it is updated with this batch's patients.
+        """
+        if patient_id_map is None:
+            patient_id_map = {}
+        valid_patients = batch['patients']
+        
         # LOAD TO SALESFORCE
         logger.info("\n[LOAD] Loading data to Salesforce...")
         
         # Load patients
-        patient_results = self.sf_loader.upsert_patients_batch(valid_patients)
+        patient_results = self.sf_loader.upsert_patients_batch(valid_patients, batch.get('duplicates'))
+        patient_id_map.update(patient_results['patient_id_map'])
         logger.info(f"Loaded patients: {patient_results['success']}/{patient_results['total']}")
         
         # Load labs
-        lab_load_results = self.sf_loader.insert_lab_results_batch(
-            valid_labs, patient_results['patient_id_map']
-        )
+        # Incremental runs skip unchanged patients, so their Salesforce ids are looked up
+        incremental = self.manifest is not None
+        lab_load_results = self.sf_loader.insert_lab_results_batch(batch['labs'], patient_id_map,
+                                                                   incremental=incremental)
         logger.info(f"Loaded lab results: {lab_load_results['success']}/{lab_load_results['total']}")
         
         # Load risks
-        risk_load_results = self.sf_loader.insert_risk_assessments_batch(
-            risk_assessments, patient_results['patient_id_map']
-        )
+        risk_load_results = self.sf_loader.insert_risk_assessments_batch(batch['risks'], patient_id_map,
+                                                                         incremental=incremental)
         logger.info(f"Loaded risk assessments: {risk_load_results['success']}/{risk_load_results['total']}")
         
         # LOAD TO BIGQUERY
@@ -88,31 +363,20 @@ class ETLOrchestrator:
         # Add Salesforce IDs to patients for BigQuery
         for patient in valid_patients:
             patient_id = patient.get('Patient_ID__c')
-            patient['sf_id'] = patient_results['patient_id_map'].get(patient_id)
+            patient['sf_id'] = patient_id_map.get(patient_id)
         
         # Load to BigQuery
         bq_patient_results = self.bq_loader.load_patients_snapshot(valid_patients)
         logger.info(f"BigQuery patients: {bq_patient_results.get('count', 0)} loaded")
         
-        bq_events_results = self.bq_loader.load_clinical_events(lab_results)
+        bq_events_results = self.bq_loader.load_clinical_events(batch['lab_results'], **(batch['events'] or {}))
         logger.info(f"BigQuery events: {bq_events_results.get('count', 0)} loaded")
         
-        bq_risks_results = self.bq_loader.load_risk_scores(risk_assessments)
+        bq_risks_results = self.bq_loader.load_risk_scores(batch['risks'])
         logger.info(f"BigQuery risks: {bq_risks_results.get('count', 0)} loaded")
         
-        # SUMMARY
-        logger.info("\n" + "="*60)
-        logger.info("ETL PIPELINE COMPLETE")
-        logger.info("="*60)
-        logger.info("\nSalesforce:")
-        logger.info(f"  Patients: {patient_results['success']}/{patient_results['total']}")
-        logger.info(f"  Lab results: {lab_load_results['success']}/{lab_load_results['total']}")
-        logger.info(f"  Risk assessments: {risk_load_results['success']}/{risk_load_results['total']}")
-        logger.info("\nBigQuery:")
-        logger.info(f"  Patients: {bq_patient_results.get('count', 0)}")
-        logger.info(f"  Clinical events: {bq_events_results.get('count', 0)}")
-        logger.info(f"  Risk scores: {bq_risks_results.get('count', 0)}")
-        logger.info("="*60)
+        bq_trends_results = self.bq_loader.load_lab_trends(batch['lab_trends'])
+        logger.info(f"BigQuery lab trends: {bq_trends_results.get('count', 0)} loaded")
         
         return {
             'salesforce': {
@@ -123,9 +387,215 @@ class ETLOrchestrator:
             'bigquery': {
                 'patients': bq_patient_results,
                 'events': bq_events_results,
-                'risks': bq_risks_results
+                'risks': bq_risks_results,
+                'trends': bq_trends_results
             }
         }
+    
+    def _finish(self, results: Dict) -> Dict:
+        """Log the run summary and commit incremental state"""
+        salesforce = results['salesforce']
+        bigquery = results['bigquery']
+        
+        # SUMMARY
+        logger.info("\n" + "="*60)
+        logger.info("ETL PIPELINE COMPLETE")
+        logger.info("="*60)
+        logger.info("\nSalesforce:")
+        logger.info(f"  Patients: {salesforce['patients']['success']}/{salesforce['patients']['total']}")
+        logger.info(f"  Lab results: {salesforce['labs']['success']}/{salesforce['labs']['total']}")
+        logger.info(f"  Risk assessments: {salesforce['risks']['success']}/{salesforce['risks']['total']}")
+        logger.info("\nBigQuery:")
+        logger.info(f"  Patients: {bigquery['patients'].get('count', 0)}")
+        logger.info(f"  Clinical events: {bigquery['events'].get('count', 0)}")
+        logger.info(f"  Risk scores: {bigquery['risks'].get('count', 0)}")
+        logger.info(f"  Lab trends: {bigquery['trends'].get('count', 0)}")
+        logger.info("="*60)
+        
+        if self.manifest is not None:
+            # Rows that loaded are recorded even after errors, so a retry does not insert them twice;
+            # patients with any error are retried in full, and inputs are only marked as processed
+            # once everything loaded
+            self.manifest.commit(self._failed_patient_ids(results), include_files=self._load_succeeded(results))
+        if self.risk_fingerprints is not None:
+            # Patients whose assessment failed to load (to Salesforce or BigQuery) are rescored next run
+            self.risk_fingerprints.commit([*(error['patient_id'] for error in salesforce['risks']['errors']),
+                                           *bigquery['risks'].get('failed_patient_ids', [])])
+        
+        return results
+    
+    def _read_errors(self) -> int:
+        """Inputs that failed to read so far, across all readers"""
+        return self.fhir_parser.read_errors + self.csv_reader.read_errors + self.ndjson_reader.read_errors
+    
+    @staticmethod
+    def _failed_patient_ids(results: Dict) -> set:
+        """Patients with a Salesforce or BigQuery load error"""
+        failed = {error.get('patient_id') for name in ('patients', 'labs', 'risks')
+                  for error in results['salesforce'][name]['errors']}
+        for result in results['bigquery'].values():
+            failed.update(result.get('failed_patient_ids', []))
+        failed.discard(None)
+        return failed
+    
+    @staticmethod
+    def _load_succeeded(results: Dict) -> bool:
+        """True if every Salesforce record and BigQuery insert loaded"""
+        return (all(results['salesforce'][name]['failed'] == 0 for name in ('patients', 'labs', 'risks'))
+                and all(result.get('success', False) for result in results['bigquery'].values()))
+    
+    def _run_micro_batches(self) -> Dict:
+        """
+        Stream batches through transform and load with bounded memory
+        A producer thread extracts and transforms batch N+1 while the
+        calling thread loads batch N; the bounded queue stops the producer
+        from running more than queue_depth batches ahead. Per-batch results
+        are merged into the same summary shape as a single-batch run.
+        """
+        logger.info(f"\n[MICRO-BATCH] Streaming batches of {self.batch_size} patient files "
+                   f"(queue depth {self.queue_depth})...")
+        
+        batches = queue.Queue(maxsize=self.queue_depth)
+        stop = threading.Event()
+        
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            read_errors = self._read_errors()
+            try:
+                for number, batch in enumerate(self._iter_input_batches(), start=1):
+                    self.risk_calculator.context_complete = self._read_errors() == read_errors
+                    if self.manifest is not None:
+                        batch = self._select_changed(batch)
+                    logger.info(f"\n[TRANSFORM] Batch {number}: {len(batch['patients'])} patients")
+                    if not put((number, self._transform(batch))):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(None)
+        
+        producer = threading.Thread(target=produce, name='etl-transform', daemon=True)
+        producer.start()
+        
+        results = None
+        patient_id_map = {}
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                
+                number, batch = item
+                logger.info(f"\n[LOAD] Batch {number}")
+                results = self._merge_results(results, self._load(batch, patient_id_map))
+        finally:
+            stop.set()
+            producer.join()
+        
+        if results is None:
+            # Nothing to extract: load an empty batch so the summary has the usual shape
+            results = self._load({'patients': [], 'labs': [], 'risks': [], 'lab_results': [], 'events': None,
+                                  'duplicates': {}, 'lab_trends': self.risk_calculator.lab_trends([])})
+        return results
+    
+    def _iter_input_batches(self) -> Iterator[Dict]:
+        """
+        Extracted input batches for micro-batch mode, patients together with their labs and conditions
+        Inputs are streamed (patient files, CSV chunks, bundles or NDJSON shards)
+        into patient partitions of about batch_size patients, which are read back
+        one per batch: every patient's full context is in one batch, even if its
+        patient_id appears in several files, and only one partition is in memory.
+        """
+        if self.clinical_source in ('fhir', 'ndjson'):
+            yield from self._iter_clinical_batches()
+            return
+        
+        files = self.fhir_parser.list_patient_files()
+        with PatientPartitions(self._num_partitions(len(files))) as partitions:
+            for patients in self.fhir_parser.iter_patient_batches(self.batch_size, files):
+                partitions.add('patients', patients)
+            for chunk in self.csv_reader.iter_lab_results(typed=self.columnar):
+                partitions.add('lab_results', self._csv_rows(chunk, LabResult))
+            for chunk in self.csv_reader.iter_conditions(typed=self.columnar):
+                partitions.add('conditions', self._csv_rows(chunk))
+            
+            # Labs and conditions of patients that were not extracted go with their partition (for BigQuery)
+            for pieces in partitions:
+                yield {
+                    'patients': self._join_pieces(pieces['patients']),
+                    'lab_results': self._join_pieces(pieces['lab_results'], LAB_COLUMNS),
+                    'conditions': self._join_pieces(pieces['conditions'], CONDITION_COLUMNS)
+                }
+    
+    def _iter_clinical_batches(self) -> Iterator[Dict]:
+        """Micro-batch inputs from FHIR bundles or an NDJSON export (see _iter_input_batches)"""
+        if self.clinical_source == 'ndjson':
+            num_patients = self.ndjson_reader.count_patients()
+            clinical_batches = self.ndjson_reader.iter_shard_batches()
+        else:
+            files = self.fhir_parser.list_patient_files()
+            num_patients = len(files)
+            clinical_batches = self.fhir_parser.iter_bundle_batches(self.batch_size, files)
+        
+        batch_names = [batch_name for batch_name, _ in ClinicalBatch.RESOURCE_TYPES.values()]
+        with PatientPartitions(self._num_partitions(num_patients)) as partitions:
+            for clinical_batch in clinical_batches:
+                partitions.add('patients', clinical_batch.patients)
+                for batch_name in batch_names:
+                    partitions.add(batch_name, clinical_batch.records(batch_name))
+            
+            for pieces in partitions:
+                yield self._clinical_batch_input(ClinicalBatch.from_records(
+                    self._join_pieces(pieces['patients']),
+                    {batch_name: self._join_pieces(pieces[batch_name]) for batch_name in batch_names}
+                ))
+    
+    def _num_partitions(self, num_patients: int) -> int:
+        """Partitions of about batch_size patients each"""
+        return max(1, math.ceil(num_patients / self.batch_size))
+    
+    def _csv_rows(self, chunk: pd.DataFrame, record_type=None):
+        """CSV chunk as the batch rows of this mode (DataFrame, slotted records or dicts)"""
+        if self.columnar:
+            return chunk
+        if self.compact_records and record_type is not None:
+            return record_type.from_frame(chunk)
+        return chunk.to_dict('records')
+    
+    def _join_pieces(self, pieces: List, columns: List[str] = None):
+        """Concatenate a partition's pieces of one kind (DataFrames in columnar mode when columns are given)"""
+        if columns is not None and self.columnar:
+            return concat_frames(pieces, columns)
+        return [row for piece in pieces for row in piece]
+    
+    @staticmethod
+    def _merge_results(total: Optional[Dict], batch: Dict) -> Dict:
+        """Fold one batch's load results into the running summary"""
+        if total is None:
+            return batch
+        
+        for key, value in batch.items():
+            if key not in total:
+                total[key] = value
+            elif isinstance(value, dict):
+                total[key] = ETLOrchestrator._merge_results(total[key], value)
+            elif isinstance(value, bool):
+                total[key] = total[key] and value
+            elif isinstance(value, (int, float)):
+                total[key] += value
+            elif isinstance(value, list):
+                total[key].extend(value)
+        return total
 
 if __name__ == "__main__":
     orchestrator = ETLOrchestrator()
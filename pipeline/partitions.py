@@ -0,0 +1,90 @@
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def partition_codes(patient_ids, num_partitions: int) -> np.ndarray:
+    """Partition of each patient_id (stable across runs and input types)"""
+    patient_ids = np.asarray(patient_ids, dtype=object)
+    if not len(patient_ids):
+        return np.zeros(0, dtype=np.int64)
+    # None/NaN ids (orphan rows) hash like the empty string
+    patient_ids = pd.Series(patient_ids, dtype=object).where(pd.notna(patient_ids), '').astype(str).to_numpy()
+    return (pd.util.hash_array(patient_ids) % np.uint64(num_partitions)).astype(np.int64)
+
+
+class PatientPartitions:
+    """
+    Spill input rows to temporary files, one per partition of patient ids
+    Rows are routed by a hash of their patient_id, so a patient's record(s),
+    labs, conditions and events all end up in the same partition however
+    they are spread over the inputs. Reading a partition back gives a batch
+    with each patient's full context while only one partition is in memory.
+    """
+
+    def __init__(self, num_partitions: int, directory: str = None):
+        self.num_partitions = max(1, num_partitions)
+        self._tmp_dir = Path(tempfile.mkdtemp(prefix='etl-partitions-', dir=directory))
+        self.row_counts = np.zeros(self.num_partitions, dtype=np.int64)
+
+    def _path(self, partition: int) -> Path:
+        return self._tmp_dir / f"{partition}.pkl"
+
+    def add(self, kind: str, rows):
+        """Append rows (list of dicts/records or DataFrame) of one kind, split by partition"""
+        if rows is None or not len(rows):
+            return
+
+        if isinstance(rows, pd.DataFrame):
+            patient_ids = rows['patient_id'].astype(object).to_numpy()
+        else:
+            patient_ids = [row.get('patient_id') for row in rows]
+        codes = partition_codes(patient_ids, self.num_partitions)
+
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+
+        for positions in np.split(order, bounds):
+            partition = int(codes[positions[0]])
+            if isinstance(rows, pd.DataFrame):
+                piece = rows.take(positions).reset_index(drop=True)
+            else:
+                piece = [rows[position] for position in positions.tolist()]
+            with open(self._path(partition), 'ab') as f:
+                pickle.dump((kind, piece), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.row_counts[partition] += len(piece)
+
+    def __iter__(self) -> Iterator[Dict[str, List]]:
+        """Yield the pieces of each non-empty partition as {kind: [piece, ...]}, in input order"""
+        for partition in range(self.num_partitions):
+            if not self.row_counts[partition]:
+                continue
+
+            pieces = defaultdict(list)
+            with open(self._path(partition), 'rb') as f:
+                while True:
+                    try:
+                        kind, piece = pickle.load(f)
+                    except EOFError:
+                        break
+                    pieces[kind].append(piece)
+            yield pieces
+
+    def close(self):
+        """Remove the spill files"""
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
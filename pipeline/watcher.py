@@ -0,0 +1,111 @@
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_WATCH_DIRS = ("data/raw", "data/raw/synthea_output", "data/raw/bulk_export")
+
+# Patients per micro-batch in watch cycles, unless the orchestrator sets its own batch_size
+DEFAULT_WATCH_BATCH_SIZE = 500
+
+
+class IngestWatcher:
+    """
+    Poll raw data directories and push new drops through the pipeline
+    The orchestrator (and its Salesforce/BigQuery clients) is created once
+    and reused; it must run in incremental mode so each cycle only loads
+    rows that were not loaded by an earlier run. Cycles go through the
+    micro-batch path, so a large drop is loaded in bounded batches.
+    """
+
+    def __init__(self, orchestrator, watch_dirs: Iterable[str] = DEFAULT_WATCH_DIRS,
+                 poll_interval: float = 30, debounce_seconds: float = 10,
+                 batch_size: int = DEFAULT_WATCH_BATCH_SIZE):
+        if orchestrator.manifest is None:
+            raise ValueError("IngestWatcher requires an orchestrator created with incremental=True")
+        if orchestrator.batch_size is None:
+            orchestrator.batch_size = batch_size
+
+        self.orchestrator = orchestrator
+        self.watch_dirs = [Path(d) for d in watch_dirs]
+        self.poll_interval = poll_interval
+        # A file must be untouched this long before it is considered fully written
+        self.debounce_seconds = debounce_seconds
+        self._processed: Dict[Path, Tuple[int, int]] = {}
+
+    def _snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        """(size, mtime) of every file directly inside the watched directories"""
+        snapshot = {}
+        for watch_dir in self.watch_dirs:
+            if not watch_dir.exists():
+                continue
+            for file_path in watch_dir.iterdir():
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue
+                if file_path.is_file():
+                    snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll_once(self) -> bool:
+        """
+        Run the pipeline if new files have arrived and settled; returns True if it ran
+        Files are marked processed only after a clean run.
+        """
+        snapshot = self._snapshot()
+        arrived = [path for path, state in snapshot.items() if self._processed.get(path) != state]
+
+        if not arrived:
+            return False
+
+        now_ns = time.time_ns()
+        debounce_ns = int(self.debounce_seconds * 1e9)
+        unsettled = {path for path in arrived if now_ns - snapshot[path][1] < debounce_ns}
+
+        # Patient bundles are independent, so unsettled ones are deferred to a later cycle; any other
+        # input (CSV tables, NDJSON shards) is read as a whole and holds the drop until it settles
+        bundle_dir = self.orchestrator.fhir_parser.data_dir.resolve()
+        held = [path for path in unsettled if path.parent.resolve() != bundle_dir]
+        if held or len(unsettled) == len(arrived):
+            logger.info(f"{len(arrived)} new files, waiting for {len(held) or len(unsettled)} to settle")
+            return False
+
+        logger.info(f"Processing drop of {len(arrived) - len(unsettled)} new or modified files"
+                    + (f", deferring {len(unsettled)} still being written" if unsettled else ""))
+        self.orchestrator.fhir_parser.skip_files = {path.resolve() for path in unsettled}
+        try:
+            results = self.orchestrator.run_pipeline()
+        finally:
+            self.orchestrator.fhir_parser.skip_files = set()
+
+        if not results.get('success'):
+            # The orchestrator did not commit this drop; leave it unprocessed so the next poll retries it
+            logger.warning("Drop did not load cleanly, retrying it on the next poll")
+            return True
+
+        self._processed.update({path: state for path, state in snapshot.items() if path not in unsettled})
+        return True
+
+    def run(self, max_cycles: int = None):
+        """Poll until interrupted (or for max_cycles polls)"""
+        logger.info(f"Watching {', '.join(str(d) for d in self.watch_dirs)} "
+                    f"every {self.poll_interval}s")
+        cycles = 0
+
+        try:
+            while max_cycles is None or cycles < max_cycles:
+                try:
+                    self.poll_once()
+                except Exception as e:
+                    # Leave the drop unprocessed so the next poll retries it
+                    logger.error(f"Ingest cycle failed: {e}")
+
+                cycles += 1
+                if max_cycles is None or cycles < max_cycles:
+                    time.sleep(self.poll_interval)
+
+        except KeyboardInterrupt:
+            logger.info("Ingest watcher stopped")
@@ -1,36 +1,22 @@
+import sys
 import pandas as pd
 import random
-import json 
 from datetime import datetime, timedelta
 import os
 from pathlib import Path 
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from etl.extract import FHIRParser
+
 print("Create data directory")
 # Create data directory
 os.makedirs('data/raw', exist_ok=True)
 
 print("Read patient IDs from FHIR files")
-# Read patient IDs from FHIR files
-patient_ids = []
-fhir_dir = Path('data/raw/synthea_output')
-
-# If FHIR file exits: extract patient data from bundle   
-if fhir_dir.exists():
-    for file_path in fhir_dir.glob('*.json'):
-        try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-
-            if data.get('resourceType') == 'Bundle':
-                for entry in data.get('entry', []):
-                    resource = entry.get('resource', {})
-                    if resource.get('resourceType') == 'Patient':
-                        patient_id = resource.get('id')
-                        if patient_id:
-                            patient_ids.append(patient_id)
-                            break
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
+# Read patient IDs from FHIR files (the parser stops at each bundle's Patient entry)
+fhir_parser = FHIRParser('data/raw/synthea_output')
+patient_ids = [patient.get('id') for patient in fhir_parser.read_patient_files() if patient.get('id')]
         
 print(f"Found {len(patient_ids)} patient IDs from FHIR files.")
 
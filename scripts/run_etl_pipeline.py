@@ -0,0 +1,100 @@
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pipeline.orchestrator import ETLOrchestrator
+from pipeline.watcher import IngestWatcher
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the healthcare ETL pipeline")
+    parser.add_argument('--clinical-source', choices=['csv', 'fhir', 'ndjson'], default='csv',
+                        help="Where labs and conditions come from")
+    parser.add_argument('--columnar', action='store_true',
+                        help="Thread labs/conditions through transform as DataFrames")
+    parser.add_argument('--compact-records', action='store_true',
+                        help="Keep patients, labs and risk assessments as slotted records instead of dicts")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only extract inputs changed since the last successful run")
+    parser.add_argument('--full-rescan', action='store_true',
+                        help="With --incremental, re-extract everything and refresh the manifest")
+    parser.add_argument('--patient-cache', action='store_true',
+                        help="Cache extracted patients by bundle content hash "
+                             "(CSV clinical source only; fhir/ndjson runs decode every bundle)")
+    parser.add_argument('--incremental-risk', action='store_true',
+                        help="Only rescore and reload patients whose labs, conditions or rule set changed")
+    parser.add_argument('--lab-status', choices=['reported', 'verify', 'derive'], default='reported',
+                        help="Keep, check or derive lab status from the reference range")
+    parser.add_argument('--deduplicate', action='store_true',
+                        help="Collapse records of the same patient (DOB + name blocking) before loading")
+    parser.add_argument('--salesforce-api', choices=['rest', 'collections', 'bulk'], default='rest',
+                        help="Load Salesforce records one request at a time, 200 per request "
+                             "(sObject Collections) or as Bulk API 2.0 jobs")
+    parser.add_argument('--salesforce-workers', type=int, default=1,
+                        help="Salesforce requests to keep in flight at once")
+    parser.add_argument('--salesforce-rate', type=float, default=None,
+                        help="Cap on Salesforce requests per second")
+    parser.add_argument('--salesforce-daily-limit', type=int, default=None,
+                        help="Cap on Salesforce requests per 24 hours (default with a limiter: "
+                             "80%% of the org's remaining daily requests)")
+    parser.add_argument('--patient-id-store', action='store_true',
+                        help="Keep patient Salesforce ids across runs and skip upserting unchanged patients")
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help="Transform and load about this many patients (with their labs and conditions) "
+                             "at a time; inputs are staged in temporary files partitioned by patient")
+    parser.add_argument('--queue-depth', type=int, default=2,
+                        help="With --batch-size, transformed batches allowed to wait for loading")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and process new drops in data/raw in micro-batches "
+                             "(implies --incremental; --batch-size defaults to 500)")
+    parser.add_argument('--poll-interval', type=float, default=30,
+                        help="Seconds between polls in --watch mode")
+    parser.add_argument('--debounce', type=float, default=10,
+                        help="Seconds a new file must be unchanged before it is processed")
+    args = parser.parse_args()
+
+    if args.watch and args.full_rescan:
+        parser.error("--full-rescan would re-extract everything on every poll; run it once without --watch")
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.queue_depth < 1:
+        parser.error("--queue-depth must be at least 1")
+    if args.salesforce_workers < 1:
+        parser.error("--salesforce-workers must be at least 1")
+    return args
+
+def main():
+    args = parse_args()
+
+    orchestrator = ETLOrchestrator(
+        clinical_source=args.clinical_source,
+        columnar=args.columnar,
+        incremental=args.incremental or args.watch,
+        full_rescan=args.full_rescan,
+        patient_cache=args.patient_cache,
+        incremental_risk=args.incremental_risk,
+        batch_size=args.batch_size,
+        queue_depth=args.queue_depth,
+        deduplicate=args.deduplicate,
+        lab_status=args.lab_status,
+        compact_records=args.compact_records,
+        salesforce_api=args.salesforce_api,
+        patient_id_store=args.patient_id_store,
+        salesforce_workers=args.salesforce_workers,
+        salesforce_rate=args.salesforce_rate,
+        salesforce_daily_limit=args.salesforce_daily_limit
+    )
+
+    if args.watch:
+        watcher = IngestWatcher(orchestrator, poll_interval=args.poll_interval,
+                                debounce_seconds=args.debounce)
+        watcher.run()
+    else:
+        orchestrator.run_pipeline()
+
+if __name__ == "__main__":
+    main()
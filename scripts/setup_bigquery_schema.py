@@ -45,6 +45,29 @@ class BigQuerySetup:
                     logger.error(f"Error creating dataset: {create_error}")
                     raise 
     
+    def add_missing_columns(self, table_id: str, schema: list):
+        """
+        Bring an existing table up to date with its schema
+        Columns added to a schema after the table was created (e.g.
+        risk_scores_history.rule_set_version) are appended in place;
+        BigQuery only allows adding NULLABLE or REPEATED columns.
+        """
+        table = self.client.get_table(table_id)
+        existing = {field.name for field in table.schema}
+        missing = [field for field in schema if field.name not in existing]
+        
+        if not missing:
+            return table
+        
+        required = [field.name for field in missing if field.mode == "REQUIRED"]
+        if required:
+            raise ValueError(f"Cannot add REQUIRED columns {required} to existing table {table_id}")
+        
+        table.schema = list(table.schema) + missing
+        table = self.client.update_table(table, ["schema"])
+        logger.info(f"Added columns {[field.name for field in missing]} to table {table_id}")
+        return table
+    
     def create_patients_table(self):
         """Create patients snapshot table"""
         table_id = f"{self.project_id}.{self.dataset_id}.patients_snapshot"
@@ -70,6 +93,7 @@ class BigQuerySetup:
         except Exception as e:
             if "Already Exists" in str(e):
                 logger.info(f"Table {table_id} already exists")
+                self.add_missing_columns(table_id, schema)
             else:
                 logger.error(f"Error creating table: {e}")
                 raise
@@ -97,6 +121,7 @@ class BigQuerySetup:
         except Exception as e:
             if "Already Exists" in str(e):
                 logger.info(f"Table {table_id} already exists")
+                self.add_missing_columns(table_id, schema)
             else:
                 logger.error(f"Error creating table: {e}")
                 raise
@@ -111,6 +136,37 @@ class BigQuerySetup:
             bigquery.SchemaField("risk_score", "INTEGER", mode="REQUIRED"),
             bigquery.SchemaField("risk_factors", "STRING", mode="NULLABLE"),
             bigquery.SchemaField("assessment_date", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("rule_set_version", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("created_timestamp", "TIMESTAMP", mode="REQUIRED"),
+        ]
+        
+        table = bigquery.Table(table_id, schema=schema)
+        
+        try:
+            table = self.client.create_table(table)
+            logger.info(f"Created table {table_id}")
+        except Exception as e:
+            if "Already Exists" in str(e):
+                logger.info(f"Table {table_id} already exists")
+                self.add_missing_columns(table_id, schema)
+            else:
+                logger.error(f"Error creating table: {e}")
+                raise
+    
+    def create_lab_trends_table(self):
+        """Create lab trend features table"""
+        table_id = f"{self.project_id}.{self.dataset_id}.lab_trends"
+        
+        schema = [
+            bigquery.SchemaField("patient_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("test_type", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("test_count", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("latest_value", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("latest_test_datetime", "TIMESTAMP", mode="NULLABLE"),
+            bigquery.SchemaField("days_since_last_test", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("slope_per_year", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("rolling_mean", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("count_last_90_days", "INTEGER", mode="NULLABLE"),
             bigquery.SchemaField("created_timestamp", "TIMESTAMP", mode="REQUIRED"),
         ]
         
@@ -122,6 +178,7 @@ class BigQuerySetup:
         except Exception as e:
             if "Already Exists" in str(e):
                 logger.info(f"Table {table_id} already exists")
+                self.add_missing_columns(table_id, schema)
             else:
                 logger.error(f"Error creating table: {e}")
                 raise
@@ -136,6 +193,7 @@ class BigQuerySetup:
         self.create_patients_table()
         self.create_clinical_events_table()
         self.create_risk_scores_table()
+        self.create_lab_trends_table()
         
         logger.info("="*60)
         logger.info("BIGQUERY SETUP COMPLETE")
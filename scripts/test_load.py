@@ -1,11 +1,25 @@
+import csv
+import io
+import json
+import os
+import re
 import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import quote_plus, unquote_plus
+
+import requests
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from etl.extract import FHIRParser, CSVReader
 from etl.transform import DataMapper, DataValidator, RiskCalculator
-from etl.load import SalesforceLoader
+from etl.load import SalesforceLoader, PatientIdStore, RateLimiter
+from etl.load import salesforce_loader
+from etl.load.rate_limiter import ApiLimitExceeded
+from pipeline import orchestrator
 from utils import setup_logger
 
 logger = setup_logger(__name__)
@@ -107,5 +121,374 @@ def test_load():
     print(f"  Risk assessments loaded: {risk_results['success']}/{risk_results['total']}")
     print("="*60)
 
+class FakeBulkAPI(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the Bulk API 2.0 ingest endpoints (and the limits resource)
+    Jobs finish on their second status poll. Rows with a 'Bogus' cell fail,
+    jobs on an object in fail_objects fail as a whole, and jobs on an
+    object in stalled_objects never finish.
+    """
+    jobs = {}
+    fail_objects = set()
+    stalled_objects = set()
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: bytes = b'', content_type: str = 'application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Sforce-Locator', 'null')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        job = json.loads(self._body())
+        with self.lock:
+            job_id = f"750FAKE{len(self.jobs) + 1}"
+            self.jobs[job_id] = dict(job, id=job_id, state='Open', polls=0)
+        self._send(200, json.dumps({'id': job_id, 'state': 'Open'}).encode())
+
+    def do_PUT(self):
+        self.jobs[self.path.split('/')[-2]]['data'] = self._body().decode('utf-8')
+        self._send(201)
+
+    def do_PATCH(self):
+        job = self.jobs[self.path.split('/')[-1]]
+        state = json.loads(self._body())['state']
+        job['state'] = 'InProgress' if state == 'UploadComplete' else state
+        self._send(200, json.dumps({'id': job['id'], 'state': job['state']}).encode())
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].rstrip('/').split('/')
+        if parts[-1] == 'limits':
+            return self._send(200, json.dumps({'DailyApiRequests': {'Remaining': 10, 'Max': 15000}}).encode())
+        if parts[-2] == 'ingest':
+            job = self.jobs[parts[-1]]
+            if job['state'] == 'InProgress' and job['object'] not in self.stalled_objects:
+                job['polls'] += 1
+                if job['polls'] >= 2:
+                    job['state'] = 'Failed' if job['object'] in self.fail_objects else 'JobComplete'
+            status = {'id': job['id'], 'state': job['state']}
+            if job['state'] == 'Failed':
+                status['errorMessage'] = 'InvalidBatch : fake job failure'
+            return self._send(200, json.dumps(status).encode())
+
+        job = self.jobs[parts[-2]]
+        rows = list(csv.DictReader(io.StringIO(job.get('data', ''))))
+        fields = list(rows[0]) if rows else []
+        if parts[-1] == 'successfulResults':
+            fields, rows = ['sf__Id', 'sf__Created'] + fields, [
+                dict(row, sf__Id=f"a0F{n:012d}", sf__Created='true') for n, row in enumerate(rows)
+                if 'Bogus' not in row.values()] if job['state'] == 'JobComplete' else []
+        elif parts[-1] == 'failedResults':
+            fields, rows = ['sf__Id', 'sf__Error'] + fields, [
+                dict(row, sf__Id='', sf__Error='INVALID_OR_NULL_FOR_RESTRICTED_PICKLIST: bad value')
+                for row in rows if 'Bogus' in row.values()] if job['state'] == 'JobComplete' else []
+        elif job['state'] == 'JobComplete':
+            rows = []
+
+        # Results come back in no particular order
+        rows.reverse()
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fields, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+        self._send(200, buffer.getvalue().encode('utf-8'), 'text/csv')
+
+
+class FakeSObject:
+    """REST sObject endpoint of FakeSalesforce"""
+
+    def __init__(self, org: 'FakeSalesforce', name: str):
+        self.org = org
+        self.name = name
+
+    def upsert(self, key: str, data: dict):
+        patient_id = key.split('/', 1)[1]
+        if 'Bogus' in data.values() or patient_id in self.org.reject:
+            raise Exception("INVALID_OR_NULL_FOR_RESTRICTED_PICKLIST: bad value")
+        self.org.upserts += 1
+        self.org.upserted_ids.append(patient_id)
+        self.org.records.setdefault(patient_id, f"a0P{len(self.org.records):012d}")
+        return 204
+
+    def create(self, data: dict):
+        if data.get('Patient__c') in self.org.deleted:
+            raise Exception("ENTITY_IS_DELETED: entity is deleted")
+        self.org.created.append((self.name, data))
+        return {'id': 'a0L000000000001'}
+
+
+class FakeSalesforce:
+    """Stand-in for simple_salesforce.Salesforce: REST upserts, IN-list queries and sObject Collections"""
+    bulk_url = None
+
+    def __init__(self, *args, **kwargs):
+        self.sf_instance = 'fake.my.salesforce.com'
+        self.base_url = self.bulk_url
+        self.session_id = 'fake-session'
+        self.session = requests.Session()
+        self.records = {}
+        self.deleted = set()
+        # Patient ids whose upserts fail
+        self.reject = set()
+        self.upserts = 0
+        self.upserted_ids = []
+        self.created = []
+        self.query_uris = []
+
+    def __getattr__(self, name: str):
+        return FakeSObject(self, name)
+
+    def limits(self):
+        response = self.session.get(f"{self.base_url}limits/")
+        response.raise_for_status()
+        return response.json()
+
+    def query_all(self, query: str):
+        self.query_uris.append(f"{self.base_url}query/?q={quote_plus(query)}")
+        patient_ids = re.findall(r"'((?:[^'\\]|\\.)*)'", query)
+        return {'records': [{'Id': self.records[patient_id], 'Patient_ID__c': patient_id}
+                            for patient_id in patient_ids if patient_id in self.records]}
+
+    def restful(self, path: str, method: str = 'GET', data: str = None):
+        return [{'success': False, 'errors': [{'statusCode': 'INVALID_OR_NULL_FOR_RESTRICTED_PICKLIST',
+                                               'message': 'bad value'}]}
+                if 'Bogus' in record.values() else {'success': True, 'id': 'a0L000000000001'}
+                for record in json.loads(data)['records']]
+
+
+class FakeBigQuery:
+    """Stand-in for BigQueryLoader that accepts every row"""
+
+    def _loaded(self, rows) -> dict:
+        return {'success': True, 'count': len(rows)}
+
+    def load_patients_snapshot(self, patients):
+        return self._loaded(patients)
+
+    def load_clinical_events(self, lab_results, conditions=None, **events):
+        return self._loaded(lab_results)
+
+    def load_risk_scores(self, risk_assessments):
+        return self._loaded(risk_assessments)
+
+    def load_lab_trends(self, trends):
+        return self._loaded(trends)
+
+
+def write_pipeline_inputs(patient_ids):
+    """Patient bundles plus two labs and a condition per patient under data/raw"""
+    bundle_dir = Path('data/raw/synthea_output')
+    bundle_dir.mkdir(parents=True)
+    for patient_id in patient_ids:
+        patient = {'resourceType': 'Patient', 'id': patient_id, 'gender': 'female', 'birthDate': '1960-05-01',
+                   'name': [{'given': ['Ada'], 'family': f"Lovelace{patient_id}"}]}
+        (bundle_dir / f"{patient_id}.json").write_text(json.dumps(
+            {'resourceType': 'Bundle', 'type': 'collection', 'entry': [{'resource': patient}]}))
+    
+    with open('data/raw/lab_results.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['patient_id', 'test_type', 'value', 'reference_range', 'test_datetime', 'status'])
+        for patient_id in patient_ids:
+            writer.writerow([patient_id, 'A1C', 6.8, '4.0-5.6', '2024-01-10 09:00:00', 'Abnormal'])
+            writer.writerow([patient_id, 'Glucose', 92, '70-100', '2024-01-10 09:00:00', 'Normal'])
+    
+    with open('data/raw/conditions.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['patient_id', 'condition'])
+        writer.writerows([patient_id, 'Hypertension'] for patient_id in patient_ids)
+
+
+def check(label: str, passed: bool, detail=None):
+    print(f"   {'✅' if passed else '❌'} {label}" + ('' if passed or detail is None else f": {detail}"))
+    return passed
+
+
+def test_load_offline():
+    """Test Salesforce load paths against local fakes (no org needed)"""
+    
+    print("="*60)
+    print("TESTING SALESFORCE LOAD PATHS (OFFLINE)")
+    print("="*60)
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBulkAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeSalesforce.bulk_url = f"http://127.0.0.1:{server.server_address[1]}/services/data/v59.0/"
+    salesforce_loader.Salesforce = FakeSalesforce
+    
+    # P3 is a duplicate of P2 and shares its Salesforce record
+    patient_id_map = {'P1': 'a0P000000000001', 'P2': 'a0P000000000002', 'P3': 'a0P000000000002'}
+    labs = [
+        {'patient_id': 'P1', 'Test_Type__c': 'A1C', 'Test_Value__c': 6.1, 'Status__c': 'Normal'},
+        {'patient_id': 'P3', 'Test_Type__c': 'A1C', 'Test_Value__c': 9.8, 'Status__c': 'Bogus'},
+        {'patient_id': 'P2', 'Test_Type__c': 'Glucose', 'Test_Value__c': 140.0, 'Status__c': 'Abnormal'},
+    ]
+    risks = [{'patient_id': 'P1', 'Risk_Level__c': 'Low', 'Risk_Score__c': 5}]
+    
+    def bulk_loader(**kwargs) -> SalesforceLoader:
+        loader = SalesforceLoader(api='bulk', **kwargs)
+        loader.bulk.poll_interval = 0.01
+        return loader
+    
+    print("\n1. Bulk API 2.0 jobs...")
+    results = bulk_loader().insert_lab_results_batch(labs, patient_id_map)
+    check("Failed rows are reported per record",
+          (results['success'], results['failed']) == (2, 1)
+          and results['errors'][0]['patient_id'] == 'P3'
+          and 'RESTRICTED_PICKLIST' in results['errors'][0]['error'], results)
+    
+    FakeBulkAPI.fail_objects.add('Risk_Assessment__c')
+    results = bulk_loader().insert_risk_assessments_batch(risks, patient_id_map)
+    FakeBulkAPI.fail_objects.clear()
+    check("A failed job fails all of its records with the job error",
+          results['failed'] == 1 and 'fake job failure' in results['errors'][0]['error'], results)
+    
+    FakeBulkAPI.stalled_objects.add('Risk_Assessment__c')
+    loader = bulk_loader()
+    loader.bulk.job_timeout = 0.2
+    results = loader.insert_risk_assessments_batch(risks, patient_id_map)
+    FakeBulkAPI.stalled_objects.clear()
+    aborted = [job for job in FakeBulkAPI.jobs.values() if job['state'] == 'Aborted']
+    check("A job that does not finish in time is aborted and its records fail",
+          results['failed'] == 1 and 'Timed out' in results['errors'][0]['error'] and len(aborted) == 1, results)
+    
+    print("\n2. sObject Collections...")
+    results = SalesforceLoader(api='collections').insert_lab_results_batch(labs, patient_id_map)
+    check("One bad record does not fail the others",
+          (results['success'], results['failed']) == (2, 1) and results['errors'][0]['patient_id'] == 'P3', results)
+    
+    print("\n3. Patient ID lookups...")
+    loader = SalesforceLoader()
+    patient_ids = [f"PATIENT-{n:05d}-{'x' * 40}" for n in range(3000)]
+    loader.sf.records = {patient_id: f"a0P{n:012d}" for n, patient_id in enumerate(patient_ids)}
+    resolved = loader.resolve_patient_ids(patient_ids)
+    longest = max(len(uri) for uri in loader.sf.query_uris)
+    check(f"IN lists are split over {len(loader.sf.query_uris)} queries under the URI limit",
+          len(resolved) == len(patient_ids) and len(loader.sf.query_uris) > 1
+          and longest <= salesforce_loader.SOQL_URI_BUDGET, longest)
+    
+    loader = SalesforceLoader()
+    loader.sf.records = {'P7': 'a0P000000000007', 'P8': 'a0P000000000008'}
+    patient_id_map = loader.upsert_patients_batch([{'Patient_ID__c': 'P8', 'Gender__c': 'Bogus'}])['patient_id_map']
+    child_labs = [{'patient_id': 'P7', 'Test_Type__c': 'A1C'}, {'patient_id': 'P8', 'Test_Type__c': 'A1C'}]
+    loader.sf.query_uris.clear()
+    full = loader.insert_lab_results_batch(child_labs, dict(patient_id_map))
+    full_queries = len(loader.sf.query_uris)
+    incremental = loader.insert_lab_results_batch(child_labs, dict(patient_id_map), incremental=True)
+    check("Missing patients are only looked up in incremental runs, never after a failed upsert",
+          full_queries == 0 and full['failed'] == 2 and incremental['success'] == 1
+          and incremental['errors'][0]['patient_id'] == 'P8' and 'P8' not in loader.sf.query_uris[0],
+          (full_queries, incremental))
+    
+    print("\n4. Patient ID store...")
+    with tempfile.TemporaryDirectory() as state_dir:
+        patients = [{'Patient_ID__c': f"P{n}", 'First_Name__c': 'Ada', 'Last_Name__c': 'Lovelace'} for n in range(5)]
+        store = PatientIdStore(str(Path(state_dir) / 'patient_ids.sqlite'))
+        loader = SalesforceLoader(id_store=store)
+        first = loader.upsert_patients_batch(patients)
+        upserts = loader.sf.upserts
+        second = loader.upsert_patients_batch(patients)
+        check("Unchanged patients are not upserted again",
+              loader.sf.upserts == upserts and second['patient_id_map'] == first['patient_id_map'])
+        
+        store.max_age = 0
+        del loader.sf.records['P4']
+        third = loader.upsert_patients_batch(patients)
+        check("Stale entries are re-verified and missing records upserted again",
+              loader.sf.upserts == upserts + 1 and third['success'] == 5 and len(loader.sf.query_uris) >= 2)
+        
+        loader.sf.deleted.add(third['patient_id_map']['P1'])
+        results = loader.insert_lab_results_batch([{'patient_id': 'P1', 'Test_Type__c': 'A1C'}],
+                                                  third['patient_id_map'])
+        check("Patients whose record was deleted are dropped from the store",
+              results['failed'] == 1 and 'P1' not in store.lookup(['P1']) and len(store) == 4)
+        store.close()
+    
+    print("\n5. Rate limiter...")
+    limiter = RateLimiter(max_concurrent=2, daily_limit=3)
+    for _ in range(3):
+        with limiter:
+            pass
+    try:
+        with limiter:
+            pass
+        capped = False
+    except ApiLimitExceeded:
+        capped = True
+    check("Requests past the daily cap raise ApiLimitExceeded", capped and limiter.requests_last_24h() == 3)
+    
+    limiter = RateLimiter(max_concurrent=1, daily_limit=0)
+    try:
+        limiter.acquire()
+    except ApiLimitExceeded:
+        pass
+    check("A refused request gives its slot back", limiter._slots.acquire(blocking=False))
+    
+    limiter = RateLimiter()
+    loader = SalesforceLoader(rate_limiter=limiter)
+    check("The daily cap defaults to the org's remaining requests less the reserve",
+          limiter.daily_limit == int(10 * (1 - salesforce_loader.DAILY_API_RESERVE))
+          and limiter.requests_last_24h() == 1)
+    
+    with limiter:
+        loader.sf.limits()
+        loader.sf.limits()
+    loader.sf.limits()
+    check("Every HTTP call counts once, inside or outside a limiter block", limiter.requests_last_24h() == 4,
+          limiter.requests_last_24h())
+    
+    print("\n6. Incremental runs...")
+    orchestrator.BigQueryLoader = FakeBigQuery
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            write_pipeline_inputs(['P1', 'P2', 'P3'])
+            etl = orchestrator.ETLOrchestrator(incremental=True)
+            org = etl.sf_loader.sf
+            
+            def loaded_since(upserted: int, created: int):
+                """(upserted patient ids, patient id per created child record) since the given counts"""
+                patient_ids = {sf_id: patient_id for patient_id, sf_id in org.records.items()}
+                return (org.upserted_ids[upserted:],
+                        sorted((sobject, patient_ids[data['Patient__c']]) for sobject, data in org.created[created:]))
+            
+            org.reject.add('P2')
+            first = etl.run_pipeline()
+            upserted, created = len(org.upserted_ids), len(org.created)
+            check("A run with a failed patient is not clean and does not look that patient up",
+                  not first['success'] and loaded_since(0, 0)[0] == ['P1', 'P3']
+                  and not any("'P2'" in query for query in map(unquote_plus, org.query_uris)), loaded_since(0, 0))
+            
+            org.reject.clear()
+            second = etl.run_pipeline()
+            check("The next run reloads exactly the failed patient's rows",
+                  second['success'] and loaded_since(upserted, created) == (
+                      ['P2'], [('Lab_Result__c', 'P2'), ('Lab_Result__c', 'P2'), ('Risk_Assessment__c', 'P2')]),
+                  loaded_since(upserted, created))
+            
+            upserted, created = len(org.upserted_ids), len(org.created)
+            third = etl.run_pipeline()
+            check("A run over unchanged inputs loads nothing",
+                  third['success'] and loaded_since(upserted, created) == ([], []), loaded_since(upserted, created))
+        finally:
+            os.chdir(cwd)
+    
+    server.shutdown()
+    print("\n" + "="*60)
+    print("OFFLINE LOAD TEST COMPLETE")
+    print("="*60)
+
 if __name__ == "__main__":
-    test_load()
\ No newline at end of file
+    # --offline runs the load paths against local fakes instead of a Salesforce org
+    if '--offline' in sys.argv:
+        test_load_offline()
+    else:
+        test_load()
\ No newline at end of file
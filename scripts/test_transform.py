@@ -68,10 +68,59 @@ def test_transform():
                   f"(Score: {risk['Risk_Score__c']})")
             print(f"         Factors: {risk['Risk_Factors__c'][:80]}...")
     
+    # Parity check: batch engine vs the per-patient reference implementation
+    print("\n5. Checking batch risk engine parity...")
+    failed_checks = []
+    reference_risks = [
+        risk_calc.calculate_patient_risk(
+            patient.get('patient_id') or patient.get('Patient_ID__c'), lab_results, conditions
+        )
+        for patient in patients
+        if patient.get('patient_id') or patient.get('Patient_ID__c')
+    ]
+    mismatches = [
+        (expected, actual) for expected, actual in zip(reference_risks, risk_assessments)
+        if expected != actual
+    ]
+    if len(reference_risks) == len(risk_assessments) and not mismatches:
+        print(f"   ✅ Batch engine matches per-patient scoring for {len(reference_risks)} patients")
+    else:
+        print(f"   ❌ Batch engine mismatch: {len(mismatches)} differing assessments")
+        failed_checks.append("batch risk engine parity")
+        for expected, actual in mismatches[:3]:
+            print(f"      expected: {expected}")
+            print(f"      actual:   {actual}")
+    
+    # The default rule set scores no trends: rising draws score as the labs alone did before
+    print("\n6. Checking default rules on rising A1C draws...")
+    rising_labs = [
+        {'patient_id': 'TREND-1', 'test_type': 'A1C', 'value': value, 'status': 'Normal', 'test_datetime': when}
+        for value, when in [(5.8, '2023-01-10T09:00:00'), (6.2, '2023-07-10T09:00:00'),
+                            (6.9, '2024-01-10T09:00:00')]
+    ]
+    baseline = {
+        'Risk_Level__c': 'High',
+        'Risk_Score__c': 40,
+        'Risk_Factors__c': 'Pre-diabetic A1C: 5.8; Pre-diabetic A1C: 6.2; Elevated A1C: 6.9'
+    }
+    trend_risks = [
+        risk_calc.calculate_patient_risk('TREND-1', rising_labs),
+        risk_calc.calculate_all_patient_risks([{'patient_id': 'TREND-1'}], rising_labs)[0]
+    ]
+    if all({field: risk[field] for field in baseline} == baseline for risk in trend_risks):
+        print(f"   ✅ Default rules ({risk_calc.rules.version}) give the baseline score of {baseline['Risk_Score__c']}")
+    else:
+        print(f"   ❌ Default rules changed the baseline score: {trend_risks}")
+        failed_checks.append("default rules on rising A1C draws")
+    
     print("\n" + "="*50)
     print("TRANSFORMATION TEST COMPLETE")
     print("="*50)
     
+    if failed_checks:
+        # Exit non-zero so scripted runs notice scoring differences
+        sys.exit(f"Failed checks: {', '.join(failed_checks)}")
+    
     # Return data for potential use
     return {
         'patients': valid_patients,
@@ -1,3 +1,4 @@
 from .logger import setup_logger
+from .frames import concat_frames, decimal_floats, frame_to_records
 
-__all__ = ['setup_logger']
\ No newline at end of file
+__all__ = ['setup_logger', 'concat_frames', 'decimal_floats', 'frame_to_records']
\ No newline at end of file
@@ -0,0 +1,64 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def decimal_floats(col: pd.Series) -> pd.Series:
+    """
+    Widen a float32 column to float64 via its shortest decimal repr
+    e.g. float32 6.7 becomes 6.7 rather than 6.699999809265137.
+    """
+    if col.dtype != np.float32:
+        return col
+    return col.astype(str).astype('float64')
+
+
+def concat_frames(frames: List[pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+    """
+    Concatenate typed frames, keeping categoricals (union of categories)
+    Returns an empty frame with the given columns if there are no frames.
+    """
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    if len(frames) == 1:
+        return frames[0]
+
+    for name in frames[0].columns:
+        if isinstance(frames[0][name].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([f[name] for f in frames]).categories
+            for frame in frames:
+                frame[name] = frame[name].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def frame_to_records(df: pd.DataFrame, datetime_format: str = DATETIME_FORMAT) -> List[Dict]:
+    """
+    Convert a columnar batch to row dicts at a serialization boundary
+    Datetimes become strings, float32 values keep their short decimal form
+    and missing values become None so rows are JSON/REST safe.
+    """
+    if df is None or df.empty:
+        return []
+
+    columns = {}
+    for name in df.columns:
+        col = df[name]
+
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            col = col.astype(object)
+
+        if pd.api.types.is_datetime64_any_dtype(col):
+            values = col.dt.strftime(datetime_format).astype(object)
+        elif col.dtype == np.float32:
+            values = decimal_floats(col).astype(object)
+        else:
+            values = col.astype(object)
+
+        columns[name] = values.where(pd.notna(values), None).tolist()
+
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]